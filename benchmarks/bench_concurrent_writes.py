@@ -0,0 +1,180 @@
+"""
+Latency & failures of the webserver's writes to QueryInfo (status updates & new queries) while the notifier
+flushes the status of every query (QueryStateWriter), each in its own process like in production.
+Compares SQLite with a rollback journal, Tortoise's defaults (WAL) & the tuned pragmas (SQLITE_PRAGMAS),
+and the DB of a db_url given as argument (e.g. a local PostgreSQL).
+
+--redis: the notifier writes the next check time of every query to Redis (ScheduleStateWriter) on every flush as well,
+needs a Redis server on localhost:6379 (or REDIS_HOST), only the key 'bench_concurrent_writes:schedule' is touched
+
+run from the repository root:
+    python -m benchmarks.bench_concurrent_writes [db_url] [--redis]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import redis.asyncio as redisaio
+from tortoise import Tortoise
+
+from config.config import SQLITE_PRAGMAS
+from src.shared.models import QueryInfo, QueryStatus
+from src.shared.schedule_state import ScheduleStateWriter
+from src.marketplace_notifier.query_state_writer import QueryStateWriter
+
+QUERIES = 2_000
+TICKS = 30  # notifier flushes, every one updates all queries
+TICK_INTERVAL = 0.05
+API_WRITES = 400
+SCHEDULE_KEY = "bench_concurrent_writes:schedule"
+
+
+def request_url(i: int) -> str:
+    return f"https://www.2dehands.be/lrp/api/search?limit=100&offset=0&query=benchmark+{i}"
+
+
+async def setup_db(db_url: str) -> None:
+    await Tortoise.init(db_url=db_url, modules={"models": ["src.shared.models"]})
+    await Tortoise.generate_schemas()
+    await QueryInfo.all().delete()
+    await QueryInfo.bulk_create([
+        QueryInfo(browser_url=f"https://www.2dehands.be/q/benchmark+{i}/", request_url=request_url(i))
+        for i in range(QUERIES)
+    ])
+    await Tortoise.close_connections()
+
+
+async def notifier_ticks(db_url: str, with_redis: bool):
+    """
+    :return: the duration (ms) of every successful flush & the amount of failed flushes
+    """
+    await Tortoise.init(db_url=db_url, modules={"models": ["src.shared.models"]})
+    redis_client = redisaio.StrictRedis(host=os.getenv("REDIS_HOST", "localhost")) if with_redis else None
+    schedule_state = ScheduleStateWriter(redis_client, key=SCHEDULE_KEY) if with_redis else None
+    query_state_writer = QueryStateWriter()
+    durations, errors = [], 0
+    try:
+        for tick in range(TICKS):
+            status = QueryStatus.FAILED if tick % 2 else QueryStatus.ACTIVE
+            next_check_time = datetime.now() + timedelta(minutes=2, seconds=tick)
+            for i in range(QUERIES):
+                query_state_writer.set_status(request_url(i), status)
+                if schedule_state is not None:
+                    schedule_state.set_next_check_time(request_url(i), next_check_time)
+            start = time.perf_counter()
+            try:
+                await query_state_writer.flush()
+                if schedule_state is not None:
+                    await schedule_state.flush()
+                durations.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                # the updates are retried on the next flush, like in the notifier
+                errors += 1
+            await asyncio.sleep(TICK_INTERVAL)
+    finally:
+        await Tortoise.close_connections()
+        if redis_client is not None:
+            await redis_client.delete(SCHEDULE_KEY)
+            await redis_client.aclose()
+    return durations, errors
+
+
+def run_notifier(db_url: str, with_redis: bool, results) -> None:
+    import logging
+    logging.disable(logging.INFO)
+    results.put(asyncio.run(notifier_ticks(db_url, with_redis)))
+
+
+async def api_writes(db_url: str, notifier: multiprocessing.Process):
+    """
+    :return: the latency (ms) of every successful write & the amount of failed writes
+    """
+    await Tortoise.init(db_url=db_url, modules={"models": ["src.shared.models"]})
+    latencies, errors = [], 0
+    try:
+        ids = await QueryInfo.all().limit(API_WRITES).values_list("id", flat=True)
+        i = 0
+        while notifier.is_alive() or i < API_WRITES // 4:
+            start = time.perf_counter()
+            try:
+                if i % 4:
+                    status = QueryStatus.FAILED if i % 2 else QueryStatus.ACTIVE
+                    await QueryInfo.filter(id=ids[i % len(ids)]).update(status=status)
+                else:
+                    await QueryInfo.create(browser_url=f"https://www.2dehands.be/q/api+{i}/",
+                                           request_url=f"https://www.2dehands.be/lrp/api/search?query=api+{i}")
+                latencies.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                errors += 1
+            i += 1
+            await asyncio.sleep(0.005)
+    finally:
+        await Tortoise.close_connections()
+    return latencies, errors
+
+
+def measure(db_url: str, with_redis: bool):
+    """
+    :return: (write latencies, failed writes) of the API & (flush durations, failed flushes) of the notifier
+    """
+    asyncio.run(setup_db(db_url))
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    notifier = context.Process(target=run_notifier, args=(db_url, with_redis, results))
+    notifier.start()
+    api = asyncio.run(api_writes(db_url, notifier))
+    notifier.join()
+    return api, results.get(timeout=10)
+
+
+def percentile(values, p: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else float("nan")
+    return statistics.quantiles(values, n=100)[p - 1]
+
+
+async def redis_available() -> bool:
+    redis_client = redisaio.StrictRedis(host=os.getenv("REDIS_HOST", "localhost"))
+    try:
+        await redis_client.ping()
+        return True
+    except redisaio.ConnectionError as e:
+        print(f"Can't connect to Redis ({e}), start a local Redis server first.")
+        return False
+    finally:
+        await redis_client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db_url", nargs="?", help="another DB to compare with, e.g. a local PostgreSQL")
+    parser.add_argument("--redis", action="store_true", help="write the schedule to Redis on every flush as well")
+    args = parser.parse_args()
+    if args.redis and not asyncio.run(redis_available()):
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        db_urls = {
+            "sqlite, rollback journal": f"sqlite://{Path(tmp) / 'delete.sqlite3'}?journal_mode=DELETE",
+            "sqlite, Tortoise defaults": f"sqlite://{Path(tmp) / 'default.sqlite3'}",
+            "sqlite, SQLITE_PRAGMAS": f"sqlite://{Path(tmp) / 'tuned.sqlite3'}?{SQLITE_PRAGMAS}",
+        }
+        if args.db_url:
+            db_urls[args.db_url.split(":", 1)[0]] = args.db_url
+
+        print(f"{QUERIES} queries, {TICKS} notifier flushes, in ms")
+        print(f"{'':>26} {'API writes':>10} {'failed':>7} {'p50':>7} {'p99':>8}"
+              f" {'flushes':>8} {'failed':>7} {'p50':>7} {'p99':>8}")
+        for name, db_url in db_urls.items():
+            (latencies, api_errors), (durations, flush_errors) = measure(db_url, args.redis)
+            print(f"{name:>26} {len(latencies):>10} {api_errors:>7} {percentile(latencies, 50):>7.2f} "
+                  f"{percentile(latencies, 99):>8.2f} {len(durations):>8} {flush_errors:>7} "
+                  f"{percentile(durations, 50):>7.2f} {percentile(durations, 99):>8.2f}")
+
+if __name__ == "__main__":
+    main()
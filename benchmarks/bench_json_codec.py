@@ -0,0 +1,37 @@
+"""
+json module vs json_codec (with the backend that's installed) on a realistic 100 listing search response:
+decoding the API response & encoding the Redis "listings" message.
+
+run from the repository root (install orjson or msgspec to see the difference):
+    python -m benchmarks.bench_json_codec
+"""
+import json
+import timeit
+
+from src.shared import json_codec
+from tests.payloads import make_search_response
+
+ROUNDS = 300
+
+
+def main():
+    response = make_search_response(newest_item_id=2_154_316_958)
+    body = json.dumps(response, ensure_ascii=False).encode("utf-8")
+    message = {"request_url": "https://www.2dehands.be/lrp/api/search?query=iphone", "new_listings": response["listings"]}
+    assert json_codec.loads(body) == json.loads(body)
+    assert json.loads(json_codec.dumps(message)) == json.loads(json.dumps(message))
+
+    print(f"json_codec backend: {json_codec.BACKEND}, response of {len(body) / 1024:.0f} KiB")
+    cases = {
+        "decode search response": (lambda: json.loads(body), lambda: json_codec.loads(body)),
+        "encode listings message": (lambda: json.dumps(message), lambda: json_codec.dumps(message)),
+    }
+    for name, (stdlib, codec) in cases.items():
+        stdlib_time = timeit.timeit(stdlib, number=ROUNDS) / ROUNDS
+        codec_time = timeit.timeit(codec, number=ROUNDS) / ROUNDS
+        print(f"{name}:\n  json        {stdlib_time * 1e6:8.0f} µs\n"
+              f"  json_codec  {codec_time * 1e6:8.0f} µs ({stdlib_time / codec_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
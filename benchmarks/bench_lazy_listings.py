@@ -0,0 +1,53 @@
+"""
+CPU time & peak memory of handling one polled search response:
+parsing the whole response (json.loads) vs only projecting the fields needed to diff (parse_listings_lazily).
+
+run from the repository root:
+    python -m benchmarks.bench_lazy_listings
+"""
+import json
+import timeit
+import tracemalloc
+
+from src.marketplace_notifier.lazy_listings import parse_listings_lazily, materialise_listing
+from src.marketplace_notifier.listing_diff import ListingDiff
+from tests.payloads import make_search_response
+
+ROUNDS = 500
+
+
+def full_parse(body: bytes, latest_item_id: int):
+    listings = json.loads(body)["listings"]
+    return ListingDiff().diff(listings, latest_item_id).new_listings
+
+
+def lazy_parse(body: bytes, latest_item_id: int):
+    listings = parse_listings_lazily(body)
+    return [materialise_listing(li) for li in ListingDiff().diff(listings, latest_item_id).new_listings]
+
+
+def peak_memory(function, *args) -> int:
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    response = make_search_response(newest_item_id=2_154_316_958)
+    body = json.dumps(response, ensure_ascii=False).encode("utf-8")
+    non_ads = [li for li in response["listings"] if li["priorityProduct"] == "NONE"]
+    print(f"response of {len(body) / 1024:.0f} KiB with {len(response['listings'])} listings")
+
+    for scenario, latest_item_id in {"idle (no new listings)": int(non_ads[0]["itemId"][1:]),
+                                     "3 new listings": int(non_ads[3]["itemId"][1:])}.items():
+        assert full_parse(body, latest_item_id) == lazy_parse(body, latest_item_id)
+        print(f"{scenario}:")
+        for name, function in (("json.loads", full_parse), ("parse_listings_lazily", lazy_parse)):
+            seconds = timeit.timeit(lambda: function(body, latest_item_id), number=ROUNDS) / ROUNDS
+            print(f"  {name:<22} {seconds * 1e6:8.0f} µs   peak {peak_memory(function, body, latest_item_id) / 1024:6.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Micro-benchmark of the listing diff: the old filter & sort comprehension from process_listings vs ListingDiff,
+on a realistic page of 100 listings.
+
+run from the repository root:
+    python -m benchmarks.bench_listing_diff
+"""
+import timeit
+
+from src.marketplace_notifier.listing_diff import ListingDiff, parse_item_id
+from src.marketplace_notifier.seen_window import SeenWindow
+from tests.payloads import make_listings
+
+ROUNDS = 20_000
+
+
+def old_diff(listings, latest_listing_id):
+    new_listings = [
+        listing for listing in listings
+        if listing["priorityProduct"] == "NONE" and int(listing["itemId"][1:]) > latest_listing_id
+    ]
+    new_listings.sort(key=lambda li: int(li["itemId"][1:]), reverse=True)
+    return new_listings
+
+
+def main():
+    listings = make_listings(newest_item_id=2_154_316_958)
+    non_ads = [li for li in listings if li["priorityProduct"] == "NONE"]
+    scenarios = {
+        "idle (no new listings)": parse_item_id(non_ads[0]["itemId"]),
+        "3 new listings": parse_item_id(non_ads[3]["itemId"]),
+        "first poll (all new)": 0,
+    }
+    diffs = {
+        "ListingDiff()": ListingDiff(),
+        "ListingDiff(early_stop_after=10)": ListingDiff(early_stop_after=10),
+    }
+
+    print(f"{ROUNDS} diffs of a {len(listings)} listing page, µs per diff")
+    for scenario, latest_item_id in scenarios.items():
+        old = timeit.timeit(lambda: old_diff(listings, latest_item_id), number=ROUNDS) / ROUNDS * 1e6
+        print(f"{scenario}:\n  {'old filter & sort':<34} {old:7.2f}")
+        for name, listing_diff in diffs.items():
+            assert listing_diff.diff(listings, latest_item_id).new_listings == old_diff(listings, latest_item_id)
+            new = timeit.timeit(lambda: listing_diff.diff(listings, latest_item_id), number=ROUNDS) / ROUNDS * 1e6
+            print(f"  {name:<34} {new:7.2f} ({old / new:.1f}x)")
+
+        # everything up to the latest item ID was seen before
+        seen_window = SeenWindow(256, sorted(
+            parse_item_id(li["itemId"]) for li in non_ads if parse_item_id(li["itemId"]) <= latest_item_id
+        ))
+        if seen_window:
+            listing_diff = ListingDiff()
+            assert listing_diff.diff(listings, latest_item_id, seen_window).new_listings == old_diff(listings, latest_item_id)
+            new = timeit.timeit(lambda: listing_diff.diff(listings, latest_item_id, seen_window), number=ROUNDS) / ROUNDS * 1e6
+            print(f"  {'ListingDiff() + SeenWindow(256)':<34} {new:7.2f} ({old / new:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Micro-benchmark of fanning a page out to many subscriptions: matching every listing against every filter one by one
+vs evaluate_filters (columns extracted once, every distinct predicate evaluated once), on a page of 100 listings.
+
+run from the repository root:
+    python -m benchmarks.bench_local_filters
+"""
+import random
+import timeit
+
+from src.marketplace_notifier.local_filters import compile_filter, evaluate_filters, selected
+from tests.payloads import make_listings
+
+ROUNDS = 20
+
+
+def make_filters(amount, seed=0):
+    """
+    subscriptions like users add them: a handful of price ranges & distances, sometimes a keyword
+    """
+    rng = random.Random(seed)
+    filters = {}
+    for i in range(amount):
+        filters[i] = compile_filter(
+            min_price_cents=rng.choice([None, 10_000, 25_000, 50_000]),
+            max_price_cents=rng.choice([None, 60_000, 100_000, 125_000]),
+            max_distance_meters=rng.choice([None, 10_000, 25_000, 50_000, 100_000]),
+            seller_verified=rng.choice([None, None, None, True]),
+            keywords=rng.choice([(), (), ("wit",), ("zwart",), ("256gb",)]),
+        )
+    return filters
+
+
+def one_by_one(listings, filters):
+    return {key: [listing for listing in listings if f.matches(listing)] for key, f in filters.items()}
+
+
+def main():
+    listings = make_listings(newest_item_id=2_154_316_958)
+    print(f"{len(listings)} listings, ms per page")
+    for amount in (10, 100, 1_000, 5_000):
+        filters = make_filters(amount)
+        masks = evaluate_filters(listings, filters)
+        assert {key: selected(listings, mask) for key, mask in masks.items()} == one_by_one(listings, filters)
+
+        old = timeit.timeit(lambda: one_by_one(listings, filters), number=ROUNDS) / ROUNDS * 1e3
+        new = timeit.timeit(lambda: evaluate_filters(listings, filters), number=ROUNDS) / ROUNDS * 1e3
+        print(f"{amount:>5} filters: one by one {old:8.2f}, evaluate_filters {new:6.2f} ({old / new:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
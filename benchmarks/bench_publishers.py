@@ -0,0 +1,69 @@
+"""
+Throughput of the notifier's outputs against a local Redis server: PUBLISH (PubSubPublisher) vs XADD with
+approximate trimming (StreamPublisher) vs XADD with exact trimming, with 1 message in flight & with many at once
+(like MAX_CONCURRENT_QUERIES queries publishing at the same time).
+The messages are "listings" messages of 3 new listings.
+
+needs a Redis server on localhost:6379 (or REDIS_HOST), only keys starting with 'bench_publishers:' are touched
+run from the repository root:
+    python -m benchmarks.bench_publishers
+"""
+import asyncio
+import os
+import time
+
+import redis.asyncio as redisaio
+
+from src.shared import json_codec
+from src.marketplace_notifier.publishers import PubSubPublisher, StreamPublisher, STREAM_MESSAGE_FIELD
+from tests.payloads import make_listings
+
+MESSAGES = 20_000
+CONCURRENCY = [1, 8, 64]
+CHANNEL = "bench_publishers:listings"
+STREAM_MAXLEN = 10_000
+
+
+class ExactStreamPublisher(StreamPublisher):
+    async def publish(self, channel, message):
+        await self.redis_client.xadd(channel, {STREAM_MESSAGE_FIELD: message}, maxlen=self.maxlen, approximate=False)
+
+
+async def messages_per_second(publisher, message, concurrency):
+    async def worker(amount):
+        for _ in range(amount):
+            await publisher.publish(CHANNEL, message)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(MESSAGES // concurrency) for _ in range(concurrency)))
+    return MESSAGES // concurrency * concurrency / (time.perf_counter() - start)
+
+
+async def main():
+    redis_client = redisaio.StrictRedis(host=os.getenv("REDIS_HOST", "localhost"),
+                                        max_connections=max(CONCURRENCY))
+    try:
+        await redis_client.ping()
+    except redisaio.ConnectionError as e:
+        print(f"Can't connect to Redis ({e}), start a local Redis server first.")
+        return
+
+    message = json_codec.dumps({"request_url": "https://www.2dehands.be/lrp/api/search?query=iphone",
+                                "new_listings": make_listings(newest_item_id=2_154_316_958, amount=3)})
+    print(f"{MESSAGES} messages of {len(message)} bytes, messages per second")
+    print(f"{'in flight':>10} {'PUBLISH':>10} {'XADD ~':>10} {'XADD =':>10}")
+    try:
+        for concurrency in CONCURRENCY:
+            results = []
+            for publisher in (PubSubPublisher(redis_client), StreamPublisher(redis_client, STREAM_MAXLEN),
+                              ExactStreamPublisher(redis_client, STREAM_MAXLEN)):
+                await redis_client.delete(CHANNEL)
+                results.append(await messages_per_second(publisher, message, concurrency))
+            print(f"{concurrency:>10} " + " ".join(f"{result:>10,.0f}" for result in results))
+    finally:
+        await redis_client.delete(CHANNEL)
+        await redis_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
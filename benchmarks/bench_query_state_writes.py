@@ -0,0 +1,68 @@
+"""
+Compares writing the notifier's status updates (e.g. FAILED) one UPDATE at a time (the old way)
+with the batched QueryStateWriter (one transaction per flush), on a SQLite file.
+The next check times aren't written to the DB anymore, see bench_schedule_writes.py.
+
+run from the repository root:
+    python -m benchmarks.bench_query_state_writes
+"""
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from tortoise import Tortoise
+
+from src.shared.models import QueryInfo, QueryStatus
+from src.marketplace_notifier.query_state_writer import QueryStateWriter
+
+QUERY_COUNTS = [100, 1_000, 10_000]
+
+
+def request_url(i: int) -> str:
+    return f"https://www.2dehands.be/lrp/api/search?limit=100&offset=0&query=benchmark+{i}"
+
+
+async def setup_db(db_path: Path, amount: int) -> None:
+    await Tortoise.init(db_url=f"sqlite://{db_path}", modules={"models": ["src.shared.models"]})
+    await Tortoise.generate_schemas()
+    await QueryInfo.bulk_create([
+        QueryInfo(browser_url=f"https://www.2dehands.be/q/benchmark+{i}/", request_url=request_url(i))
+        for i in range(amount)
+    ], batch_size=500)
+
+
+async def per_query_updates(amount: int, status: QueryStatus) -> None:
+    for i in range(amount):
+        await QueryInfo.filter(request_url=request_url(i)).update(status=status)
+
+
+async def batched_updates(amount: int, status: QueryStatus) -> None:
+    writer = QueryStateWriter()
+    for i in range(amount):
+        writer.set_status(request_url(i), status)
+    await writer.flush()
+
+
+async def main():
+    print(f"{'queries':>8} | {'per query UPDATE':>17} | {'batched (1 tx)':>15} | speedup")
+    for amount in QUERY_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            await setup_db(Path(tmp_dir) / "bench.sqlite3", amount)
+
+            start = time.perf_counter()
+            await per_query_updates(amount, QueryStatus.FAILED)
+            per_query = time.perf_counter() - start
+
+            start = time.perf_counter()
+            await batched_updates(amount, QueryStatus.ACTIVE)
+            batched = time.perf_counter() - start
+
+            assert await QueryInfo.filter(status=QueryStatus.ACTIVE).count() == amount
+            await Tortoise.close_connections()
+
+        print(f"{amount:>8} | {per_query:>16.3f}s | {batched:>14.3f}s | {per_query / batched:>6.1f}x")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
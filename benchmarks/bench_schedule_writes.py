@@ -0,0 +1,85 @@
+"""
+Compares writing the notifier's per-cycle next check times one UPDATE of QueryInfo.next_check_time at a time
+(the old way, on a SQLite file) with the ScheduleStateWriter (one pipeline to the sorted set in Redis per flush).
+
+needs a Redis server on localhost:6379 (or REDIS_HOST), only the key 'bench_schedule_writes:schedule' is touched
+
+run from the repository root:
+    python -m benchmarks.bench_schedule_writes
+"""
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import redis.asyncio as redisaio
+from tortoise import Tortoise
+
+from src.shared.models import QueryInfo
+from src.shared.schedule_state import ScheduleStateWriter
+
+QUERY_COUNTS = [100, 1_000, 10_000]
+SCHEDULE_KEY = "bench_schedule_writes:schedule"
+
+
+def request_url(i: int) -> str:
+    return f"https://www.2dehands.be/lrp/api/search?limit=100&offset=0&query=benchmark+{i}"
+
+
+async def setup_db(db_path: Path, amount: int) -> None:
+    await Tortoise.init(db_url=f"sqlite://{db_path}", modules={"models": ["src.shared.models"]})
+    await Tortoise.generate_schemas()
+    await QueryInfo.bulk_create([
+        QueryInfo(browser_url=f"https://www.2dehands.be/q/benchmark+{i}/", request_url=request_url(i))
+        for i in range(amount)
+    ], batch_size=500)
+
+
+async def per_query_updates(amount: int, next_check_time: datetime) -> None:
+    for i in range(amount):
+        await QueryInfo.filter(request_url=request_url(i)).update(next_check_time=next_check_time)
+
+
+async def batched_updates(writer: ScheduleStateWriter, amount: int, next_check_time: datetime) -> None:
+    for i in range(amount):
+        writer.set_next_check_time(request_url(i), next_check_time)
+    await writer.flush()
+
+
+async def main():
+    redis_client = redisaio.StrictRedis(host=os.getenv("REDIS_HOST", "localhost"))
+    try:
+        await redis_client.ping()
+    except redisaio.ConnectionError as e:
+        print(f"Can't connect to Redis ({e}), start a local Redis server first.")
+        return
+
+    print(f"{'queries':>8} | {'per query UPDATE':>17} | {'Redis pipeline':>15} | speedup")
+    try:
+        for amount in QUERY_COUNTS:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                await setup_db(Path(tmp_dir) / "bench.sqlite3", amount)
+                now = datetime.now()
+
+                start = time.perf_counter()
+                await per_query_updates(amount, now)
+                per_query = time.perf_counter() - start
+                await Tortoise.close_connections()
+
+            await redis_client.delete(SCHEDULE_KEY)
+            start = time.perf_counter()
+            await batched_updates(ScheduleStateWriter(redis_client, key=SCHEDULE_KEY), amount,
+                                  now + timedelta(minutes=2))
+            batched = time.perf_counter() - start
+            assert await redis_client.zcard(SCHEDULE_KEY) == amount
+
+            print(f"{amount:>8} | {per_query:>16.3f}s | {batched:>14.3f}s | {per_query / batched:>6.1f}x")
+    finally:
+        await redis_client.delete(SCHEDULE_KEY)
+        await redis_client.aclose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+"""
+Cache of the item details the webserver proxies (/item/<item_id>), so looking up the same listing again
+(e.g. by several Discord bots) doesn't cost another request to the rate-limited item API of 2dehands.
+"""
+import asyncio
+import logging
+import time
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.shared import json_codec
+from src.shared.api_utils import fetch_item_details, is_listing_not_found
+from src.shared.ttl_cache import TTLCache
+
+ItemDetailsResponse = Tuple[int, Optional[Dict[str, Any]]]  # see fetch_item_details
+
+
+class ItemDetailsCache:
+    """
+    The responses of fetch_item_details per item ID, in memory (LRU) & optionally in Redis,
+    so they're shared with other processes & survive a restart.
+
+    Besides the details, the answers which won't change soon are cached as well (negative caching):
+    404 (the item doesn't exist) for a long time & LISTING_NOT_FOUND (too soon for the details) for a few seconds.
+    Other errors (e.g. 403 when we're throttled) aren't cached.
+    Concurrent lookups of the same item ID share one request.
+    """
+
+    def __init__(self, retry_client, redis_client=None, max_entries: int = 2048, details_ttl: float = 5 * 60,
+                 not_found_ttl: float = 60 * 60, too_soon_ttl: float = 5, key_prefix: str = "item_details",
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        retry_client: client for the item API (app.2dehands.be)
+        redis_client: redis.asyncio client to share the cache with (None = in memory only)
+        details_ttl: seconds the details of an item are reused, the status of a listing (e.g. CLOSED) may change
+        not_found_ttl: seconds a 404 is reused
+        too_soon_ttl: seconds a LISTING_NOT_FOUND is reused
+        """
+        self.retry_client = retry_client
+        self.redis_client = redis_client
+        self.details_ttl = details_ttl
+        self.not_found_ttl = not_found_ttl
+        self.too_soon_ttl = too_soon_ttl
+        self.key_prefix = key_prefix
+        self.memory: TTLCache[str, ItemDetailsResponse] = TTLCache(max_entries, details_ttl, clock)
+        self.redis_hits = 0
+        self.fetches = 0
+        self.coalesced = 0  # lookups which waited for the request of another lookup
+        self._in_flight: Dict[str, "asyncio.Future[ItemDetailsResponse]"] = {}
+        self._using_redis = redis_client is not None
+
+    async def get(self, item_id: str) -> ItemDetailsResponse:
+        """
+        :return: the (cached) response of fetch_item_details for item_id
+        """
+        response = self.memory.get(item_id)
+        if response is not None:
+            return response
+
+        in_flight = self._in_flight.get(item_id)
+        if in_flight is not None:
+            self.coalesced += 1
+        else:
+            in_flight = self._in_flight[item_id] = asyncio.ensure_future(self._lookup(item_id))
+            in_flight.add_done_callback(lambda _: self._in_flight.pop(item_id, None))
+        # shielded: a lookup which gets cancelled (e.g. its client disconnected) doesn't cancel the others
+        return await asyncio.shield(in_flight)
+
+    async def _lookup(self, item_id: str) -> ItemDetailsResponse:
+        cached = await self._redis_get(item_id)
+        if cached is not None:
+            self.redis_hits += 1
+            response, remaining_ttl = cached
+            # another process cached it: it isn't written back, nor kept longer than it's cached in Redis
+            ttl = self._ttl(*response)
+            if ttl is not None:
+                self.memory.set(item_id, response, ttl if remaining_ttl is None else min(ttl, remaining_ttl))
+            return response
+
+        self.fetches += 1
+        response = await fetch_item_details(self.retry_client, item_id)
+        ttl = self._ttl(*response)
+        if ttl is not None:
+            self.memory.set(item_id, response, ttl)
+            await self._redis_set(item_id, response, ttl)
+        return response
+
+    def _ttl(self, status: int, details: Optional[Dict[str, Any]]) -> Optional[float]:
+        """
+        :return: seconds a response may be reused, None if it shouldn't be cached
+        """
+        if status == HTTPStatus.OK:
+            return self.details_ttl
+        if status == HTTPStatus.NOT_FOUND:
+            return self.not_found_ttl
+        if is_listing_not_found(status, details):
+            return self.too_soon_ttl
+        return None
+
+    async def _redis_get(self, item_id: str) -> Optional[Tuple[ItemDetailsResponse, Optional[float]]]:
+        """
+        :return: the cached response & the seconds it stays cached in Redis (None if it doesn't expire),
+        None if it isn't cached
+        """
+        if self.redis_client is None:
+            return None
+        key = self._key(item_id)
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.pttl(key)
+                cached, pttl = await pipe.execute()
+            self._redis_available()
+        except Exception as e:
+            self._redis_unavailable(e)
+            return None
+        if cached is None:
+            return None
+        cached = json_codec.loads(cached)
+        # pttl is negative if the key has no expiry (or expired since the GET)
+        return (cached["status"], cached["details"]), (pttl / 1000 if pttl >= 0 else None)
+
+    async def _redis_set(self, item_id: str, response: ItemDetailsResponse, ttl: float) -> None:
+        if self.redis_client is None:
+            return
+        status, details = response
+        try:
+            await self.redis_client.set(self._key(item_id), json_codec.dumps({"status": status, "details": details}),
+                                        px=int(ttl * 1000))
+            self._redis_available()
+        except Exception as e:
+            self._redis_unavailable(e)
+
+    def _key(self, item_id: str) -> str:
+        return f"{self.key_prefix}:{item_id}"
+
+    def _redis_available(self) -> None:
+        if not self._using_redis:
+            self._using_redis = True
+            logging.info("Item details cache: Redis is back, sharing the cache again.")
+
+    def _redis_unavailable(self, e: Exception) -> None:
+        if self._using_redis:
+            self._using_redis = False
+            logging.warning(f"Item details cache: Redis unavailable ({type(e).__name__} - {e}), "
+                            f"caching in memory only.")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.memory),
+            "memory_hits": self.memory.hits,
+            "redis_hits": self.redis_hits,
+            "coalesced": self.coalesced,
+            "fetches": self.fetches,
+        }
@@ -1,31 +1,77 @@
+import asyncio
 import json
+import logging
+import re
 import traceback
 import urllib.parse
 from pathlib import Path
-from typing import Optional
+from typing import Annotated, Any, Dict, List, Optional
 from urllib.parse import urlencode, quote_plus, unquote_plus
 
+import redis.asyncio as redisaio
 import tortoise
 from aiohttp import ClientResponseError
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, StringConstraints, field_validator
 from quart import Quart
+from quart.json.provider import DefaultJSONProvider
 from quart_schema import QuartSchema, RequestSchemaValidationError, validate_request, Info, document_response, \
     validate_querystring
 from tortoise import Tortoise
 from tortoise.contrib.quart import register_tortoise
 from tortoise.contrib.pydantic import pydantic_model_creator, pydantic_queryset_creator
+from tortoise.functions import Count
 
-from src.shared.constants import TWEEDEHANDS_BROWSER_URL_REGEX
-from src.shared.api_utils import get_retry_client
+from src.shared import json_codec
+from src.shared.constants import TWEEDEHANDS_BROWSER_URL_REGEX, ITEM_ID_REGEX, QUERY_CHANGES_CHANNEL
+from src.shared.api_utils import get_retry_client, is_listing_not_found
+from src.shared.connection_pool import ConnectionStats, ITEM_CONNECTOR_PROFILE
+from src.shared.rate_limiter import RateGovernor
 from src.shared.models import QueryInfo, QueryStatus
+from src.shared.schedule_state import get_next_check_times, get_scheduled_count
+from src.api.item_cache import ItemDetailsCache
 from config.config import config
 
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    serializes the responses with json_codec (orjson/msgspec when installed)
+    the output only differs from the DefaultJSONProvider in whitespace & non-ASCII characters not being escaped
+    """
+    compact = True  # also in debug mode, indented responses go through the (slow) json module
+
+    def __init__(self, app, fallback: DefaultJSONProvider):
+        """
+        fallback: the provider this one replaces, its default() is kept (e.g. QuartSchema serializes pydantic models)
+        """
+        super().__init__(app)
+        self.default = fallback.default
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.keys() - {"separators"}:
+            # e.g. indented responses in debug mode
+            return super().dumps(obj, **kwargs)
+        return json_codec.dumps_str(obj, default=self.default, sort_keys=self.sort_keys)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return json_codec.loads(s)
+
+
 app = Quart(__name__)
 app.rc = None
-API_VERSION = "1.3.7"  # always edit this in the README too
+app.redis = None
+app.item_cache = None
+MAX_BATCH_ITEMS = 100  # max item IDs per /item/batch request
+BATCH_CONCURRENCY = 4  # item details of a /item/batch request fetched at the same time (they share the request budget)
+app.connection_stats = ConnectionStats()
+API_VERSION = "1.5.0"  # always edit this in the README too
 QuartSchema(app, info=Info(title="Marketplace Monitor API", version=API_VERSION))
+app.json = FastJSONProvider(app, fallback=app.json)
 QueryInfo_Pydantic = pydantic_model_creator(QueryInfo)
 QueryInfo_Pydantic_List = pydantic_queryset_creator(QueryInfo)
+QUERY_FIELDS = tuple(QueryInfo._meta.fields_map)  # the fields a /query response can be projected on
+MAX_QUERY_PAGE_SIZE = 500  # max QueryInfos per /query page
 with open(Path(__file__).parent / "l1_categories.json", "r") as f:
     l1_category_dict = json.load(f)
 with open(Path(__file__).parent / "l2_categories.json", "r") as f:
@@ -38,16 +84,63 @@ async def startup():
         db_url=config["default_db_url"],
         modules={"models": ["src.shared.models"]}
     )
-    app.rc = get_retry_client()
+    app.redis = redisaio.StrictRedis(host=config["redis_host"])
+    # the /item requests share the request budget for 2dehands with the notifier
+    app.rc = get_retry_client(rate_governor=RateGovernor(app.redis), connector_profile=ITEM_CONNECTOR_PROFILE,
+                              connection_stats=app.connection_stats)
+    # the same listing is often looked up by several consumers (shared with other webserver processes through Redis)
+    app.item_cache = ItemDetailsCache(app.rc, app.redis)
 
 
 @app.after_serving
 async def close_db():
     await Tortoise.close_connections()
     await app.rc.close()
+    await app.redis.aclose()
+
+
+async def publish_query_change(action: str, query_info: QueryInfo) -> None:
+    """
+    lets the notifier know a query was added, deleted or got a new status
+    the DB stays the source of truth (the notifier also syncs with it periodically),
+    so a failing publish only gets logged & never fails the request
+    """
+    try:
+        await app.redis.publish(QUERY_CHANGES_CHANNEL, json_codec.dumps({
+            "action": action,
+            "id": query_info.id,
+            "request_url": query_info.request_url,
+            "status": query_info.status
+        }))
+    except Exception as e:
+        logging.warning(f"Couldn't publish query change ({action}) for query {query_info.id}: {type(e).__name__} - {e}")
+
+async def with_schedule(queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    fills in the next_check_time of the (dumped) QueryInfos from the notifier's schedule in Redis,
+    the DB column isn't updated anymore (when Redis is unavailable, the DB value is kept)
+    """
+    next_check_times = await get_next_check_times(app.redis, (query["request_url"] for query in queries))
+    if next_check_times is not None:
+        for query in queries:
+            query["next_check_time"] = next_check_times[query["request_url"]]
+    return queries
 
 class QueryArgs(BaseModel):
     request_url: Optional[str] = None
+    status: Optional[QueryStatus] = Field(None, description="only return the QueryInfos with this status")
+    limit: Optional[int] = Field(None, ge=1, le=MAX_QUERY_PAGE_SIZE,
+                                 description="max QueryInfos per page, ordered by id (none = all of them)")
+    cursor: Optional[int] = Field(None, description="next_cursor of the previous page")
+    fields: Optional[str] = Field(None, description=f"comma-separated fields to return, of {', '.join(QUERY_FIELDS)}"
+                                                    f" (none = all of them)")
+
+    @field_validator("fields")
+    @classmethod
+    def validate_fields(cls, fields: Optional[str]) -> Optional[str]:
+        if fields is not None and (unknown := set(fields.split(",")) - set(QUERY_FIELDS)):
+            raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+        return fields
 
 # Input model for validation
 class QueryData(BaseModel):
@@ -57,6 +150,18 @@ class QueryData(BaseModel):
 # response models (for OpenAPI documentation)
 class QueryInfoListResponse(BaseModel):
     queries: Optional[QueryInfo_Pydantic_List] = Field(description="List of QueryInfos in the database")
+    next_cursor: Optional[int] = Field(None, description="cursor of the next page, null on the last page")
+
+class QuerySummaryResponse(BaseModel):
+    total: int = Field(description="amount of QueryInfos in the database")
+    statuses: Dict[str, int] = Field(description="amount of QueryInfos per status")
+    scheduled: Optional[int] = Field(description="amount of queries the notifier(s) monitor, null if unknown")
+
+# input model for fetching the details of several items at once
+class ItemBatchData(BaseModel):
+    item_ids: List[Annotated[str, StringConstraints(pattern=ITEM_ID_REGEX)]] = Field(
+        ..., min_length=1, max_length=MAX_BATCH_ITEMS,
+        description="itemIds of the listings (e.g. m2141361524), duplicates are fetched once")
 
 # input model for updating QueryInfo status
 class UpdateQueryStatus(BaseModel):
@@ -163,8 +268,9 @@ async def create_query_by_link(data: QueryData):
     except Exception as e:
         raise e
 
+    await publish_query_change("added", qi)
     qi_py = await QueryInfo_Pydantic.from_tortoise_orm(qi)
-    return qi_py.model_dump(), 200
+    return (await with_schedule([qi_py.model_dump()]))[0], 200
 
 @app.post("/query/status")
 @validate_request(UpdateQueryStatus)
@@ -173,6 +279,8 @@ async def set_query_status(data: UpdateQueryStatus):
     updated_count = await QueryInfo.filter(id=data.id).update(status=data.status)
     if updated_count == 0:
         return {"error": "QueryInfo not found"}, 404
+    if qi := await QueryInfo.get_or_none(id=data.id):
+        await publish_query_change("status", qi)
     return {}, 204
 
 #TODO: add a test_request_url endpoint, which returns the X latest listings for a req URL
@@ -182,11 +290,47 @@ async def set_query_status(data: UpdateQueryStatus):
 @validate_querystring(QueryArgs)
 @document_response(model_class=QueryInfoListResponse)
 async def get_all_queries(query_args: QueryArgs):
+    # e.g. /query?status=ACTIVE&limit=100&fields=id,browser_url, then &cursor=<next_cursor> for the next page
+    queryset = QueryInfo.all().order_by("id")
     if request_url := query_args.request_url:
-        qi_py = await QueryInfo_Pydantic_List.from_queryset(QueryInfo.filter(request_url=request_url).all())
+        queryset = queryset.filter(request_url=request_url)
+    if query_args.status is not None:
+        queryset = queryset.filter(status=query_args.status)
+    if query_args.cursor is not None:
+        queryset = queryset.filter(id__gt=query_args.cursor)
+    if query_args.limit is not None:
+        # one more, to know whether there's a next page
+        queryset = queryset.limit(query_args.limit + 1)
+
+    if query_args.fields is None:
+        fields = None
+        queries = (await QueryInfo_Pydantic_List.from_queryset(queryset)).model_dump()
     else:
-        qi_py = await QueryInfo_Pydantic_List.from_queryset(QueryInfo.all())
-    return {"queries": qi_py.model_dump()}
+        # only what's asked is selected & serialized, the id is needed for the cursor
+        # & the request_url for the next_check_time
+        fields = list(dict.fromkeys(query_args.fields.split(",")))
+        selected = dict.fromkeys(["id", *fields, *(["request_url"] if "next_check_time" in fields else [])])
+        queries = await queryset.values(*selected)
+
+    next_cursor = None
+    if query_args.limit is not None and len(queries) > query_args.limit:
+        queries = queries[:query_args.limit]
+        next_cursor = queries[-1]["id"]
+    if fields is None or "next_check_time" in fields:
+        queries = await with_schedule(queries)
+    if fields is not None:
+        queries = [{field: query[field] for field in fields} for query in queries]
+    return {"queries": queries, "next_cursor": next_cursor}
+
+
+@app.get("/query/summary")
+@document_response(model_class=QuerySummaryResponse)
+async def get_query_summary():
+    # only counts, for dashboards polling the API
+    statuses = {status.value: 0 for status in QueryStatus}
+    for status, count in await QueryInfo.annotate(count=Count("id")).group_by("status").values_list("status", "count"):
+        statuses[QueryStatus(status).value] = count
+    return {"total": sum(statuses.values()), "statuses": statuses, "scheduled": await get_scheduled_count(app.redis)}
 
 
 @app.get("/query/<query_info_id>")
@@ -203,38 +347,62 @@ async def get_query_by_id(query_info_id: int):
     except Exception as e:
         raise e
     qi_py = await QueryInfo_Pydantic.from_tortoise_orm(qi)
-    return qi_py.model_dump()
+    return (await with_schedule([qi_py.model_dump()]))[0]
+
+def _item_details_error(status: int, json_response: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    :return: the error message for a response of the item details, None if it's not an error we explain
+    """
+    if status == 404:
+        return "Item Not Found"
+    # This error is raised when a listing exists, but you're fetching the details too soon.
+    # so retrying will most likely result in status 200
+    if is_listing_not_found(status, json_response):
+        return "Details of item not available yet, try again"
+    return None
+
 
 @app.get("/item/<item_id>")
 async def get_additional_listing_info(item_id: str):
-    url = f"https://app.2dehands.be/app/vip/v4/item/{item_id}"
-    headers = {"ecg-locale": "nl-BE", "content-type": "application/json"}
-
-
-    async with app.rc.post(url, headers=headers) as response:
-        status = response.status
-        if status == 404:
-            # "code" will be "NOT_FOUND"
-            return {
-                "error": "Item Not Found",
-            }, status
-        # status 403 means we're ratelimited by cloudfront
-
-        json_response = await response.json()
-    # This error is raised when a listing exists, but you're fetching the details too soon.
-    # so retrying will most likely result in status 200
-    if status == 400 and json_response["code"] == "LISTING_NOT_FOUND":
+    if not re.fullmatch(ITEM_ID_REGEX, item_id):
+        return {"error": f"Invalid item ID: {item_id}, expected e.g. m2141361524"}, 400
+    status, json_response = await app.item_cache.get(item_id)
+    if error := _item_details_error(status, json_response):
         return {
-            "error": "Details of item not available yet, try again",
+            "error": error,
         }, status
     # if ["metaData"]["adStatus"] == "CLOSED" => item is expired
     # the status can also be ACTIVE ofcourse
 
-    if json_response.get("recommendedItems"):
-        del json_response["recommendedItems"]
-
     return json_response, status
 
+# INPUT: {"item_ids": ["m2141361524", "m2141361525"]}
+# OUTPUT: {"items": {"m2141361524": {"status": 200, "details": {...}}, "m2141361525": {"status": 404, "error": "..."}}}
+@app.post("/item/batch")
+@validate_request(ItemBatchData)
+async def get_additional_listing_info_batch(data: ItemBatchData):
+    # one request instead of one /item/<item_id> per listing, every item ID gets its own status (& error)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def get_item(item_id: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                status, json_response = await app.item_cache.get(item_id)
+            except ClientResponseError as e:
+                return {"status": e.status, "error": type(e).__name__, "reason": str(e)}
+            except Exception as e:
+                logging.error(f"Failed to get the details of item {item_id}: {type(e).__name__} - {e}")
+                return {"status": 500, "error": "Unexpected error occurred", "reason": str(e)}
+        if error := _item_details_error(status, json_response):
+            return {"status": status, "error": error}
+        if status != 200:
+            return {"status": status, "error": "Unexpected response of 2dehands", "reason": json_response}
+        return {"status": status, "details": json_response}
+
+    item_ids = list(dict.fromkeys(data.item_ids))
+    items = await asyncio.gather(*(get_item(item_id) for item_id in item_ids))
+    return {"items": dict(zip(item_ids, items))}, 200
+
 @app.delete("/query/<query_info_id>")
 async def delete_query(query_info_id: int):
     try:
@@ -247,6 +415,7 @@ async def delete_query(query_info_id: int):
         raise e
 
     await query.delete()
+    await publish_query_change("deleted", query)
     return {"message": "Query deleted"}, 200
 
 
@@ -297,6 +466,13 @@ async def ping() -> str:
     return "pong"
 
 
+@app.get("/metrics")
+async def metrics():
+    # how well the connections to 2dehands (for /item) are reused & why requests were retried or failed
+    return {"connections": app.connection_stats.snapshot(), "retries": app.rc.retry_diagnostics.snapshot(),
+            "item_cache": app.item_cache.snapshot()}
+
+
 register_tortoise(
     app,
     db_url=config["default_db_url"],
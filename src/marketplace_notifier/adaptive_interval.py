@@ -0,0 +1,95 @@
+import time
+from typing import Dict, NamedTuple, Optional
+
+
+class _Velocity(NamedTuple):
+    rate: Optional[float]  # smoothed new listings per second, None until the second poll
+    last_poll: float  # monotonic time of the previous poll
+
+
+class AdaptiveIntervalPolicy:
+    """
+    Polling interval per query, based on how fast it gets new listings (its velocity):
+    a query is polled about once per target_new_listings new listings, within [min_interval, max_interval].
+    So busy queries are polled more often & quiet ones free up requests.
+
+    With a request budget, all intervals are stretched by the same factor when together they'd make
+    more requests per minute than the budget, the budget wins over max_interval.
+    """
+
+    def __init__(self, base_interval: float, min_interval: float, max_interval: float,
+                 requests_per_minute: Optional[float] = None, target_new_listings: float = 1.0,
+                 smoothing: float = 0.3):
+        """
+        base_interval: seconds between polls of a query we know nothing about yet
+        min_interval & max_interval: bounds in seconds of an interval (before applying the request budget)
+        requests_per_minute: budget of all queries together (None = no budget)
+        smoothing: weight of the latest poll in the velocity (exponentially weighted moving average)
+        """
+        if not 0 < min_interval <= base_interval <= max_interval:
+            raise ValueError("Expected 0 < min_interval <= base_interval <= max_interval")
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.requests_per_minute = requests_per_minute
+        self.target_new_listings = target_new_listings
+        self.smoothing = smoothing
+        self._velocities: Dict[str, _Velocity] = {}
+        self._intervals: Dict[str, float] = {}  # interval per request URL, without the budget applied
+        self._demand = 0.0  # requests per minute of all intervals together, without the budget applied
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    def record_poll(self, request_url: str, new_listings: int, now: Optional[float] = None) -> None:
+        """
+        Update the velocity of a query with the amount of new listings found by a poll.
+        The first poll of a query only sets the starting point (its diff doesn't tell how fast listings come in).
+        """
+        now = time.monotonic() if now is None else now
+        velocity = self._velocities.get(request_url)
+        if velocity is None:
+            self._velocities[request_url] = _Velocity(None, now)
+            self._set_interval(request_url, self.base_interval)
+            return
+
+        elapsed = max(now - velocity.last_poll, 1e-3)
+        rate = new_listings / elapsed
+        if velocity.rate is not None:
+            rate = self.smoothing * rate + (1 - self.smoothing) * velocity.rate
+        self._velocities[request_url] = _Velocity(rate, now)
+
+        interval = self.target_new_listings / rate if rate > 0 else self.max_interval
+        self._set_interval(request_url, min(max(interval, self.min_interval), self.max_interval))
+
+    def interval(self, request_url: str) -> float:
+        """
+        :return: seconds until the next poll of a query, with the request budget applied
+        """
+        interval = self._intervals.get(request_url)
+        if interval is None:
+            interval = self._set_interval(request_url, self.base_interval)
+        return interval * self.budget_factor
+
+    @property
+    def budget_factor(self) -> float:
+        """
+        factor (>= 1) by which all intervals are stretched to stay within the request budget
+        """
+        if self.requests_per_minute is None or self._demand <= self.requests_per_minute:
+            return 1.0
+        return self._demand / self.requests_per_minute
+
+    def remove(self, request_url: str) -> None:
+        self._velocities.pop(request_url, None)
+        if self._intervals.pop(request_url, None) is not None:
+            # recalculated instead of subtracted, so rounding errors don't add up
+            self._demand = sum(60 / interval for interval in self._intervals.values())
+
+    def _set_interval(self, request_url: str, interval: float) -> float:
+        previous = self._intervals.get(request_url)
+        if previous is not None:
+            self._demand -= 60 / previous
+        self._intervals[request_url] = interval
+        self._demand += 60 / interval
+        return interval
@@ -0,0 +1,179 @@
+"""
+Multi-worker mode: the monitored queries are shared by several notifier processes (workers) through Redis.
+
+- Membership: every worker adds a heartbeat to a sorted set (worker ID => time of its last heartbeat).
+  A worker which didn't send one for worker_ttl seconds is considered dead & dropped.
+- Partitioning: a query belongs to the live worker with the highest rendezvous hash for its shard key,
+  so every worker computes the same owner without coordinating and only the queries of a joining or dying worker move.
+  Queries which are coalesced (see split_request_url) have the same shard key, so they stay on the same worker.
+- Leases: the workers' views of the membership can differ for a moment (between heartbeats), so a worker only
+  polls a query while it holds the lease of its shard key (SET NX PX), which it renews with every heartbeat.
+  A worker releases the leases of the queries it gave away (once their fetches in progress are done & their state
+  is flushed), the leases of a dead worker expire after lease_ttl.
+  So a query is never polled by two workers at once & always ends up with a live worker.
+
+The workers have to share the notifier's DB (the latest listings), so the new owner of a query continues
+where the previous one stopped.
+"""
+import hashlib
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Set
+
+from src.marketplace_notifier.query_coalescing import split_request_url
+
+# KEYS[1]: lease, ARGV: worker ID, lease ttl (ms)  => 1 if the worker holds the lease (now)
+_ACQUIRE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner == false or owner == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# KEYS[1]: lease, ARGV: worker ID  => 1 if the worker held the lease
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def shard_key(request_url: str) -> str:
+    """
+    the key a query is partitioned on: its broader search, so queries which can be coalesced end up together
+    """
+    return split_request_url(request_url)[0]
+
+
+def _score(worker_id: str, key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{worker_id}\0{key}".encode(), digest_size=8).digest(), "big")
+
+
+def rendezvous_owner(key: str, workers: Iterable[str]) -> Optional[str]:
+    """
+    Highest random weight hashing: the worker with the highest hash for the key, None if there are no workers.
+    When a worker leaves, only its keys move (each to the worker with the next highest hash).
+    """
+    return max(workers, key=lambda worker_id: _score(worker_id, key), default=None)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class NotifierCluster:
+    """
+    The membership & leases of this worker, see the module docstring.
+    """
+
+    def __init__(self, redis_client, worker_id: Optional[str] = None, heartbeat_interval: float = 5,
+                 worker_ttl: float = 15, lease_ttl: float = 30, key_prefix: str = "notifier"):
+        """
+        worker_ttl: seconds without a heartbeat after which a worker is considered dead,
+        should be a few heartbeat_intervals (the clocks of the workers shouldn't differ more than that)
+        lease_ttl: seconds a lease stays valid without being renewed, how long the queries of a dead worker aren't polled
+        """
+        self.redis_client = redis_client
+        self.worker_id = worker_id or default_worker_id()
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_ttl = worker_ttl
+        self.lease_ttl = lease_ttl
+        self.key_prefix = key_prefix
+        self.workers: List[str] = [self.worker_id]  # the live workers, as seen on the last heartbeat
+        self._held: Set[str] = set()  # shard keys of which this worker holds the lease
+        self._shard_keys: Dict[str, str] = {}  # Maps request URLs to their shard key
+        self._acquire_script = redis_client.register_script(_ACQUIRE_SCRIPT)
+        self._release_script = redis_client.register_script(_RELEASE_SCRIPT)
+
+    @property
+    def workers_key(self) -> str:
+        return f"{self.key_prefix}:workers"
+
+    def _shard_key(self, request_url: str) -> str:
+        key = self._shard_keys.get(request_url)
+        if key is None:
+            key = self._shard_keys[request_url] = shard_key(request_url)
+        return key
+
+    def _lease_key(self, key: str) -> str:
+        return f"{self.key_prefix}:lease:{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"
+
+    def owns(self, request_url: str) -> bool:
+        """
+        whether the query belongs to this worker, according to the membership of the last heartbeat
+        """
+        return rendezvous_owner(self._shard_key(request_url), self.workers) == self.worker_id
+
+    def holds(self, request_url: str) -> bool:
+        return self._shard_key(request_url) in self._held
+
+    async def heartbeat(self) -> bool:
+        """
+        Let the others know this worker is alive & update the membership.
+        :return: whether the live workers changed since the previous heartbeat
+        """
+        now = time.time()
+        await self.redis_client.zadd(self.workers_key, {self.worker_id: now})
+        await self.redis_client.zremrangebyscore(self.workers_key, "-inf", now - self.worker_ttl)
+        workers = sorted(worker_id.decode() if isinstance(worker_id, bytes) else worker_id
+                         for worker_id in await self.redis_client.zrange(self.workers_key, 0, -1))
+        changed = workers != self.workers
+        if changed:
+            logging.info(f"Notifier workers changed: {len(self.workers)} => {len(workers)} {workers}")
+        self.workers = workers
+        return changed
+
+    async def acquire(self, request_url: str) -> bool:
+        """
+        Take (or renew) the lease of a query's shard key.
+        :return: whether this worker may poll the query
+        """
+        key = self._shard_key(request_url)
+        acquired = bool(await self._acquire_script(keys=[self._lease_key(key)],
+                                                   args=[self.worker_id, int(self.lease_ttl * 1000)]))
+        if acquired:
+            self._held.add(key)
+        else:
+            self._held.discard(key)
+        return acquired
+
+    async def release(self, request_url: str) -> None:
+        """
+        Give up the lease of a query's shard key (if this worker holds it).
+        """
+        await self._release(self._shard_key(request_url))
+
+    async def sync_leases(self, request_urls: Iterable[str], release: bool = True) -> None:
+        """
+        Renew the held leases of the queries this worker monitors (request_urls) & release the others.
+        release: False renews the others as well, e.g. while their state isn't written yet
+        """
+        needed = {self._shard_key(request_url) for request_url in request_urls}
+        for key in list(self._held):
+            if key in needed or not release:
+                if not await self._acquire_script(keys=[self._lease_key(key)],
+                                                  args=[self.worker_id, int(self.lease_ttl * 1000)]):
+                    self._held.discard(key)
+                    logging.warning(f"Lost the lease of {key}.")
+            else:
+                await self._release(key)
+        if release:
+            self._shard_keys = {request_url: key for request_url, key in self._shard_keys.items() if key in needed}
+
+    async def leave(self) -> None:
+        """
+        Release all leases & leave the cluster, so the other workers take over right away.
+        """
+        for key in list(self._held):
+            await self._release(key)
+        await self.redis_client.zrem(self.workers_key, self.worker_id)
+
+    async def _release(self, key: str) -> None:
+        self._held.discard(key)
+        await self._release_script(keys=[self._lease_key(key)], args=[self.worker_id])
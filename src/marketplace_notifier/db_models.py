@@ -19,4 +19,20 @@ class LatestListingInfoDB(Model):
             re.M)],
         description="url to use for GET request"
     )
-    title = fields.CharField(max_length=60)
\ No newline at end of file
+    title = fields.CharField(max_length=60)
+
+
+class SeenListingsDB(Model):
+    """
+    stores per request_url the item IDs of the most recently seen listings (see SeenWindow)
+    lives next to LatestListingInfoDB, which only holds the single highest item ID
+    """
+    request_url = fields.CharField(
+        pk=True,
+        max_length=500,
+        validators=[RegexValidator(
+            r'^https://www\.2dehands\.be/lrp/api/search\?.*',
+            re.M)],
+        description="url to use for GET request"
+    )
+    item_ids = fields.BinaryField(description="64-bit little-endian item IDs (without 'm' prefix), oldest first")
@@ -0,0 +1,154 @@
+"""
+Enriches new listings with their details in the background, so the notification of new listings isn't delayed:
+the details are published later on the LISTING_DETAILS_CHANNEL (per query with ListingMessages.shard_by_query).
+The details are fetched from the 2dehands item API directly (fetch_item_details, the same request as the webserver's
+/item/{item_id}), with the notifier's item client: its RateGovernor shares the request budget with the other requests.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from src.shared import json_codec
+from src.shared.api_utils import fetch_item_details, is_listing_not_found
+from src.shared.ttl_cache import TTLCache
+from src.marketplace_notifier.publishers import LISTING_DETAILS_CHANNEL, ListingMessages
+
+# the details of a new listing usually become available within a minute (until then: LISTING_NOT_FOUND)
+DEFAULT_RETRY_DELAYS = (10, 30, 90)
+
+
+class ListingEnricher:
+    """
+    Fetches the details of new listings with a bounded pool of workers & publishes them per listing & query,
+    as the listing_messages say (the same payload & channels as the new listings).
+
+    A listing which is too new for its details (LISTING_NOT_FOUND) is retried after each of the retry_delays,
+    without holding up a worker in the meantime.
+    Fetched details are cached per item ID, so a listing which is new for several queries is only fetched once.
+    When the queue is full, new listings aren't enriched (the notifications are more important than the details).
+    """
+
+    def __init__(self, retry_client, publisher, workers: int = 2, max_queued: int = 500,
+                 cache_ttl: float = 10 * 60, cache_size: int = 2048,
+                 retry_delays: Sequence[float] = DEFAULT_RETRY_DELAYS,
+                 listing_messages: ListingMessages = ListingMessages()):
+        """
+        retry_client: client for the item API (app.2dehands.be), shouldn't retry on 400 (that's LISTING_NOT_FOUND)
+        publisher: PubSubPublisher or StreamPublisher (see publishers.py)
+        workers: max details fetched at the same time
+        max_queued: max listings waiting for a worker (including the retries which are due)
+        cache_ttl: seconds fetched details are reused
+        retry_delays: seconds to wait before the next attempt after a LISTING_NOT_FOUND, one per retry
+        listing_messages: the payload of the details & whether every query gets its own channel
+        """
+        self.retry_client = retry_client
+        self.publisher = publisher
+        self.workers = max(workers, 1)
+        self.retry_delays = tuple(retry_delays)
+        self.listing_messages = listing_messages
+        self.details_cache: TTLCache[str, Dict[str, Any]] = TTLCache(cache_size, cache_ttl)
+        self.queue: "asyncio.Queue[Tuple[str, int]]" = asyncio.Queue(max_queued)  # (item ID, attempt)
+        # Maps the item IDs being enriched to the request URLs to publish to, with the ID of their query
+        self._subscribers: Dict[str, Dict[str, Optional[int]]] = {}
+        self._retry_handles: Set[asyncio.TimerHandle] = set()
+        self.dropped = 0  # listings which weren't enriched because the queue was full or they kept failing
+
+    def __len__(self) -> int:
+        """
+        amount of listings being enriched (queued, being fetched or waiting for a retry)
+        """
+        return len(self._subscribers)
+
+    def submit(self, request_url: str, new_listings: List[Dict[str, Any]], query_id: Optional[int] = None) -> None:
+        """
+        Enrich new listings of a request URL (query_id: the ID of its QueryInfo), their details are published later.
+        """
+        for listing in new_listings:
+            item_id = listing["itemId"]
+            subscribers = self._subscribers.get(item_id)
+            if subscribers is not None:
+                # already being enriched (e.g. it's new for another query too)
+                subscribers[request_url] = query_id
+                continue
+            try:
+                self.queue.put_nowait((item_id, 0))
+            except asyncio.QueueFull:
+                self.dropped += 1
+                logging.warning(f"Enrichment queue is full, not fetching the details of {item_id}.")
+                continue
+            self._subscribers[item_id] = {request_url: query_id}
+
+    async def run(self) -> None:
+        """
+        Run the workers until cancelled.
+        """
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            for handle in self._retry_handles:
+                handle.cancel()
+            self._retry_handles.clear()
+
+    async def _worker(self) -> None:
+        while True:
+            item_id, attempt = await self.queue.get()
+            try:
+                await self._enrich(item_id, attempt)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._give_up(item_id, f"{type(e).__name__} - {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _enrich(self, item_id: str, attempt: int) -> None:
+        details = self.details_cache.get(item_id)
+        if details is None:
+            status, details = await fetch_item_details(self.retry_client, item_id)
+            if is_listing_not_found(status, details):
+                self._retry_later(item_id, attempt)
+                return
+            if status != 200 or details is None:
+                self._give_up(item_id, f"status {status}")
+                return
+            self.details_cache.set(item_id, details)
+
+        for request_url, query_id in self._subscribers.pop(item_id, {}).items():
+            message = self.listing_messages.details_message(request_url, query_id, item_id, details)
+            await self.publisher.publish(self.listing_messages.details_channel(query_id), json_codec.dumps(message))
+        logging.info(f"Published the details of {item_id}.")
+
+    def _retry_later(self, item_id: str, attempt: int) -> None:
+        """
+        LISTING_NOT_FOUND: queue the listing again after the next retry delay
+        """
+        if attempt >= len(self.retry_delays):
+            self._give_up(item_id, "details still not available")
+            return
+
+        def requeue():
+            self._retry_handles.discard(handle)
+            try:
+                self.queue.put_nowait((item_id, attempt + 1))
+            except asyncio.QueueFull:
+                self._give_up(item_id, "queue is full")
+
+        handle = asyncio.get_running_loop().call_later(self.retry_delays[attempt], requeue)
+        self._retry_handles.add(handle)
+
+    def _give_up(self, item_id: str, reason: str) -> None:
+        self._subscribers.pop(item_id, None)
+        self.dropped += 1
+        logging.warning(f"Not enriching {item_id}: {reason}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enriching": len(self._subscribers),
+            "queued": self.queue.qsize(),
+            "waiting_for_retry": len(self._retry_handles),
+            "dropped": self.dropped,
+            "cache": self.details_cache.snapshot(),
+        }
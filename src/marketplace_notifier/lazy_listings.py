@@ -0,0 +1,131 @@
+import hashlib
+import json
+import re
+from typing import Any, Dict, List, Optional, Union
+
+from src.shared import json_codec
+
+# every listing object of a search response starts with its itemId
+# (the raw body is scanned as bytes, so it never has to be decoded as a whole)
+_LISTING_START = re.compile(rb'\{\s*"itemId"\s*:\s*"(m\d+)"')
+_PRIORITY_PRODUCT = re.compile(rb'"priorityProduct"\s*:\s*"([A-Z_]+)"')
+_ITEM_ID = re.compile(rb'"itemId"\s*:\s*"(m\d+)"')
+_decoder = json.JSONDecoder()
+
+
+class LazyListing(dict):
+    """
+    A listing of a search response of which only "itemId" & "priorityProduct" are parsed.
+    Looking up any other key parses the full listing (once) from the raw response.
+    ! Call materialise() before handing it to a serializer which reads the dict directly (e.g. orjson),
+    json.dumps & the Mapping methods (items, keys, ...) materialise it themselves.
+    """
+    __slots__ = ("_body", "_start", "_end")
+
+    def __init__(self, body: bytes, start: int, end: int, item_id: str, priority_product: str):
+        """
+        start & end: the listing object is somewhere in body[start:end], starting at start
+        """
+        super().__init__(itemId=item_id, priorityProduct=priority_product)
+        self._body = body
+        self._start = start
+        self._end = end
+
+    def materialise(self) -> Dict[str, Any]:
+        """
+        Parse the full listing from the raw response (if not done yet) & return it as a plain dict.
+        """
+        if self._body is not None:
+            listing, _ = _decoder.raw_decode(self._body[self._start:self._end].decode("utf-8"))
+            if listing.get("itemId") != super().__getitem__("itemId"):
+                raise ValueError(f"Lazy listing at {self._start} doesn't match {super().__getitem__('itemId')}")
+            self.update(listing)
+            self._body = None  # the raw response can be freed
+        return dict(super().items())
+
+    def __missing__(self, key):
+        if self._body is None:
+            raise KeyError(key)
+        self.materialise()
+        return self[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        self.materialise()
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self.materialise()
+        return super().__iter__()
+
+    def __len__(self):
+        self.materialise()
+        return super().__len__()
+
+    def keys(self):
+        self.materialise()
+        return super().keys()
+
+    def values(self):
+        self.materialise()
+        return super().values()
+
+    def items(self):
+        self.materialise()
+        return super().items()
+
+
+def materialise_listing(listing: Dict[str, Any]) -> Dict[str, Any]:
+    return listing.materialise() if isinstance(listing, LazyListing) else listing
+
+
+def parse_listings_lazily(body: Union[bytes, str]) -> List[Dict[str, Any]]:
+    """
+    Get the listings of a /lrp/api/search response, only parsing the fields needed to diff them (see LazyListing).
+    Falls back to parsing the whole response when it doesn't look like we expect (e.g. the keys got reordered).
+    """
+    body = body.encode("utf-8") if isinstance(body, str) else body
+    listings = _project_listings(body)
+    if listings is None:
+        return json_codec.loads(body)["listings"]
+    return listings
+
+
+def _project_listings(body: bytes) -> Optional[List[LazyListing]]:
+    starts = list(_LISTING_START.finditer(body))
+    # every itemId should be the start of a listing, otherwise the layout changed
+    # (quotes inside JSON strings are escaped, so this can't match a listing's text)
+    if not starts or len(starts) != body.count(b'"itemId"'):
+        return None
+
+    listings = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1].start() if i + 1 < len(starts) else len(body)
+        priority_product = _PRIORITY_PRODUCT.search(body, start.end(), end)
+        if priority_product is None:
+            return None
+        listings.append(LazyListing(body, start.start(), end, start.group(1).decode(), priority_product.group(1).decode()))
+    return listings
+
+
+def listings_fingerprint(body: bytes) -> bytes:
+    """
+    Digest of all non-ad item IDs (in page order) of a raw search response, so any listing which enters the page
+    (also below the top, e.g. a bumped one) changes it.
+    Everything else changes on (nearly) every request without affecting the diff: the ads rotate,
+    correlation IDs, view counts...
+    """
+    item_ids = []
+    for item_id in _ITEM_ID.finditer(body):
+        priority_product = _PRIORITY_PRODUCT.search(body, item_id.end())
+        if priority_product is not None and priority_product.group(1) == b"NONE":
+            item_ids.append(item_id.group(1))
+    if not item_ids:
+        # not a page of listings as we know it, so only an identical response counts as unchanged
+        return hashlib.blake2b(body, digest_size=16).digest()
+    return hashlib.blake2b(b",".join(item_ids), digest_size=16).digest()
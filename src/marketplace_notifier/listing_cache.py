@@ -0,0 +1,170 @@
+import logging
+from typing import Dict, Iterable, Tuple
+
+from tortoise.transactions import in_transaction
+
+from src.marketplace_notifier.db_models import LatestListingInfoDB, SeenListingsDB
+from src.marketplace_notifier.seen_window import SeenWindow
+
+TITLE_MAX_LENGTH = LatestListingInfoDB._meta.fields_map["title"].max_length
+
+
+class LatestListingCache:
+    """
+    In-memory copy of LatestListingInfoDB & SeenListingsDB: the latest item ID (high-water mark)
+    and the SeenWindow per request_url.
+    Reads never hit the DB, updates are only marked dirty and written to the DB in one transaction by flush().
+    """
+
+    def __init__(self, seen_window_size: int = 256):
+        """
+        seen_window_size: amount of item IDs remembered per request_url, should be well above the page size (100)
+        """
+        self.seen_window_size = seen_window_size
+        self._latest: Dict[str, Tuple[int, str, str]] = {}  # Maps request URLs to (parsed item ID, item ID, title)
+        self._seen_windows: Dict[str, SeenWindow] = {}
+        self._dirty = set()  # request URLs with a latest listing update which isn't in the DB yet
+        self._dirty_seen_windows = set()  # request URLs with a seen window update which isn't in the DB yet
+        self._evict_after_flush = set()  # evicted request URLs with updates which have to be written first
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    async def load(self) -> None:
+        """
+        Load all latest listings & seen windows from the DB, a single query each.
+        Should be called once at startup, after the orphaned rows are cleaned up.
+        """
+        rows = await LatestListingInfoDB.all().values_list("request_url", "item_id", "title")
+        self._latest = {request_url: (int(item_id[1:]), item_id, title) for request_url, item_id, title in rows}
+        rows = await SeenListingsDB.all().values_list("request_url", "item_ids")
+        self._seen_windows = {
+            request_url: SeenWindow.from_bytes(self.seen_window_size, item_ids) for request_url, item_ids in rows
+        }
+        self._dirty.clear()
+        self._dirty_seen_windows.clear()
+        self._evict_after_flush.clear()
+        logging.info(f"Loaded {len(self._latest)} latest listing(s) & {len(self._seen_windows)} seen window(s) "
+                     f"into the cache.")
+
+    async def reload(self, request_urls: Iterable[str]) -> None:
+        """
+        Reload the latest listings & seen windows of some request URLs from the DB,
+        e.g. because another notifier (worker) handled them until now. Their pending updates are dropped.
+        """
+        request_urls = list(request_urls)
+        for request_url in request_urls:
+            self._latest.pop(request_url, None)
+            self._seen_windows.pop(request_url, None)
+            self._dirty.discard(request_url)
+            self._dirty_seen_windows.discard(request_url)
+            self._evict_after_flush.discard(request_url)
+        rows = await LatestListingInfoDB.filter(request_url__in=request_urls).values_list(
+            "request_url", "item_id", "title")
+        for request_url, item_id, title in rows:
+            self._latest[request_url] = (int(item_id[1:]), item_id, title)
+        rows = await SeenListingsDB.filter(request_url__in=request_urls).values_list("request_url", "item_ids")
+        for request_url, item_ids in rows:
+            self._seen_windows[request_url] = SeenWindow.from_bytes(self.seen_window_size, item_ids)
+
+    async def ensure_loaded(self, request_url: str) -> None:
+        """
+        Make sure a request URL which is (re-)monitored is in the cache: cancel its pending eviction,
+        or reload it from the DB if it was evicted.
+        """
+        if request_url in self._evict_after_flush:
+            self._evict_after_flush.discard(request_url)
+        elif request_url not in self._latest and request_url not in self._seen_windows:
+            await self.reload([request_url])
+
+    def evict(self, request_url: str) -> None:
+        """
+        Drop a request URL which isn't monitored anymore from the cache,
+        after its pending updates are written (on the next flush) if it has any.
+        """
+        if request_url in self._dirty or request_url in self._dirty_seen_windows:
+            self._evict_after_flush.add(request_url)
+        else:
+            self._drop(request_url)
+
+    def _drop(self, request_url: str) -> None:
+        self._latest.pop(request_url, None)
+        self._seen_windows.pop(request_url, None)
+
+    def latest_item_id(self, request_url: str) -> int:
+        """
+        :return: the parsed item ID (without 'm' prefix) of the latest listing of a request URL, 0 if there's none yet
+        """
+        latest = self._latest.get(request_url)
+        return latest[0] if latest else 0
+
+    def seen_window(self, request_url: str) -> SeenWindow:
+        """
+        :return: the SeenWindow of a request URL, an empty one if nothing was seen yet
+        """
+        seen_window = self._seen_windows.get(request_url)
+        if seen_window is None:
+            seen_window = self._seen_windows[request_url] = SeenWindow(self.seen_window_size)
+        return seen_window
+
+    def mark_seen(self, request_url: str, item_ids: Iterable[int]) -> None:
+        """
+        Add item IDs (oldest first) to the SeenWindow of a request URL, it gets written to the DB on the next flush.
+        """
+        item_ids = list(item_ids)
+        if item_ids:
+            self.seen_window(request_url).extend(item_ids)
+            self._dirty_seen_windows.add(request_url)
+
+    def update(self, request_url: str, item_id: str, title: str) -> None:
+        """
+        Set the latest listing of a request URL, it gets written to the DB on the next flush.
+        """
+        self._latest[request_url] = (int(item_id[1:]), item_id, title[:TITLE_MAX_LENGTH])
+        self._dirty.add(request_url)
+
+    async def flush(self) -> None:
+        """
+        Write all dirty latest listings & seen windows to the DB in one transaction.
+        If it fails, the entries stay dirty & are retried on the next flush.
+        """
+        if not self._dirty and not self._dirty_seen_windows:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        dirty_seen_windows, self._dirty_seen_windows = self._dirty_seen_windows, set()
+        rows = [
+            LatestListingInfoDB(request_url=request_url, item_id=self._latest[request_url][1],
+                                title=self._latest[request_url][2])
+            for request_url in dirty
+        ]
+        seen_rows = [
+            SeenListingsDB(request_url=request_url, item_ids=self._seen_windows[request_url].to_bytes())
+            for request_url in dirty_seen_windows
+        ]
+        try:
+            async with in_transaction(LatestListingInfoDB._meta.default_connection) as connection:
+                if rows:
+                    await LatestListingInfoDB.bulk_create(
+                        rows,
+                        on_conflict=["request_url"],
+                        update_fields=["item_id", "title"],
+                        using_db=connection
+                    )
+                if seen_rows:
+                    await SeenListingsDB.bulk_create(
+                        seen_rows,
+                        on_conflict=["request_url"],
+                        update_fields=["item_ids"],
+                        using_db=connection
+                    )
+        except Exception:
+            # updates made while flushing are already in the dirty sets again
+            self._dirty |= dirty
+            self._dirty_seen_windows |= dirty_seen_windows
+            raise
+        # the evicted request URLs which weren't updated again while flushing
+        for request_url in self._evict_after_flush - self._dirty - self._dirty_seen_windows:
+            self._evict_after_flush.discard(request_url)
+            self._drop(request_url)
+        logging.info(f"Flushed {len(rows)} latest listing(s) & {len(seen_rows)} seen window(s) to the DB.")
@@ -0,0 +1,91 @@
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from src.marketplace_notifier.seen_window import SeenWindow
+
+
+class DiffResult(NamedTuple):
+    new_listings: List[Dict[str, Any]]  # new non-ad listings, newest first
+    latest_item_id: int  # parsed item ID of the newest listing, the previous one if there are no new listings
+    seen_item_ids: List[int]  # item IDs to add to the query's SeenWindow, oldest first
+
+
+def parse_item_id(item_id: str) -> int:
+    """
+    "m2154316958" -> 2154316958
+    """
+    return int(item_id[1:])  # Remove 'm' prefix
+
+
+class ListingDiff:
+    """
+    Finds the new non-ad listings on a page of listings.
+
+    Without a SeenWindow, a listing is new when its item ID is higher than the latest (highest) item ID we've seen.
+    With a SeenWindow, a listing is new when we haven't seen its item ID yet & it's above the window's floor,
+    which also catches listings that show up late, below newer ones.
+
+    The page is walked once & every item ID is parsed once.
+    Pages are sorted on SORT_INDEX (newest first), so the new listings are found in order
+    and only get sorted when the page turns out not to be in order.
+    """
+
+    def __init__(self, early_stop_after: Optional[int] = None):
+        """
+        early_stop_after: stop walking the page after this many consecutive non-ad listings which aren't new.
+        None walks the whole page: listings sometimes show up a few positions lower than their item ID suggests,
+        so only stop early when you can accept missing those.
+        """
+        self.early_stop_after = early_stop_after
+
+    def diff(self, listings: Iterable[Dict[str, Any]], latest_item_id: int,
+             seen_window: Optional[SeenWindow] = None) -> DiffResult:
+        if not seen_window:
+            # nothing seen yet (or no window used): everything above the latest item ID is new
+            floor, seen_ids = latest_item_id, ()
+        else:
+            floor, seen_ids = seen_window.floor, seen_window.snapshot()
+
+        if self.early_stop_after is None:
+            # ads are pinned to the top whatever their age, so they're never new
+            # (item ID parsing is inlined, this comprehension is the hot path for idle queries)
+            new_listings = [
+                (item_id, listing) for listing in listings
+                if listing["priorityProduct"] == "NONE"
+                and (item_id := int(listing["itemId"][1:])) > floor and item_id not in seen_ids
+            ]
+        else:
+            new_listings = self._diff_until_old_listings(listings, floor, seen_ids)
+
+        if any(new_listings[i][0] < new_listings[i + 1][0] for i in range(len(new_listings) - 1)):
+            new_listings.sort(key=lambda id_and_listing: id_and_listing[0], reverse=True)  # Sort by ID (newest first)
+
+        if seen_window is not None and not seen_window:
+            # first diff with this window: fill it with the whole page, so the old listings aren't new next time
+            seen_item_ids = sorted(int(listing["itemId"][1:]) for listing in listings
+                                   if listing["priorityProduct"] == "NONE")
+        else:
+            seen_item_ids = [item_id for item_id, _ in reversed(new_listings)]
+
+        if not new_listings:
+            return DiffResult([], latest_item_id, seen_item_ids)
+        return DiffResult([listing for _, listing in new_listings], max(new_listings[0][0], latest_item_id),
+                          seen_item_ids)
+
+    def _diff_until_old_listings(self, listings: Iterable[Dict[str, Any]], floor: int,
+                                 seen_ids) -> List[Tuple[int, Dict[str, Any]]]:
+        new_listings = []
+        old_in_a_row = 0
+        for listing in listings:
+            if listing["priorityProduct"] != "NONE":
+                continue
+
+            item_id = parse_item_id(listing["itemId"])
+            if item_id > floor and item_id not in seen_ids:
+                new_listings.append((item_id, listing))
+                old_in_a_row = 0
+                continue
+
+            old_in_a_row += 1
+            if old_in_a_row >= self.early_stop_after:
+                break
+        return new_listings
@@ -0,0 +1,200 @@
+"""
+Filters evaluated on fetched listings (dicts shaped like the Listing model in src/misc/api_models.py),
+instead of by 2dehands, so one fetch can be fanned out to many queries.
+
+A query's filters are compiled once into a CompiledFilter: a tuple of hashable predicates.
+A page is evaluated against many compiled filters in one pass (evaluate_filters): the fields are extracted
+into columns once, every distinct predicate is evaluated once over its column into a bitmask (bit i = listing i)
+and each filter is the AND of its predicates' bitmasks.
+"""
+from dataclasses import dataclass
+from typing import (Any, Callable, ClassVar, Dict, FrozenSet, Hashable, Iterable, List, Mapping, NamedTuple,
+                    Optional, Sequence, Tuple, TypeVar)
+
+K = TypeVar("K", bound=Hashable)
+
+
+def _field(*keys: str) -> Callable[[Dict[str, Any]], Any]:
+    def get(listing: Dict[str, Any]) -> Any:
+        value = listing
+        for key in keys:
+            value = value.get(key) if isinstance(value, dict) else None
+        return value
+    return get
+
+
+def _text(listing: Dict[str, Any]) -> str:
+    return f"{listing.get('title') or ''}\n{listing.get('description') or ''}".lower()
+
+
+# how every column is extracted from a listing
+_EXTRACTORS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "price_cents": _field("priceInfo", "priceCents"),
+    "distance_meters": _field("location", "distanceMeters"),
+    "category_id": _field("categoryId"),
+    "seller_verified": _field("sellerInformation", "isVerified"),
+    "traits": lambda listing: frozenset(listing.get("traits") or ()),
+    "text": _text,
+}
+
+
+class ListingColumns:
+    """
+    The fields of a page of listings the predicates look at, one tuple per field in page order.
+    A column is only extracted when a predicate needs it (e.g. the text column is the most expensive).
+    """
+
+    def __init__(self, listings: Sequence[Dict[str, Any]]):
+        self.listings = listings
+        self._columns: Dict[str, Tuple[Any, ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self.listings)
+
+    def __getitem__(self, name: str) -> Tuple[Any, ...]:
+        column = self._columns.get(name)
+        if column is None:
+            extract = _EXTRACTORS[name]
+            column = self._columns[name] = tuple(extract(listing) for listing in self.listings)
+        return column
+
+
+class _Predicate:
+    """
+    a test on a single column, subclasses are frozen dataclasses so equal predicates of different queries are shared
+    """
+    column: ClassVar[str]
+
+    def test(self, value: Any) -> bool:
+        raise NotImplementedError
+
+    def mask(self, columns: ListingColumns) -> int:
+        test = self.test
+        return sum(1 << i for i, value in enumerate(columns[self.column]) if test(value))
+
+
+@dataclass(frozen=True)
+class PriceRange(_Predicate):
+    min_cents: Optional[int]
+    max_cents: Optional[int]
+    column: ClassVar[str] = "price_cents"
+
+    def test(self, price_cents: Optional[int]) -> bool:
+        # listings without a price pass, like they do in the search results of 2dehands
+        return price_cents is None or ((self.min_cents is None or price_cents >= self.min_cents)
+                                       and (self.max_cents is None or price_cents <= self.max_cents))
+
+
+@dataclass(frozen=True)
+class MaxDistance(_Predicate):
+    meters: int
+    column: ClassVar[str] = "distance_meters"
+
+    def test(self, distance_meters: Optional[int]) -> bool:
+        return distance_meters is None or distance_meters <= self.meters
+
+
+@dataclass(frozen=True)
+class CategoryIn(_Predicate):
+    category_ids: FrozenSet[int]
+    column: ClassVar[str] = "category_id"
+
+    def test(self, category_id: Optional[int]) -> bool:
+        return category_id in self.category_ids
+
+
+@dataclass(frozen=True)
+class SellerVerified(_Predicate):
+    verified: bool
+    column: ClassVar[str] = "seller_verified"
+
+    def test(self, verified: Optional[bool]) -> bool:
+        return bool(verified) == self.verified
+
+
+@dataclass(frozen=True)
+class HasTraits(_Predicate):
+    traits: FrozenSet[str]
+    column: ClassVar[str] = "traits"
+
+    def test(self, traits: FrozenSet[str]) -> bool:
+        return self.traits <= traits
+
+
+@dataclass(frozen=True)
+class Keywords(_Predicate):
+    words: Tuple[str, ...]  # lowercase, all of them have to be in the title or description
+    column: ClassVar[str] = "text"
+
+    def test(self, text: str) -> bool:
+        return all(word in text for word in self.words)
+
+
+class CompiledFilter(NamedTuple):
+    """
+    The predicates a listing has to pass, cheapest first. No predicates = every listing passes.
+    """
+    predicates: Tuple[_Predicate, ...] = ()
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.predicates
+
+    def matches(self, listing: Dict[str, Any]) -> bool:
+        return all(predicate.test(_EXTRACTORS[predicate.column](listing)) for predicate in self.predicates)
+
+
+def compile_filter(min_price_cents: Optional[int] = None, max_price_cents: Optional[int] = None,
+                   max_distance_meters: Optional[int] = None, category_ids: Optional[Iterable[int]] = None,
+                   seller_verified: Optional[bool] = None, traits: Iterable[str] = (),
+                   keywords: Iterable[str] = ()) -> CompiledFilter:
+    """
+    None (or empty) = don't filter on it
+    category_ids: the listing has to be in one of these categories
+    traits: the listing has to have all of these traits (see TraitEnum)
+    keywords: the title or description has to contain all of these (case-insensitive)
+    """
+    predicates = []
+    if min_price_cents is not None or max_price_cents is not None:
+        predicates.append(PriceRange(min_price_cents, max_price_cents))
+    if max_distance_meters is not None:
+        predicates.append(MaxDistance(max_distance_meters))
+    if category_ids is not None:
+        predicates.append(CategoryIn(frozenset(category_ids)))
+    if seller_verified is not None:
+        predicates.append(SellerVerified(seller_verified))
+    if traits:
+        predicates.append(HasTraits(frozenset(traits)))
+    if keywords:
+        predicates.append(Keywords(tuple(sorted({word.lower() for word in keywords}))))
+    return CompiledFilter(tuple(predicates))
+
+
+def evaluate_filters(listings: Sequence[Dict[str, Any]], filters: Mapping[K, CompiledFilter]) -> Dict[K, int]:
+    """
+    Evaluate a page of listings against many filters in one pass.
+    :return: a bitmask per filter key, bit i is set if listings[i] passes the filter (see selected)
+    """
+    columns = ListingColumns(listings)
+    predicate_masks: Dict[_Predicate, int] = {}
+    all_listings = (1 << len(listings)) - 1
+
+    masks = {}
+    for key, compiled_filter in filters.items():
+        mask = all_listings
+        for predicate in compiled_filter.predicates:
+            if not mask:
+                break
+            predicate_mask = predicate_masks.get(predicate)
+            if predicate_mask is None:
+                predicate_mask = predicate_masks[predicate] = predicate.mask(columns)
+            mask &= predicate_mask
+        masks[key] = mask
+    return masks
+
+
+def selected(listings: Sequence[Dict[str, Any]], mask: int) -> List[Dict[str, Any]]:
+    """
+    the listings of which the bit is set in mask, in page order
+    """
+    return [listing for i, listing in enumerate(listings) if mask >> i & 1]
@@ -1,5 +1,8 @@
+import asyncio
 import logging
 from logging.handlers import RotatingFileHandler
+import os
+import signal
 import sys
 
 import redis.asyncio as redisaio
@@ -7,11 +10,38 @@ from tortoise import run_async, Tortoise
 
 from config.config import config
 from src.shared.api_utils import get_retry_client
+from src.shared.connection_pool import ConnectionStats, SEARCH_CONNECTOR_PROFILE, ITEM_CONNECTOR_PROFILE
+from src.shared.rate_limiter import RateGovernor
 from src.shared.models import QueryInfo
-from src.marketplace_notifier.db_models import LatestListingInfoDB
+from src.marketplace_notifier.db_models import LatestListingInfoDB, SeenListingsDB
+from src.marketplace_notifier.listing_cache import LatestListingCache
+from src.marketplace_notifier.adaptive_interval import AdaptiveIntervalPolicy
+from src.marketplace_notifier.cluster import NotifierCluster
+from src.marketplace_notifier.enrichment import ListingEnricher
 from src.marketplace_notifier.notifier import Notifier
+from src.marketplace_notifier.publishers import PUBSUB_OUTPUT, FULL_PAYLOAD, ListingMessages, create_publisher
 
 FETCH_INTERVAL = 2 * 60  # 2 minutes
+MAX_CONCURRENT_QUERIES = 8  # queries fetched & processed at the same time, 1 = sequential
+SEEN_WINDOW_SIZE = 256  # item IDs remembered per query to detect new listings, should be well above the page size
+DIFF_EARLY_STOP_AFTER = None  # stop comparing a page after this many old listings in a row (None = whole page)
+LAZY_LISTING_PARSE = True  # only parse the fields needed to find new listings, instead of the whole search response
+ADAPTIVE_INTERVALS = False  # poll busy queries more & quiet ones less, instead of all of them every FETCH_INTERVAL
+MIN_FETCH_INTERVAL = 30  # bounds of a query's interval with ADAPTIVE_INTERVALS
+MAX_FETCH_INTERVAL = 15 * 60
+REQUEST_BUDGET_PER_MINUTE = 60  # max search requests per minute of all queries together with ADAPTIVE_INTERVALS
+# fetch queries which only differ in price range or distance with one (broader) search & filter locally
+# (off by default: listings without a distance pass the local distance filter, a shared page has fewer of each query)
+COALESCE_QUERIES = False
+SKIP_UNCHANGED_PAGES = True  # don't parse & diff a search response with the same listings as the previous one
+ENRICH_LISTINGS = False  # publish the details of new listings on the 'listing_details' channel, after notifying them
+ENRICHMENT_WORKERS = 2  # details fetched at the same time with ENRICH_LISTINGS
+LISTINGS_OUTPUT = PUBSUB_OUTPUT  # "stream" (STREAM_OUTPUT) keeps the messages in Redis streams until consumers acknowledge them
+STREAM_MAXLEN = 10_000  # about how many messages are kept per stream with STREAM_OUTPUT
+LISTING_PAYLOAD = FULL_PAYLOAD  # how much of a new listing (& its details) is sent: "full", "compact" or "id_only"
+SHARD_LISTING_CHANNELS = False  # send the listings (& details) of every query on its own 'listings:<query_id>' channel
+# share the queries with the other notifiers which run with it (see cluster.py), they have to share the notifier_db_url
+MULTI_WORKER = os.getenv("NOTIFIER_MULTI_WORKER", "false").lower() == "true"
 # Create a custom logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -43,7 +73,7 @@ for handler in [file_handler, console_handler]:
 
 async def cleanup_orphaned_latest_listings():
     """
-    Removes stale rows from LatestListingInfoDB that no longer have a corresponding entry in QueryInfo.
+    Removes stale rows from LatestListingInfoDB (and SeenListingsDB) that no longer have a corresponding entry in QueryInfo.
     This can happen when a query is deleted via the webserver API while the notifier is offline - QueryInfo loses the row,
     but LatestListingInfoDB still holds the last-seen listing ID for that URL.
     QueryInfo is the source of truth.
@@ -64,6 +94,12 @@ async def cleanup_orphaned_latest_listings():
     else:
         logging.info("No orphaned rows found.")
 
+    seen_urls = set(await SeenListingsDB.all().values_list('request_url', flat=True))
+    orphaned_seen = seen_urls - shared_urls
+    if orphaned_seen:
+        deleted = await SeenListingsDB.filter(request_url__in=orphaned_seen).delete()
+        logging.info(f"Deleted {deleted} orphaned SeenListingsDB row(s) for URLs no longer in QueryInfo.")
+
     new_queries_count = len(shared_urls - local_urls)
     if new_queries_count:
         logging.info(
@@ -81,7 +117,7 @@ async def run():
     """
     CONFIG = {
         "connections": {
-            "default": f"sqlite://{config['database_path']}/marketplace.sqlite3",
+            "default": config["notifier_db_url"],
             "shared": config["default_db_url"]
         },
         "apps": {
@@ -99,6 +135,17 @@ async def run():
     await Tortoise.generate_schemas()
 
     await cleanup_orphaned_latest_listings()
+    latest_listing_cache = LatestListingCache(SEEN_WINDOW_SIZE)
+    await latest_listing_cache.load()
+
+    # stop gracefully (e.g. on 'docker stop'), so the notifier can flush its in-memory state to the DB
+    main_task = asyncio.current_task()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(sig, main_task.cancel)
+        except NotImplementedError:
+            # not supported on Windows
+            pass
 
     # initialize redis pubsub IPC
     redis_client = redisaio.StrictRedis(host=config["redis_host"])
@@ -116,10 +163,38 @@ async def run():
     # aiohttp.client_exceptions.ClientResponseError: 400, message='Bad Request', url='.../api/...'
     # so we retry if the status code is 400
     # TODO: check if it actually retries for that status
-    retry_client = get_retry_client(statuses=[400])
-    async with retry_client as cs:
-        notifier = Notifier(cs, redis_client, FETCH_INTERVAL)
-        await notifier.start()
+    # the request budget for 2dehands is shared with the webserver (see DEFAULT_LIMITS for the rates)
+    connection_stats = ConnectionStats()
+    rate_governor = RateGovernor(redis_client)
+    retry_client = get_retry_client(statuses=[400], rate_governor=rate_governor,
+                                    connector_profile=SEARCH_CONNECTOR_PROFILE, connection_stats=connection_stats)
+    # the item API has its own connections & doesn't retry on 400 (LISTING_NOT_FOUND is retried by the enricher)
+    item_client = get_retry_client(rate_governor=rate_governor, connector_profile=ITEM_CONNECTOR_PROFILE)
+    publisher = create_publisher(LISTINGS_OUTPUT, redis_client, STREAM_MAXLEN)
+    listing_messages = ListingMessages(LISTING_PAYLOAD, SHARD_LISTING_CHANNELS)
+    async with retry_client as cs, item_client:
+        listing_enricher = ListingEnricher(
+            item_client, publisher, workers=ENRICHMENT_WORKERS, listing_messages=listing_messages
+        ) if ENRICH_LISTINGS else None
+        adaptive_intervals = AdaptiveIntervalPolicy(
+            FETCH_INTERVAL, MIN_FETCH_INTERVAL, MAX_FETCH_INTERVAL, REQUEST_BUDGET_PER_MINUTE
+        ) if ADAPTIVE_INTERVALS else None
+        notifier = Notifier(cs, redis_client, FETCH_INTERVAL, latest_listing_cache,
+                            max_concurrent_queries=MAX_CONCURRENT_QUERIES,
+                            diff_early_stop_after=DIFF_EARLY_STOP_AFTER,
+                            lazy_listing_parse=LAZY_LISTING_PARSE,
+                            skip_unchanged_pages=SKIP_UNCHANGED_PAGES,
+                            adaptive_intervals=adaptive_intervals,
+                            coalesce_queries=COALESCE_QUERIES,
+                            connection_stats=connection_stats,
+                            listing_enricher=listing_enricher,
+                            publisher=publisher,
+                            listing_messages=listing_messages,
+                            cluster=NotifierCluster(redis_client) if MULTI_WORKER else None)
+        try:
+            await notifier.start()
+        except asyncio.CancelledError:
+            logging.info("Notifier stopped.")
 
 
 if __name__ == '__main__':
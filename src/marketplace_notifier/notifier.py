@@ -1,218 +1,709 @@
-import redis.asyncio as redis
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Union
 import os
 
-from src.shared.api_utils import get_request_response
+from src.shared import json_codec
+from src.shared.api_utils import get_request_response, get_changed_response, ResponseFingerprints
+from src.shared.connection_pool import ConnectionStats
+from src.shared.constants import QUERY_CHANGES_CHANNEL
 from src.shared.models import QueryInfo, QueryStatus
-from src.marketplace_notifier.db_models import LatestListingInfoDB
+from src.shared.schedule_state import ScheduleStateWriter
+from src.marketplace_notifier.adaptive_interval import AdaptiveIntervalPolicy
+from src.marketplace_notifier.cluster import NotifierCluster
+from src.marketplace_notifier.enrichment import ListingEnricher
+from src.marketplace_notifier.listing_cache import LatestListingCache
+from src.marketplace_notifier.listing_diff import ListingDiff, parse_item_id
+from src.marketplace_notifier.lazy_listings import parse_listings_lazily, listings_fingerprint
+from src.marketplace_notifier.local_filters import CompiledFilter, evaluate_filters
+from src.marketplace_notifier.publishers import PubSubPublisher, StreamPublisher, ListingMessages, PAYLOADS
+from src.marketplace_notifier.query_coalescing import QueryCoalescer
+from src.marketplace_notifier.query_state_writer import QueryStateWriter
+from src.marketplace_notifier.scheduler import QuerySchedule
 
 REQUEST_URL_ERROR_CHANNEL = "request_url_error"
 GENERIC_WARNING_CHANNEL = "warning"
-SLEEP_INTERVAL = 10  # seconds between checking for new queries or changes
+RECONCILE_INTERVAL = 5 * 60  # seconds between full syncs of the monitored queries with the DB (changes are pushed)
+RESUBSCRIBE_DELAY = 5  # seconds to wait before resubscribing to the query changes after a Redis error
+FLUSH_INTERVAL = 5  # seconds between writing the batched query states & latest listings to the DB
 WEBSERVER_URL = f"http://{'webserver' if os.getenv('USE_DOCKER_CONFIG', 'false').lower() == 'true' else 'localhost'}:5000"
 
 import asyncio
 import logging
-import json
 import traceback
 from datetime import datetime, timedelta
 
+
 class Notifier:
     """
     Manages the scheduling and execution of queries at regular intervals.
     Prevents spamming the 2dehands API by spreading requests over time.
+
+    Queries are kept in a min-heap on their next execution time, the scheduler sleeps until the first one is due
+    or until it's woken up by a change in the monitored queries (see add_query & remove_query).
+    Changes are pushed by the webserver over Redis, a periodic full sync with the DB catches anything missed.
     """
 
-    def __init__(self, retry_client, redis_client, interval):
+    def __init__(self, retry_client, redis_client, interval, latest_listing_cache,
+                 max_concurrent_queries=1, diff_early_stop_after=None, lazy_listing_parse=False,
+                 skip_unchanged_pages=False, adaptive_intervals: Optional[AdaptiveIntervalPolicy] = None,
+                 coalesce_queries=False, connection_stats: Optional[ConnectionStats] = None,
+                 listing_enricher: Optional[ListingEnricher] = None,
+                 publisher: Union[PubSubPublisher, StreamPublisher, None] = None,
+                 listing_messages: ListingMessages = ListingMessages(),
+                 cluster: Optional[NotifierCluster] = None):
+        """
+        latest_listing_cache: loaded LatestListingCache, flushed to the DB every FLUSH_INTERVAL & on shutdown
+        diff_early_stop_after: see ListingDiff, None compares every listing on the page
+        lazy_listing_parse: only parse the fields needed for diffing, new listings are parsed fully (see LazyListing)
+        skip_unchanged_pages: don't decode & diff a page when it's the same as on the previous fetch
+        (304 Not Modified or the same item IDs, see listings_fingerprint)
+        adaptive_intervals: poll every query at its own interval, based on how often it gets new listings
+        (None = every query once per interval)
+        coalesce_queries: fetch queries which only differ in price range or distance once, with a broader search,
+        and filter its listings locally per query (see QueryCoalescer)
+        connection_stats: the ConnectionStats of the retry_client, logged on every sync with the DB
+        listing_enricher: publishes the details of new listings after they're notified (None = no details)
+        publisher: sends the new listings to the consumers (None = PUBLISH with the redis_client), see publishers.py
+        listing_messages: the payload of the new listings & whether every query gets its own channel
+        cluster: share the queries with other notifier processes (None = this notifier monitors all of them),
+        see cluster.py
+        max_concurrent_queries: how many ready queries may be fetched & processed at the same time (1 = sequential),
+        the requests themselves are paced by the retry_client's RateGovernor
+        """
+        if listing_messages.payload not in PAYLOADS:
+            raise ValueError(f"Unknown payload '{listing_messages.payload}', expected one of {PAYLOADS}")
         self.retry_client = retry_client
         self.redis_client = redis_client
         self.interval = interval
-        self.query_schedule = {}  # Maps request URLs to their next scheduled execution time
+        self.latest_listing_cache = latest_listing_cache
+        self.query_state_writer = QueryStateWriter()  # batches the QueryInfo status updates
+        # the next check times are only shown by the webserver, so they're kept in Redis instead of the DB
+        self.schedule_state = ScheduleStateWriter(redis_client, shared=cluster is not None)
+        self.listing_diff = ListingDiff(diff_early_stop_after)
+        self.lazy_listing_parse = lazy_listing_parse
+        self.response_fingerprints = ResponseFingerprints() if skip_unchanged_pages else None
+        self.adaptive_intervals = adaptive_intervals
+        self.connection_stats = connection_stats
+        self.listing_enricher = listing_enricher
+        self.publisher = publisher or PubSubPublisher(redis_client)
+        self.listing_messages = listing_messages
+        self.cluster = cluster
+        self.query_coalescer = QueryCoalescer(coalesce_queries)  # which URL is fetched for which request URLs
+        self.query_schedule = QuerySchedule()  # fetch URLs waiting for their next execution
+        self.active_queries = set()  # all monitored request URLs, scheduled or being processed
+        self.query_ids = {}  # Maps the monitored request URLs to the ID of their QueryInfo
+        self.schedule_changed = asyncio.Event()
+        self.query_semaphore = asyncio.Semaphore(max(max_concurrent_queries, 1))
+        self._running_tasks = set()
+        self._fetch_tasks = {}  # Maps fetch URLs to the task processing them right now
 
     async def start(self):
         """
         Start the scheduler and monitor for changes in active queries.
         """
+        if self.cluster is not None:
+            await self.cluster.heartbeat()
+            logging.info(f"Running as notifier worker {self.cluster.worker_id} of {len(self.cluster.workers)}.")
         await self._initialize_schedule()
 
+        background_tasks = [
+            asyncio.create_task(self._listen_for_query_changes()),
+            asyncio.create_task(self._reconcile_loop()),
+            asyncio.create_task(self._flush_loop())
+        ]
+        if self.listing_enricher is not None:
+            background_tasks.append(asyncio.create_task(self.listing_enricher.run()))
+        if self.cluster is not None:
+            background_tasks.append(asyncio.create_task(self._heartbeat_loop()))
+        try:
+            await self._run_schedule()
+        finally:
+            for task in background_tasks:
+                task.cancel()
+            if self.cluster is not None:
+                await self._finish_fetches(list(self._fetch_tasks))
+            await self._flush_state()
+            if self.cluster is not None:
+                # after flushing, so the workers taking over our queries continue where we stopped
+                await self._leave_cluster()
+
+    async def _run_schedule(self):
+        """
+        Sleep until the next query is due (or the schedule changed) and dispatch all due queries.
+        """
         while True:
-            active_queries = await QueryInfo.filter(status=QueryStatus.ACTIVE).values_list("request_url", flat=True)
+            # clear before looking at the schedule, so a change made while we're sleeping is never missed
+            self.schedule_changed.clear()
+            next_time = self.query_schedule.next_time()
+            timeout = None if next_time is None else (next_time - datetime.now()).total_seconds()
 
-            if not active_queries:
-                logging.info("No active queries found. Sleeping...")
-                await asyncio.sleep(SLEEP_INTERVAL)
+            if timeout is not None and timeout <= 0:
+                self._dispatch_ready_queries()
                 continue
 
-            await self._update_schedule(active_queries)
-            await self._process_ready_queries()
-            self._log_upcoming_schedule()
+            try:
+                await asyncio.wait_for(self.schedule_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.cluster.heartbeat_interval)
+            try:
+                await self._heartbeat()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Cluster heartbeat failed: {type(e).__name__} - {e}")
+
+    async def _heartbeat(self):
+        """
+        Keep this worker in the cluster: when the workers change, the queries are rebalanced with a full sync.
+        The leases of the queries we gave away are released after their fetches in progress are done
+        & their state is flushed: the next owner continues with the latest listings in the DB.
+        As long as that fails, they're kept (renewed) & it's retried on the next heartbeat.
+        """
+        if await self.cluster.heartbeat():
+            await self._reconcile()
+            # the queries we gave away, which are still being processed
+            await self._finish_fetches([fetch_url for fetch_url in self._fetch_tasks
+                                        if not self.query_coalescer.subscribers(fetch_url)])
+        flushed = await self._flush_state()
+        if not flushed:
+            logging.warning("Keeping the leases of the queries we gave away until their state is flushed.")
+        await self.cluster.sync_leases(self.active_queries, release=flushed)
+
+    async def _finish_fetches(self, fetch_urls):
+        """
+        Wait for the fetches of fetch_urls in progress (at most a heartbeat interval), cancel the ones still running.
+        """
+        tasks = [self._fetch_tasks[fetch_url] for fetch_url in fetch_urls if fetch_url in self._fetch_tasks]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=self.cluster.heartbeat_interval)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            logging.warning(f"Cancelled {len(pending)} fetches which were handed over to another worker.")
+
+    async def _leave_cluster(self):
+        try:
+            await self.cluster.leave()
+        except Exception as e:
+            logging.error(f"Couldn't leave the cluster: {type(e).__name__} - {e}")
+
+    async def _reconcile_loop(self):
+        """
+        Periodically sync the monitored queries with the DB, as a safety net for missed change events.
+        """
+        while True:
+            await asyncio.sleep(RECONCILE_INTERVAL)
+            try:
+                await self._reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Failed to sync the monitored queries with the DB: {type(e).__name__} - {e}, "
+                              f"retrying in {RECONCILE_INTERVAL}s")
+
+    async def _reconcile(self):
+        """
+        Sync the monitored queries with the ACTIVE queries in the DB.
+        """
+        # pending updates (e.g. queries we marked as FAILED) have to be in the DB before we compare with it
+        await self._flush_state()
+        active_queries = await self._load_active_queries()
+
+        if not active_queries:
+            logging.info("No active queries found. Sleeping...")
+
+        await self._update_schedule(active_queries)
+        self._rejoin_split_fetches()
+        if self.adaptive_intervals is not None and self.adaptive_intervals.budget_factor > 1:
+            logging.warning(f"Polling intervals are stretched {self.adaptive_intervals.budget_factor:.1f}x "
+                            f"to stay within {self.adaptive_intervals.requests_per_minute} requests per minute.")
+        if self.connection_stats is not None:
+            logging.info(f"Connection stats: {self.connection_stats.snapshot()}")
+        retry_diagnostics = getattr(self.retry_client, "retry_diagnostics", None)
+        if retry_diagnostics is not None:
+            logging.info(f"Retry diagnostics: {retry_diagnostics.snapshot(recent_failures=3)}")
+        if self.listing_enricher is not None:
+            logging.info(f"Listing enrichment: {self.listing_enricher.snapshot()}")
+        self._log_upcoming_schedule()
+
+    async def _load_active_queries(self):
+        """
+        :return: the request URLs of the ACTIVE queries in the DB which this worker monitors
+        (their IDs are remembered for the listing messages)
+        """
+        active_queries = await QueryInfo.filter(status=QueryStatus.ACTIVE).values_list("id", "request_url")
+        if self.cluster is not None:
+            # the other workers monitor the rest
+            active_queries = [(query_id, request_url) for query_id, request_url in active_queries
+                              if self.cluster.owns(request_url)]
+        self.query_ids.update((request_url, query_id) for query_id, request_url in active_queries)
+        return [request_url for _, request_url in active_queries]
+
+    async def _flush_loop(self):
+        """
+        Periodically write the batched query states & latest listings to the DB.
+        """
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self._flush_state()
+
+    async def _flush_state(self):
+        """
+        Write all pending DB updates, one transaction per DB, & the schedule to Redis.
+        :return: whether everything was written
+        """
+        flushed = True
+        for name, flush in (("query states", self.query_state_writer.flush),
+                            ("latest listings", self.latest_listing_cache.flush),
+                            ("schedule", self.schedule_state.flush)):
+            try:
+                await flush()
+            except Exception as e:
+                flushed = False
+                logging.error(f"Failed to flush the {name}: {type(e).__name__} - {e}")
+        return flushed
+
+    async def _listen_for_query_changes(self):
+        """
+        Apply the query changes the webserver publishes on the QUERY_CHANGES_CHANNEL.
+        Changes published while we weren't subscribed are caught up on with a full sync after (re)subscribing.
+        """
+        while True:
+            try:
+                async with self.redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(QUERY_CHANGES_CHANNEL)
+                    logging.info(f"Listening for query changes on '{QUERY_CHANGES_CHANNEL}'...")
+                    await self._reconcile()
+                    async for msg in pubsub.listen():
+                        if msg["type"] != "message":
+                            continue
+                        await self._apply_query_change(json_codec.loads(msg["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Lost query changes subscription: {type(e).__name__} - {e}, "
+                              f"resubscribing in {RESUBSCRIBE_DELAY}s")
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
 
-            await asyncio.sleep(SLEEP_INTERVAL)
+    async def _apply_query_change(self, change):
+        """
+        Incrementally update the schedule for a single query change event.
+        """
+        request_url = change["request_url"]
+        logging.info(f"Received query change ({change['action']}): {request_url}")
+        if change["action"] == "deleted" or change["status"] != QueryStatus.ACTIVE:
+            self.remove_query(request_url)
+        elif self.cluster is not None and not self.cluster.owns(request_url):
+            logging.info(f"Query is monitored by another worker: {request_url}")
+        else:
+            self.query_ids[request_url] = change["id"]
+            await self.add_query(request_url)
 
     async def _initialize_schedule(self):
         """
         Initialize the schedule by spreading active queries evenly across the interval.
         """
         now = datetime.now()
-        active_queries = await QueryInfo.filter(status=QueryStatus.ACTIVE).values_list("request_url", flat=True)
+        active_queries = await self._load_active_queries()
 
         if not active_queries:
             logging.info("No active queries found to initialize.")
-            return
 
-        spread_interval = self.interval / max(len(active_queries), 1)
+        for request_url in active_queries:
+            self.active_queries.add(request_url)
+            self.query_coalescer.add(request_url)
+        fetch_urls = list(self.query_coalescer.fetch_urls())
+        if len(fetch_urls) < len(active_queries):
+            logging.info(f"Coalesced {len(active_queries)} queries into {len(fetch_urls)} fetches.")
 
-        for i, request_url in enumerate(active_queries):
+        spread_interval = self.interval / max(len(fetch_urls), 1)
+
+        for i, fetch_url in enumerate(fetch_urls):
             next_execution_time = now + timedelta(seconds=i * spread_interval)
-            self.query_schedule[request_url] = next_execution_time
-            logging.info(f"Scheduled initial query at {next_execution_time.strftime('%H:%M:%S')}: {request_url}")
+            self.query_schedule.schedule(fetch_url, next_execution_time)
+            logging.info(f"Scheduled initial query at {next_execution_time.strftime('%H:%M:%S')}: {fetch_url}")
+
+            for request_url in self.query_coalescer.subscribers(fetch_url):
+                self.schedule_state.set_next_check_time(request_url, next_execution_time)
+
+        await self._rewrite_schedule_state()
+        await self._flush_state()
 
-            await QueryInfo.filter(request_url=request_url).update(next_check_time=next_execution_time)
+    async def _rewrite_schedule_state(self):
+        """
+        Replace the schedule in Redis (our part of it, with a cluster) with the queries we monitor,
+        so the queries which were removed while the notifier wasn't running don't stay in it.
+        """
+        try:
+            await self.schedule_state.rewrite(None if self.cluster is None else self.cluster.owns)
+        except Exception as e:
+            # the pending next check times are written with the next flush
+            logging.error(f"Failed to rewrite the schedule: {type(e).__name__} - {e}")
 
     async def _update_schedule(self, active_queries):
         """
         Update the schedule by adding new queries and removing inactive ones.
         """
         # Remove queries that are no longer active
-        inactive_queries = set(self.query_schedule.keys()) - set(active_queries)
+        inactive_queries = self.active_queries - set(active_queries)
         for request_url in inactive_queries:
-            self.query_schedule.pop(request_url, None)
-            logging.info(f"Removed inactive query: {request_url}")
+            self.remove_query(request_url)
 
         # Add new queries that are not yet scheduled
-        new_queries = set(active_queries) - set(self.query_schedule.keys())
+        new_queries = set(active_queries) - self.active_queries
         for request_url in new_queries:
-            await self._schedule_new_query(request_url)
+            await self.add_query(request_url)
+
+    async def add_query(self, request_url):
+        """
+        Start monitoring a (new or re-activated) query, it gets executed right away.
+        """
+        # a re-activated query shouldn't be marked as FAILED again by an update which wasn't flushed yet
+        self.query_state_writer.discard_status(request_url)
+        if request_url in self.active_queries:
+            return
+        # it may have been monitored before, evicted from the cache when it was removed
+        await self.latest_listing_cache.ensure_loaded(request_url)
+        self.active_queries.add(request_url)
+        previous_fetch_url, fetch_url = self.query_coalescer.add(request_url)
+        self._forget_fetch_url(previous_fetch_url)
+        # the page of a new or re-activated query has to be diffed, even if it didn't change
+        self._forget_fetch_url(fetch_url)
+        if previous_fetch_url is not None and previous_fetch_url != fetch_url:
+            self.query_schedule.remove(previous_fetch_url)
+        await self._schedule_new_query(fetch_url)
+
+    def remove_query(self, request_url):
+        """
+        Stop monitoring a query. If it's being processed right now, it won't be rescheduled.
+        """
+        if request_url not in self.active_queries:
+            return
+        self.active_queries.discard(request_url)
+        self.query_ids.pop(request_url, None)
+        self.schedule_state.remove(request_url)
+        self.latest_listing_cache.evict(request_url)
+        previous_fetch_url, fetch_url = self.query_coalescer.remove(request_url)
+        if previous_fetch_url != fetch_url:
+            # the remaining queries of the group (if any) are fetched with another URL, at the same time
+            next_execution_time = self.query_schedule.get(previous_fetch_url)
+            self.query_schedule.remove(previous_fetch_url)
+            self._forget_fetch_url(previous_fetch_url)
+            if fetch_url is not None:
+                self._forget_fetch_url(fetch_url)
+                self.query_schedule.schedule(fetch_url, next_execution_time or datetime.now())
+        self.schedule_changed.set()
+        logging.info(f"Removed inactive query: {request_url}")
+
+    def _forget_fetch_url(self, fetch_url):
+        """
+        Drop what we remember about the previous fetches of a URL, its next page is processed as a new one.
+        """
+        if fetch_url is None:
+            return
+        if self.response_fingerprints is not None:
+            self.response_fingerprints.discard(fetch_url)
+        if self.adaptive_intervals is not None:
+            self.adaptive_intervals.remove(fetch_url)
 
-    async def _schedule_new_query(self, request_url):
+    async def _schedule_new_query(self, fetch_url):
         """
-        Schedule a new query for the first time.
+        Schedule a new query (or the fetch of the group it joined) right away.
         """
         next_execution_time = datetime.now()
-        self.query_schedule[request_url] = next_execution_time
-        logging.info(f"Scheduled new query at {next_execution_time.strftime('%H:%M:%S')}: {request_url}")
+        self.query_schedule.schedule(fetch_url, next_execution_time)
+        self.schedule_changed.set()
+        logging.info(f"Scheduled new query at {next_execution_time.strftime('%H:%M:%S')}: {fetch_url}")
 
-        await QueryInfo.filter(request_url=request_url).update(next_check_time=next_execution_time)
+        for request_url in self.query_coalescer.subscribers(fetch_url):
+            self.schedule_state.set_next_check_time(request_url, next_execution_time)
 
-    async def _process_ready_queries(self):
+    def _dispatch_ready_queries(self):
         """
-        Process all queries that are ready to be executed.
+        Pop all due queries off the schedule and process each of them in its own task,
+        at most max_concurrent_queries at the same time.
         """
         now = datetime.now()
-        ready_queries = [url for url, time in self.query_schedule.items() if time <= now]
+        ready_queries = self.query_schedule.pop_due(now)
 
-        spread_interval = self.interval / max(len(self.query_schedule), 1)
-        last_scheduled_time = max(self.query_schedule.values(), default=now)
+        spread_interval = self.interval / max(len(self.query_coalescer), 1)
+        last_scheduled_time = max(self.query_schedule.latest_time or now, now)
 
-        for i, request_url in enumerate(ready_queries):
-            try:
-                logging.info(f"Processing query: {request_url}")
-
-                result = await get_request_response(self.retry_client, request_url, json_response=True)
-                await process_listings({request_url: result["listings"]}, self.redis_client)
+        # the next execution times are assigned up front, so they don't depend on which query finishes first
+        for i, fetch_url in enumerate(ready_queries):
+            next_execution_time = last_scheduled_time + timedelta(seconds=(i + 1) * spread_interval)
+            task = asyncio.create_task(self._process_query(fetch_url, next_execution_time))
+            self._running_tasks.add(task)
+            task.add_done_callback(self._running_tasks.discard)
+            self._fetch_tasks[fetch_url] = task
+            task.add_done_callback(lambda done, fetch_url=fetch_url: self._fetch_done(fetch_url, done))
 
-                next_execution_time = last_scheduled_time + timedelta(seconds=(i + 1) * spread_interval)
-                self.query_schedule[request_url] = next_execution_time
-                logging.info(f"Next execution scheduled at {next_execution_time.strftime('%H:%M:%S')}: {request_url}")
+    def _fetch_done(self, fetch_url, task):
+        if self._fetch_tasks.get(fetch_url) is task:
+            del self._fetch_tasks[fetch_url]
 
-                await QueryInfo.filter(request_url=request_url).update(next_check_time=next_execution_time)
+    async def _process_query(self, fetch_url, next_execution_time):
+        """
+        Fetch & process a single query (or coalesced group of queries) and schedule its next execution.
+        A failing query gets marked as FAILED, without affecting the other queries.
+        """
+        async with self.query_semaphore:
+            try:
+                if self.cluster is not None and not await self._acquire_lease(fetch_url):
+                    # another worker still polls it (it's being handed over, it's released after its next heartbeat)
+                    # or it couldn't be taken over yet
+                    retry_time = datetime.now() + timedelta(seconds=self.cluster.heartbeat_interval)
+                    self.query_schedule.schedule(fetch_url, retry_time)
+                    self.schedule_changed.set()
+                    return
+
+                logging.info(f"Processing query: {fetch_url}")
+
+                listings = await self._fetch_listings(fetch_url)
+
+                # the queries we fetched for, they may have changed while fetching
+                subscribers = self.query_coalescer.subscribers(fetch_url)
+                if not subscribers:
+                    logging.warning(f"Request URL {fetch_url} was removed from the database while processing.")
+                    return
+
+                new_listing_count = 0
+                if listings is None:
+                    logging.info(f"No changes since the previous fetch: {fetch_url}")
+                else:
+                    new_listing_counts = await process_listings(
+                        {request_url: listings for request_url in subscribers}, self.publisher,
+                        self.latest_listing_cache, self.listing_diff,
+                        {request_url: f for request_url, f in subscribers.items() if f is not None},
+                        self.listing_enricher, self.query_ids, self.listing_messages
+                    )
+                    new_listing_count = max(new_listing_counts.values(), default=0)
+
+                if self.adaptive_intervals is not None:
+                    self.adaptive_intervals.record_poll(fetch_url, new_listing_count)
+                    interval = self.adaptive_intervals.interval(fetch_url)
+                    next_execution_time = datetime.now() + timedelta(seconds=interval)
+
+                self.query_schedule.schedule(fetch_url, next_execution_time)
+                self.schedule_changed.set()
+                logging.info(f"Next execution scheduled at {next_execution_time.strftime('%H:%M:%S')}: {fetch_url}")
+
+                for request_url in subscribers:
+                    self.schedule_state.set_next_check_time(request_url, next_execution_time)
 
             except Exception as e:
                 error_traceback = traceback.format_exc()
-                logging.error(f"Error processing query {request_url}: {type(e).__name__} - {str(e)}\n{error_traceback}")
-                await QueryInfo.filter(request_url=request_url).update(status=QueryStatus.FAILED)
-                logging.info(f"Marked query as FAILED: {request_url}")
-
-                await self.redis_client.publish(REQUEST_URL_ERROR_CHANNEL, json.dumps({
-                    "request_url": request_url,
-                    "error": type(e).__name__,
-                    "reason": str(e),
-                    "traceback": error_traceback
-                }))
+                logging.error(f"Error processing query {fetch_url}: {type(e).__name__} - {str(e)}\n{error_traceback}")
+                if self.query_coalescer.is_shared(fetch_url):
+                    # the broader search failed, which none of the queries asked for
+                    self._split_coalesced_fetch(fetch_url)
+                    return
+                for request_url in self.query_coalescer.subscribers(fetch_url):
+                    self.remove_query(request_url)
+                    self.query_state_writer.set_status(request_url, QueryStatus.FAILED)
+                    logging.info(f"Marked query as FAILED: {request_url}")
+
+                    await self.redis_client.publish(REQUEST_URL_ERROR_CHANNEL, json_codec.dumps({
+                        "request_url": request_url,
+                        "error": type(e).__name__,
+                        "reason": str(e),
+                        "traceback": error_traceback
+                    }))
+
+    def _split_coalesced_fetch(self, fetch_url):
+        """
+        Poll the queries of a coalesced fetch on their own request URLs from now on, right away.
+        Only the ones which fail on their own URL get marked as FAILED.
+        """
+        request_urls = self.query_coalescer.split(fetch_url)
+        self.query_schedule.remove(fetch_url)
+        self._forget_fetch_url(fetch_url)
+        now = datetime.now()
+        for request_url in request_urls:
+            self._forget_fetch_url(request_url)
+            self.query_schedule.schedule(request_url, now)
+            self.schedule_state.set_next_check_time(request_url, now)
+        self.schedule_changed.set()
+        logging.warning(f"Polling the {len(request_urls)} queries of the failed coalesced fetch {fetch_url} "
+                        f"on their own request URLs.")
+
+    def _rejoin_split_fetches(self):
+        """
+        Share the coalesced fetches again which were split a while ago (see QueryCoalescer.rejoin_splits),
+        at the earliest time one of their queries was due.
+        """
+        for fetch_url, previous_fetch_urls in self.query_coalescer.rejoin_splits().items():
+            next_execution_times = [self.query_schedule.get(previous_fetch_url)
+                                    for previous_fetch_url in previous_fetch_urls]
+            for previous_fetch_url in previous_fetch_urls:
+                self.query_schedule.remove(previous_fetch_url)
+                self._forget_fetch_url(previous_fetch_url)
+            self._forget_fetch_url(fetch_url)
+            next_execution_time = min((time for time in next_execution_times if time is not None),
+                                      default=datetime.now())
+            self.query_schedule.schedule(fetch_url, next_execution_time)
+            for request_url in self.query_coalescer.subscribers(fetch_url):
+                self.schedule_state.set_next_check_time(request_url, next_execution_time)
+            self.schedule_changed.set()
+            logging.info(f"Coalescing the {len(previous_fetch_urls)} queries of {fetch_url} again.")
+
+    async def _acquire_lease(self, fetch_url):
+        """
+        :return: whether this worker may poll the fetch URL, see NotifierCluster
+        """
+        newly_acquired = not self.cluster.holds(fetch_url)
+        try:
+            acquired = await self.cluster.acquire(fetch_url)
+        except Exception as e:
+            # without a lease, we can't know whether another worker polls it
+            logging.error(f"Couldn't acquire the lease of {fetch_url}: {type(e).__name__} - {e}")
+            return False
+        if not acquired:
+            logging.info(f"Query is leased by another worker: {fetch_url}")
+            return False
+        if newly_acquired:
+            # another worker may have polled these queries until now, continue where it stopped
+            try:
+                await self.latest_listing_cache.reload(self.query_coalescer.subscribers(fetch_url))
+            except Exception as e:
+                # polling it with outdated latest listings would notify listings again, retry the takeover later
+                logging.error(f"Couldn't load the latest listings of {fetch_url}: {type(e).__name__} - {e}")
+                await self._release_lease(fetch_url)
+                return False
+        return True
+
+    async def _release_lease(self, fetch_url):
+        try:
+            await self.cluster.release(fetch_url)
+        except Exception as e:
+            # it expires after the lease_ttl, this worker doesn't renew it anymore
+            logging.error(f"Couldn't release the lease of {fetch_url}: {type(e).__name__} - {e}")
+
+    async def _fetch_listings(self, request_url):
+        """
+        Fetch the listings of a request URL, parsed lazily or fully.
+        :return: None if the page didn't change since the previous fetch (only with skip_unchanged_pages)
+        """
+        if self.response_fingerprints is not None:
+            body = await get_changed_response(self.retry_client, request_url, self.response_fingerprints,
+                                              fingerprint=listings_fingerprint)
+            if body is None:
+                return None
+        elif self.lazy_listing_parse:
+            body = await get_request_response(self.retry_client, request_url, json_response=True, raw_response=True)
+        else:
+            result = await get_request_response(self.retry_client, request_url, json_response=True)
+            return result["listings"]
+        return parse_listings_lazily(body) if self.lazy_listing_parse else json_codec.loads(body)["listings"]
 
     def _log_upcoming_schedule(self):
         """
         Log the upcoming schedule for the next queries.
         """
         now = datetime.now()
-        upcoming_queries = [(url, time) for url, time in self.query_schedule.items() if time > now]
-        upcoming_queries.sort(key=lambda x: x[1])
+        upcoming_queries = self.query_schedule.upcoming(5)  # Log at most 5 upcoming queries
 
         if upcoming_queries:
             logging.info("Upcoming query executions:")
-            for i, (url, time) in enumerate(upcoming_queries[:5]):  # Log at most 5 upcoming queries
-                wait_time = (time - now).total_seconds()
+            for i, (url, time) in enumerate(upcoming_queries):
+                wait_time = max((time - now).total_seconds(), 0)
                 logging.info(f"  {i + 1}. {time.strftime('%H:%M:%S')} (in {wait_time:.0f}s): {url}")
 
-            if len(upcoming_queries) > 5:
-                logging.info(f"  ... and {len(upcoming_queries) - 5} more")
+            if len(self.query_schedule) > 5:
+                logging.info(f"  ... and {len(self.query_schedule) - 5} more")
 
 async def process_listings(
     request_url_all_listings_dict: Dict[str, List[Dict[Any, Any]]],
-    async_redis_client: redis.client
-) -> None:
+    publisher: Union[PubSubPublisher, StreamPublisher],
+    latest_listing_cache: LatestListingCache,
+    listing_diff: Optional[ListingDiff] = None,
+    listing_filters: Optional[Dict[str, CompiledFilter]] = None,
+    listing_enricher: Optional[ListingEnricher] = None,
+    query_ids: Optional[Dict[str, int]] = None,
+    listing_messages: ListingMessages = ListingMessages()
+) -> Dict[str, int]:
     """
     Processes listings for each request URL:
-    - Filters out ads and outdated listings.
-    - Updates the latest listing in the database.
-    - Publishes new listings to a Redis channel.
+    - Filters out ads and already seen listings.
+    - Filters out the new listings which don't match the request URL's local filter (listing_filters), if it has one.
+    - Updates the latest listing in the cache (which is flushed to the database).
+    - Publishes new listings to the Redis channel (or stream) with the publisher, as listing_messages says
+      (query_ids: the ID of the QueryInfo of the request URLs, for the channel & message).
+    - Hands the new listings to the listing_enricher, which publishes their details later.
+    :return: the amount of new listings per request URL
     """
+    listing_diff = listing_diff or ListingDiff()
+    new_listings_per_url = {}
     for request_url, listings in request_url_all_listings_dict.items():
         logging.info(f"Processing request URL: {request_url}")
 
-        # Check if the request URL exists in the database
-        if not await QueryInfo.exists(request_url=request_url):
-            logging.warning(f"Request URL {request_url} was removed from the database while processing.")
-            continue
+        latest_listing_id = latest_listing_cache.latest_item_id(request_url)
+        seen_window = latest_listing_cache.seen_window(request_url)
 
-        # Get the latest listing for the request URL from the database
-        latest_listing = await LatestListingInfoDB.filter(request_url=request_url).get_or_none()
-        latest_listing_id = int(latest_listing.item_id[1:]) if latest_listing else 0  # Remove 'm' prefix
+        # new non-ad listings (which weren't seen before), sorted by ID (newest first)
+        diff_result = listing_diff.diff(listings, latest_listing_id, seen_window)
+        latest_listing_cache.mark_seen(request_url, diff_result.seen_item_ids)
+        new_listings_per_url[request_url] = diff_result.new_listings
 
-        # Filter and sort new non-ad listings
-        new_listings = [
-            listing for listing in listings
-            if listing["priorityProduct"] == "NONE" and int(listing["itemId"][1:]) > latest_listing_id
-        ]
+    if listing_filters:
+        _apply_listing_filters(new_listings_per_url, listing_filters)
 
+    new_listing_counts = {}
+    for request_url, new_listings in new_listings_per_url.items():
+        new_listing_counts[request_url] = len(new_listings)
         if not new_listings:
             logging.info(f"No new non-ad listings for request URL: {request_url}")
             continue
 
-        new_listings.sort(key=lambda li: int(li["itemId"][1:]), reverse=True)  # Sort by ID (newest first)
-
         logging.info(f"Found {len(new_listings)} new non-ad listings for {request_url}.")
 
-        # Update the latest listing in the database
-        await _update_latest_listing(request_url, new_listings[0], latest_listing)
+        # Update the latest listing (the newest listing which passed the filter, which may not be the newest one)
+        latest_listing_id = latest_listing_cache.latest_item_id(request_url)
+        if parse_item_id(new_listings[0]["itemId"]) > latest_listing_id:
+            latest_listing_cache.update(request_url, new_listings[0]["itemId"], new_listings[0]["title"])
+            logging.info(f"Set latest listing for {request_url} to <item_id: {new_listings[0]['itemId']}, title: {new_listings[0]['title']}>.")
 
         # Publish new listings to Redis
-        await _publish_new_listings_to_redis(request_url, new_listings, async_redis_client)
+        query_id = query_ids.get(request_url) if query_ids else None
+        await _publish_new_listings_to_redis(request_url, new_listings, publisher, query_id, listing_messages)
+        if listing_enricher is not None:
+            listing_enricher.submit(request_url, new_listings, query_id)
+    return new_listing_counts
 
 
-async def _update_latest_listing(request_url: str, latest_listing: Dict[str, Any], db_latest_listing: LatestListingInfoDB) -> None:
+def _apply_listing_filters(new_listings_per_url: Dict[str, List[Dict[str, Any]]],
+                           listing_filters: Dict[str, CompiledFilter]) -> None:
     """
-    Updates the latest listing for a request URL in the database.
+    Keep only the new listings which pass their request URL's filter (in place).
+    The new listings of all request URLs are evaluated in one pass, each listing once,
+    and only new listings are evaluated, so only those have to be fully parsed.
     """
-    if db_latest_listing is None:
-        new_listing = LatestListingInfoDB(
-            request_url=request_url,
-            item_id=latest_listing["itemId"],
-            title=latest_listing["title"]
-        )
-        await new_listing.save()
-        logging.info(f"Set latest listing for {request_url} to <item_id: {latest_listing['itemId']}, title: {latest_listing['title']}>.")
-    else:
-        db_latest_listing.item_id = latest_listing["itemId"]
-        db_latest_listing.title = latest_listing["title"]
-        await db_latest_listing.save()
-        logging.info(f"Updated latest listing for {request_url} to <item_id: {latest_listing['itemId']}, title: {latest_listing['title']}>.")
-
-
-async def _publish_new_listings_to_redis(request_url: str, new_listings: List[Dict[str, Any]], async_redis_client: redis.client) -> None:
+    filtered_urls = [request_url for request_url in new_listings_per_url if request_url in listing_filters]
+    candidates, positions = [], {}  # every listing (by identity) which is new for a filtered request URL
+    for request_url in filtered_urls:
+        for listing in new_listings_per_url[request_url]:
+            if id(listing) not in positions:
+                positions[id(listing)] = len(candidates)
+                candidates.append(listing)
+
+    masks = evaluate_filters(candidates, {request_url: listing_filters[request_url] for request_url in filtered_urls})
+    for request_url in filtered_urls:
+        mask = masks[request_url]
+        new_listings_per_url[request_url] = [listing for listing in new_listings_per_url[request_url]
+                                             if mask >> positions[id(listing)] & 1]
+
+
+async def _publish_new_listings_to_redis(request_url: str, new_listings: List[Dict[str, Any]],
+                                         publisher: Union[PubSubPublisher, StreamPublisher], query_id: Optional[int],
+                                         listing_messages: ListingMessages) -> None:
     """
-    Publishes new listings to the Redis channel.
+    Publishes new listings to the Redis channel (or stream).
     """
-    message = {"request_url": request_url, "new_listings": new_listings}
-    await async_redis_client.publish("listings", json.dumps(message))
+    message = listing_messages.message(request_url, query_id, new_listings)
+    await publisher.publish(listing_messages.channel(query_id), json_codec.dumps(message))
     logging.info(f"Published {len(new_listings)} new listings for {request_url} to Redis.")
\ No newline at end of file
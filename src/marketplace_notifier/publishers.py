@@ -0,0 +1,149 @@
+"""
+How the notifier sends its messages (new listings, their details) to the consumers through Redis:
+- PubSubPublisher: PUBLISH on a channel, fire-and-forget. A consumer which isn't subscribed at that moment
+  (e.g. it's restarting) misses the message.
+- StreamPublisher: XADD to a stream (a Redis key with the same name as the channel). Consumers read it with a
+  consumer group (XREADGROUP) & acknowledge what they handled (XACK), so they can catch up after being down
+  & replay what they didn't acknowledge. The stream is trimmed to about maxlen messages.
+
+ListingMessages decides what goes in a "listings" (or "listing_details") message & on which channel it's sent.
+"""
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+from src.marketplace_notifier.lazy_listings import materialise_listing
+
+PUBSUB_OUTPUT = "pubsub"
+STREAM_OUTPUT = "stream"
+STREAM_MESSAGE_FIELD = "data"  # the field of a stream entry which holds the message
+
+LISTINGS_CHANNEL = "listings"
+LISTING_DETAILS_CHANNEL = "listing_details"
+FULL_PAYLOAD = "full"  # the listings as they are in the search response
+COMPACT_PAYLOAD = "compact"  # only COMPACT_FIELDS, enough to show a listing
+ID_ONLY_PAYLOAD = "id_only"  # only the itemId, fetch the details when needed (/item/batch)
+# no description, pictures (imageUrls has the thumbnail), attributes, traits, seller, ...
+COMPACT_FIELDS = ("itemId", "title", "priceInfo", "location", "date", "imageUrls", "categoryId", "vipUrl")
+# the details add what a listing doesn't have (enough of): the description, attributes & pictures
+DETAILS_COMPACT_FIELDS = COMPACT_FIELDS + ("description", "attributes", "pictures")
+PAYLOADS = (FULL_PAYLOAD, COMPACT_PAYLOAD, ID_ONLY_PAYLOAD)
+
+
+class ListingMessages(NamedTuple):
+    """
+    The new listings of a query are sent as
+    {"request_url": <request_url>, "query_id": <id of the QueryInfo>, "new_listings": [<listings>]},
+    their details (see ListingEnricher) as
+    {"request_url": <request_url>, "query_id": <id of the QueryInfo>, "item_id": <itemId>, "details": <details>}
+    payload: how much of every listing (& its details) is sent, see PAYLOADS
+    shard_by_query: send the listings of every query on its own channel, 'listings:<query_id>'
+    (& their details on 'listing_details:<query_id>'), so a consumer only receives (& decodes) the queries
+    it subscribes to (or PSUBSCRIBE 'listings:*' for all of them)
+    """
+    payload: str = FULL_PAYLOAD
+    shard_by_query: bool = False
+
+    def channel(self, query_id: Optional[int]) -> str:
+        """
+        a query of which the ID isn't known (yet) is sent on the LISTINGS_CHANNEL
+        """
+        return self._shard(LISTINGS_CHANNEL, query_id)
+
+    def details_channel(self, query_id: Optional[int]) -> str:
+        """
+        a query of which the ID isn't known (yet) is sent on the LISTING_DETAILS_CHANNEL
+        """
+        return self._shard(LISTING_DETAILS_CHANNEL, query_id)
+
+    def message(self, request_url: str, query_id: Optional[int],
+                new_listings: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {"request_url": request_url, "query_id": query_id,
+                "new_listings": [project_listing(listing, self.payload) for listing in new_listings]}
+
+    def details_message(self, request_url: str, query_id: Optional[int], item_id: str,
+                        details: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        without "details" for the ID_ONLY_PAYLOAD: it only says they're available (/item/batch)
+        """
+        message = {"request_url": request_url, "query_id": query_id, "item_id": item_id}
+        if self.payload == FULL_PAYLOAD:
+            message["details"] = details
+        elif self.payload == COMPACT_PAYLOAD:
+            message["details"] = {field: details[field] for field in DETAILS_COMPACT_FIELDS
+                                  if details.get(field) is not None}
+        elif self.payload != ID_ONLY_PAYLOAD:
+            raise ValueError(f"Unknown payload '{self.payload}', expected one of {PAYLOADS}")
+        return message
+
+    def _shard(self, channel: str, query_id: Optional[int]) -> str:
+        if not self.shard_by_query or query_id is None:
+            return channel
+        return f"{channel}:{query_id}"
+
+
+def project_listing(listing: Dict[str, Any], payload: str) -> Dict[str, Any]:
+    """
+    the part of a listing a payload sends (a LazyListing is only fully parsed when needed)
+    """
+    if payload == FULL_PAYLOAD:
+        return materialise_listing(listing)
+    if payload == COMPACT_PAYLOAD:
+        return {field: listing[field] for field in COMPACT_FIELDS if listing.get(field) is not None}
+    if payload == ID_ONLY_PAYLOAD:
+        return {"itemId": listing["itemId"]}
+    raise ValueError(f"Unknown payload '{payload}', expected one of {PAYLOADS}")
+
+
+class PubSubPublisher:
+    """
+    PUBLISH every message, logs a warning when nobody is listening (the message is lost)
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.published = 0
+        self.unheard = 0  # messages which no subscriber received
+        self._warned_unheard = False
+
+    async def publish(self, channel: str, message: Union[str, bytes]) -> None:
+        receivers = await self.redis_client.publish(channel, message)
+        self.published += 1
+        if receivers:
+            self._warned_unheard = False
+            return
+        self.unheard += 1
+        if not self._warned_unheard:
+            self._warned_unheard = True
+            logging.warning(f"Nobody is subscribed to the '{channel}' channel, its messages are lost "
+                            f"(use the stream output to keep them).")
+
+
+class StreamPublisher:
+    """
+    XADD every message to the stream named after its channel, trimmed to about maxlen messages
+    """
+
+    def __init__(self, redis_client, maxlen: Optional[int] = 10_000):
+        """
+        maxlen: max messages kept per stream (None = no limit), the stream is trimmed approximately (MAXLEN ~),
+        which is a lot cheaper than trimming it exactly
+        """
+        self.redis_client = redis_client
+        self.maxlen = maxlen
+        self.published = 0
+
+    async def publish(self, channel: str, message: Union[str, bytes]) -> None:
+        await self.redis_client.xadd(channel, {STREAM_MESSAGE_FIELD: message}, maxlen=self.maxlen,
+                                     approximate=True)
+        self.published += 1
+
+
+def create_publisher(output: str, redis_client, stream_maxlen: Optional[int] = 10_000):
+    """
+    output: PUBSUB_OUTPUT or STREAM_OUTPUT
+    """
+    if output == PUBSUB_OUTPUT:
+        return PubSubPublisher(redis_client)
+    if output == STREAM_OUTPUT:
+        return StreamPublisher(redis_client, stream_maxlen)
+    raise ValueError(f"Unknown output '{output}', expected '{PUBSUB_OUTPUT}' or '{STREAM_OUTPUT}'")
@@ -0,0 +1,184 @@
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, quote_plus, urlencode, urlsplit, urlunsplit
+
+from src.marketplace_notifier.local_filters import CompiledFilter, compile_filter
+
+
+def _parse_bound(value: str) -> Optional[int]:
+    return None if value in ("", "null") else int(value)
+
+
+def split_request_url(request_url: str) -> Tuple[str, CompiledFilter]:
+    """
+    Split a request URL in the broader search it's part of (the same query, category, postcode, ...)
+    and the filters to apply locally on the listings of that search: the price range & the distance.
+    Filters which can't be parsed stay part of the search.
+    """
+    parsed = urlsplit(request_url)
+    params = parse_qsl(parsed.query, keep_blank_values=True)
+    # distanceMeters is relative to the postcode, so only searches with the same postcode can be shared
+    has_postcode = any(key == "postcode" for key, _ in params)
+
+    search_params = []
+    min_price_cents = max_price_cents = max_distance_meters = None
+    for key, value in params:
+        try:
+            if key == "attributeRanges[]" and value.startswith("PriceCents:"):
+                _, low, high = value.split(":")
+                min_price_cents, max_price_cents = _parse_bound(low), _parse_bound(high)
+                continue
+            if key == "distanceMeters" and has_postcode:
+                max_distance_meters = int(value)
+                continue
+        except ValueError:
+            pass
+        search_params.append((key, value))
+
+    search_url = urlunsplit(parsed._replace(query=urlencode(search_params, quote_via=quote_plus)))
+    return search_url, compile_filter(min_price_cents=min_price_cents, max_price_cents=max_price_cents,
+                                      max_distance_meters=max_distance_meters)
+
+
+class QueryCoalescer:
+    """
+    Groups request URLs which are part of the same broader search (see split_request_url),
+    so the group is fetched once & the listings are fanned out to every request URL with its own local filter.
+
+    A group of a single request URL fetches that exact request URL: a broader search has fewer matching listings
+    on its page, so it's only worth it when the fetch is shared.
+    When the fetch of a broader search fails, its group can be split for a while (see split & rejoin_splits).
+    """
+
+    def __init__(self, enabled: bool = True, split_ttl: float = 30 * 60, clock: Callable[[], float] = time.monotonic):
+        """
+        enabled: False puts every request URL in a group of its own
+        split_ttl: seconds the request URLs of a split group are fetched on their own, before it's shared again
+        """
+        self.enabled = enabled
+        self.split_ttl = split_ttl
+        self.clock = clock
+        self._groups: Dict[str, Dict[str, CompiledFilter]] = {}  # Maps search URLs to {request URL: local filter}
+        self._search_urls: Dict[str, str] = {}  # Maps request URLs to the search URL of their group
+        # Maps the search URLs of which every request URL is fetched on its own to the time they may be shared again
+        self._split_searches: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        """
+        amount of groups, so fetches per round
+        """
+        return len(self._groups)
+
+    def __contains__(self, request_url: str) -> bool:
+        return request_url in self._search_urls
+
+    def fetch_urls(self) -> Iterator[str]:
+        return (self._fetch_url(search_url) for search_url in self._groups)
+
+    def fetch_url(self, request_url: str) -> Optional[str]:
+        """
+        :return: the URL which is fetched for a request URL, None if it isn't part of a group
+        """
+        search_url = self._search_urls.get(request_url)
+        return None if search_url is None else self._fetch_url(search_url)
+
+    def add(self, request_url: str) -> Tuple[Optional[str], str]:
+        """
+        :return: the fetch URL of the request URL's group before (None if it's a new group) & after adding it
+        """
+        if request_url in self._search_urls:
+            fetch_url = self.fetch_url(request_url)
+            return fetch_url, fetch_url
+
+        if self.enabled:
+            search_url, listing_filter = split_request_url(request_url)
+        if not self.enabled or search_url in self._split_searches:
+            search_url, listing_filter = request_url, CompiledFilter()
+        group = self._groups.setdefault(search_url, {})
+        previous_fetch_url = self._fetch_url(search_url) if group else None
+        group[request_url] = listing_filter
+        self._search_urls[request_url] = search_url
+        return previous_fetch_url, self._fetch_url(search_url)
+
+    def remove(self, request_url: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        :return: the fetch URL of the request URL's group before (None if it wasn't part of a group)
+        & after removing it (None if the group is gone)
+        """
+        search_url = self._search_urls.pop(request_url, None)
+        if search_url is None:
+            return None, None
+        previous_fetch_url = self._fetch_url(search_url)
+        group = self._groups[search_url]
+        del group[request_url]
+        if not group:
+            del self._groups[search_url]
+            return previous_fetch_url, None
+        return previous_fetch_url, self._fetch_url(search_url)
+
+    def is_shared(self, fetch_url: str) -> bool:
+        """
+        :return: whether the fetch URL is the broader search of several request URLs
+        """
+        group = self._groups.get(fetch_url)
+        return group is not None and len(group) > 1
+
+    def split(self, fetch_url: str) -> List[str]:
+        """
+        Stop sharing the fetch of a broader search (e.g. because it fails): every request URL of its group
+        (& every one added later) is fetched with its own URL for split_ttl seconds.
+        :return: the request URLs of the group, empty if the fetch URL isn't shared
+        """
+        if not self.is_shared(fetch_url):
+            return []
+        group = self._groups.pop(fetch_url)
+        self._split_searches[fetch_url] = self.clock() + self.split_ttl
+        for request_url in group:
+            self._groups[request_url] = {request_url: CompiledFilter()}
+            self._search_urls[request_url] = request_url
+        return list(group)
+
+    def rejoin_splits(self) -> Dict[str, List[str]]:
+        """
+        Share the fetch of the broader searches again of which the split expired.
+        :return: the fetch URL of every group which is shared again, with the fetch URLs it replaces
+        """
+        now = self.clock()
+        expired = {search_url for search_url, expiry in self._split_searches.items() if expiry <= now}
+        if not expired:
+            return {}
+        for search_url in expired:
+            del self._split_searches[search_url]
+
+        rejoined: Dict[str, List[str]] = {}
+        for request_url, search_url in list(self._search_urls.items()):
+            if search_url != request_url:
+                continue  # not fetched on its own
+            search_url, listing_filter = split_request_url(request_url)
+            if search_url not in expired:
+                continue
+            if request_url != search_url:
+                del self._groups[request_url]
+            self._groups.setdefault(search_url, {})[request_url] = listing_filter
+            self._search_urls[request_url] = search_url
+            rejoined.setdefault(search_url, []).append(request_url)
+        return {self._fetch_url(search_url): request_urls for search_url, request_urls in rejoined.items()
+                if len(request_urls) > 1}
+
+    def subscribers(self, fetch_url: str) -> Dict[str, Optional[CompiledFilter]]:
+        """
+        :return: the request URLs to fan the listings of a fetch URL out to, with the local filter to apply
+        (None if the listings don't need filtering), empty if nothing is fetched with this URL anymore
+        """
+        group = self._groups.get(fetch_url)
+        if group is not None and len(group) > 1:
+            return {request_url: None if listing_filter.is_empty else listing_filter
+                    for request_url, listing_filter in group.items()}
+        search_url = self._search_urls.get(fetch_url)
+        if search_url is not None and len(self._groups[search_url]) == 1:
+            return {fetch_url: None}
+        return {}
+
+    def _fetch_url(self, search_url: str) -> str:
+        group = self._groups[search_url]
+        return next(iter(group)) if len(group) == 1 else search_url
@@ -0,0 +1,65 @@
+import logging
+from typing import Dict
+
+from tortoise.transactions import in_transaction
+
+from src.shared.models import QueryInfo, QueryStatus
+
+# max amount of request URLs in a single "IN (...)" lookup, SQLite limits the amount of variables in a query
+LOOKUP_CHUNK_SIZE = 500
+
+
+class QueryStateWriter:
+    """
+    Collects the QueryInfo status updates made by the notifier (e.g. FAILED)
+    and writes them all in one transaction per flush, instead of one UPDATE per query.
+    Only the last update per request URL is written.
+    The next check times aren't written to the DB, see ScheduleStateWriter.
+    """
+
+    def __init__(self):
+        self._statuses: Dict[str, QueryStatus] = {}
+
+    def __len__(self) -> int:
+        return len(self._statuses)
+
+    def set_status(self, request_url: str, status: QueryStatus) -> None:
+        self._statuses[request_url] = status
+
+    def discard_status(self, request_url: str) -> None:
+        """
+        Drop a pending status update, e.g. when the status was changed through the webserver in the meantime.
+        """
+        self._statuses.pop(request_url, None)
+
+    async def flush(self) -> None:
+        """
+        Write all pending updates in one transaction, with one bulk UPDATE.
+        If it fails, updates which weren't overwritten in the meantime are retried on the next flush.
+        """
+        if not self._statuses:
+            return
+
+        statuses, self._statuses = self._statuses, {}
+        request_urls = list(statuses)
+
+        try:
+            # looked up before the transaction: a transaction which reads before it writes can't wait for the
+            # write lock in SQLite, it fails right away ("database is locked") when the webserver wrote in between
+            rows = []
+            for i in range(0, len(request_urls), LOOKUP_CHUNK_SIZE):
+                rows += await QueryInfo.filter(
+                    request_url__in=request_urls[i:i + LOOKUP_CHUNK_SIZE]
+                ).only("id", "request_url")
+
+            for row in rows:
+                row.status = statuses[row.request_url]
+            if rows:
+                async with in_transaction(QueryInfo._meta.default_connection) as connection:
+                    await QueryInfo.bulk_update(rows, fields=["status"], batch_size=LOOKUP_CHUNK_SIZE,
+                                                using_db=connection)
+        except Exception:
+            # newer updates (made while flushing) win over the ones we failed to write
+            self._statuses = {**statuses, **self._statuses}
+            raise
+        logging.info(f"Flushed state of {len(rows)} query(s) to the DB.")
@@ -0,0 +1,109 @@
+import heapq
+import itertools
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+class QuerySchedule:
+    """
+    Priority queue of request URLs, keyed on their next execution time.
+    Rescheduling or removing a URL doesn't touch the heap, the old heap entry just becomes stale
+    and is skipped (and dropped) when it reaches the top.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int, str]] = []
+        self._entries: Dict[str, Tuple[datetime, int]] = {}  # Maps request URLs to their valid heap entry
+        self._counter = itertools.count()  # tie-breaker, so URLs with the same time keep insertion order
+        self._latest_time: Optional[datetime] = None  # cached latest_time, None = recompute it
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, request_url: str) -> bool:
+        return request_url in self._entries
+
+    @property
+    def latest_time(self) -> Optional[datetime]:
+        """
+        :return: the latest scheduled execution time, None if nothing is scheduled
+        """
+        if self._latest_time is None and self._entries:
+            self._latest_time = max(execution_time for execution_time, _ in self._entries.values())
+        return self._latest_time
+
+    def schedule(self, request_url: str, execution_time: datetime) -> None:
+        """
+        (Re)schedule a request URL, replacing its previous execution time if it had one.
+        """
+        seq = next(self._counter)
+        previous = self._entries.get(request_url)
+        self._entries[request_url] = (execution_time, seq)
+        heapq.heappush(self._heap, (execution_time, seq, request_url))
+        if previous is not None and execution_time < previous[0]:
+            self._unscheduled(previous[0])
+        elif self._latest_time is not None and execution_time > self._latest_time:
+            self._latest_time = execution_time
+        self._compact_if_needed()
+
+    def remove(self, request_url: str) -> bool:
+        """
+        Unschedule a request URL.
+        :return: whether the URL was scheduled
+        """
+        entry = self._entries.pop(request_url, None)
+        if entry is None:
+            return False
+        self._unscheduled(entry[0])
+        return True
+
+    def get(self, request_url: str) -> Optional[datetime]:
+        entry = self._entries.get(request_url)
+        return entry[0] if entry else None
+
+    def next_time(self) -> Optional[datetime]:
+        """
+        :return: the earliest scheduled execution time, None if nothing is scheduled
+        """
+        self._drop_stale_top()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> List[str]:
+        """
+        Remove and return all request URLs which are due at the given time, earliest first.
+        """
+        due = []
+        while True:
+            self._drop_stale_top()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            execution_time, _, request_url = heapq.heappop(self._heap)
+            del self._entries[request_url]
+            self._unscheduled(execution_time)
+            due.append(request_url)
+
+    def upcoming(self, amount: int) -> List[Tuple[str, datetime]]:
+        """
+        :return: the first `amount` scheduled (request URL, execution time) pairs, earliest first
+        """
+        valid_entries = (entry for entry in self._heap if self._is_valid(entry))
+        return [(url, time) for time, _, url in heapq.nsmallest(amount, valid_entries)]
+
+    def _unscheduled(self, execution_time: datetime) -> None:
+        # the latest time has to be recomputed when it isn't scheduled anymore
+        if execution_time == self._latest_time:
+            self._latest_time = None
+
+    def _is_valid(self, heap_entry: Tuple[datetime, int, str]) -> bool:
+        execution_time, seq, request_url = heap_entry
+        return self._entries.get(request_url) == (execution_time, seq)
+
+    def _drop_stale_top(self) -> None:
+        while self._heap and not self._is_valid(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def _compact_if_needed(self) -> None:
+        # rebuild the heap when it's mostly stale entries, so it can't grow unbounded
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(time, seq, url) for url, (time, seq) in self._entries.items()]
+            heapq.heapify(self._heap)
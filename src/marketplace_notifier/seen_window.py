@@ -0,0 +1,77 @@
+import sys
+from array import array
+from typing import Iterable, Iterator, Set
+
+
+class SeenWindow:
+    """
+    The item IDs of the last `capacity` listings seen for a query, in a ring buffer.
+    Stored as an array of 64-bit ints (8 bytes per ID), so thousands of queries stay cheap in memory.
+
+    A listing is new when its ID isn't in the window & is above the window's floor (its lowest ID):
+    listings which show up late or get bumped aren't missed/re-sent, as long as they're younger than the floor.
+    """
+    __slots__ = ("capacity", "_ids", "_next")
+
+    def __init__(self, capacity: int, item_ids: Iterable[int] = ()):
+        """
+        item_ids: oldest first, only the last `capacity` ones are kept
+        """
+        self.capacity = capacity
+        self._ids = array("q")
+        self._next = 0  # position in the ring buffer which gets overwritten next, once it's full
+        self.extend(item_ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[int]:
+        """
+        oldest first
+        """
+        yield from self._ids[self._next:]
+        yield from self._ids[:self._next]
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._ids
+
+    @property
+    def floor(self) -> int:
+        """
+        lowest item ID in the window, 0 if it's empty
+        """
+        return min(self._ids, default=0)
+
+    def snapshot(self) -> Set[int]:
+        """
+        set of the IDs in the window, for many lookups at once
+        """
+        return set(self._ids)
+
+    def add(self, item_id: int) -> None:
+        if len(self._ids) < self.capacity:
+            self._ids.append(item_id)
+            return
+        self._ids[self._next] = item_id
+        self._next = (self._next + 1) % self.capacity
+
+    def extend(self, item_ids: Iterable[int]) -> None:
+        """
+        item_ids: oldest first
+        """
+        for item_id in item_ids:
+            self.add(item_id)
+
+    def to_bytes(self) -> bytes:
+        ids = array("q", self)
+        if sys.byteorder == "big":
+            ids.byteswap()  # always stored little-endian
+        return ids.tobytes()
+
+    @classmethod
+    def from_bytes(cls, capacity: int, data: bytes) -> "SeenWindow":
+        ids = array("q")
+        ids.frombytes(data)
+        if sys.byteorder == "big":
+            ids.byteswap()
+        return cls(capacity, ids)
@@ -1,22 +1,41 @@
+import hashlib
 import logging
 from http import HTTPStatus
 from types import SimpleNamespace
-from typing import Optional, Dict, Any, Iterable, Type
+from typing import Optional, Dict, Any, Iterable, Type, Callable, NamedTuple, Mapping, Tuple
 
 from aiohttp_retry import RetryClient, ExponentialRetry, RetryOptions
-from aiohttp import (ClientSession, TraceConfig, TraceRequestStartParams, TraceRequestEndParams,
+from src.shared import json_codec
+from src.shared.connection_pool import ConnectorProfile, ConnectionStats
+from src.shared.rate_limiter import RateGovernor
+from src.shared.retry_diagnostics import RetryDiagnostics
+from aiohttp import (ClientSession, ClientResponse, TraceConfig, TraceRequestStartParams, TraceRequestEndParams,
                      ClientConnectorDNSError)
 
 
-def get_retry_client(exceptions: Iterable[Type[Exception]] = None, statuses: Iterable[int] = None) -> RetryClient:
+ITEM_DETAILS_URL = "https://app.2dehands.be/app/vip/v4/item/{item_id}"
+ITEM_DETAILS_HEADERS = {"ecg-locale": "nl-BE", "content-type": "application/json"}
+
+
+def get_retry_client(exceptions: Iterable[Type[Exception]] = None, statuses: Iterable[int] = None,
+                     rate_governor: Optional[RateGovernor] = None,
+                     connector_profile: Optional[ConnectorProfile] = None,
+                     connection_stats: Optional[ConnectionStats] = None,
+                     retry_diagnostics: Optional[RetryDiagnostics] = None) -> RetryClient:
     """
     RetryClient which includes logging the retries
+    ! call it with a running event loop
     exceptions: exceptions to retry on
     statuses: HTTP status codes to retry on
+    rate_governor: every request (& retry) waits for it before starting & reports its status to it
+    connector_profile: connection pool settings (None = aiohttp's defaults), see SEARCH_CONNECTOR_PROFILE
+    connection_stats: records the new & reused connections of this client
+    retry_diagnostics: records why requests were retried or failed (a new one if not given),
+    available as the retry_diagnostics attribute of the client
     """
 
     # Store last error/status for retry logging
-    last_error_info = {}
+    retry_diagnostics = RetryDiagnostics() if retry_diagnostics is None else retry_diagnostics
 
     # Callback to capture response status
     async def on_request_end(
@@ -26,11 +45,13 @@ def get_retry_client(exceptions: Iterable[Type[Exception]] = None, statuses: Ite
     ) -> None:
         status = params.response.status
         url = str(params.url)
+        if rate_governor is not None:
+            await rate_governor.report(url, status)
 
         # store status if it might trigger a retry (4xx/5xx) ! this depends on the retry_options!
+        # the body isn't read here: it's up to the caller (& only a final failure keeps a snippet of it)
         if status >= 400:
-            response_text = await params.response.text()
-            last_error_info[url] = {"status": status, "reason": params.response.reason, "text": response_text}
+            retry_diagnostics.record_error(url, status, params.response.reason)
 
     # Callback to log retries (but skip first attempt)
     async def on_request_start(
@@ -38,21 +59,21 @@ def get_retry_client(exceptions: Iterable[Type[Exception]] = None, statuses: Ite
             trace_config_ctx: SimpleNamespace,
             params: TraceRequestStartParams,
     ) -> None:
+        if rate_governor is not None:
+            await rate_governor.acquire(str(params.url))
         current_attempt = trace_config_ctx.trace_request_ctx['current_attempt']
         if current_attempt > 1:  # the attempts are 1 based!
             url = str(params.url)
 
             # Get the error/status that caused this retry
-            error_reason = last_error_info.get(url, "Unknown reason")
+            error = retry_diagnostics.record_retry(url)
+            error_reason = f"{error.status} {error.reason}" if error else "Unknown reason"
 
             logging.warning(
                 f"Retrying attempt {current_attempt}/{retry_options.attempts} for URL: {params.url} "
                 f"due to {error_reason}"
             )
 
-            # clean up
-            last_error_info.pop(url, None)
-
     trace_config = TraceConfig()
     trace_config.on_request_start.append(on_request_start)
     trace_config.on_request_end.append(on_request_end)
@@ -60,26 +81,45 @@ def get_retry_client(exceptions: Iterable[Type[Exception]] = None, statuses: Ite
     # default ClientDNSError, this is raised when the internet seems down
     exceptions = {ClientConnectorDNSError} if exceptions is None else {ClientConnectorDNSError, *exceptions}
     retry_options = ExponentialRetry(attempts=4, start_timeout=3.0, exceptions=exceptions, statuses=statuses)
-    return RetryClient(
+    trace_configs = [trace_config]
+    if connection_stats is not None:
+        trace_configs.append(connection_stats.trace_config())
+    session_kwargs = {}
+    if connector_profile is not None:
+        session_kwargs["connector"] = connector_profile.create_connector()
+    retry_client = RetryClient(
         retry_options=retry_options,
-        trace_configs=[trace_config],
-        raise_for_status=False
+        trace_configs=trace_configs,
+        raise_for_status=False,
+        **session_kwargs
     )
+    retry_client.retry_diagnostics = retry_diagnostics
+    return retry_client
+
+
+async def _record_failure(retry_client: RetryClient, URI: str, response: ClientResponse) -> None:
+    """
+    keep the status & the start of the body of a request which failed after all retries in the client's diagnostics
+    ! call it before the response is released
+    """
+    retry_diagnostics = getattr(retry_client, "retry_diagnostics", None)
+    if retry_diagnostics is None:
+        return
+    try:
+        body = await response.content.read(retry_diagnostics.snippet_length)
+    except Exception:
+        body = None
+    retry_diagnostics.record_failure(URI, response.status, response.reason, body)
 
 async def get_request_response(retry_client: RetryClient, URI: str,
-                               headers: Optional[Dict] = None, json_response: bool = True, retry_options: RetryOptions = None) -> Any:
+                               headers: Optional[Dict] = None, json_response: bool = True, retry_options: RetryOptions = None,
+                               raw_response: bool = False) -> Any:
     """
     uses client_session with given headers and a user-agent
     logs errors
+    raw_response: return the undecoded body (bytes), so the caller can decide what to parse
     """
-    if headers is None:
-        headers = {
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36"}
-    elif "user-agent" not in headers:
-        headers = dict(headers, **{
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36"})
-    if json_response:
-        headers["accept"] = "application/json"
+    headers = _with_default_headers(headers, json_response)
 
     logging.info("making request for %s", URI)
     # TODO: handle exception when we lose connection (or when server refuses)
@@ -93,12 +133,134 @@ aiohttp.client_exceptions.ClientConnectorError: Cannot connect to host www.2deha
     # aiohttp.client_exceptions.ClientConnectorDNSError: Cannot connect to host www.2dehands.be:443 ssl:default [getaddrinfo failed]
     async with retry_client.get(URI, headers=headers, retry_options=ro) as response:
         if response.status == HTTPStatus.OK:
+            if raw_response:
+                return await response.read()
             if not json_response:
                 return await response.text()
-            return await response.json()
+            return await response.json(loads=json_codec.loads)
         elif response.status == HTTPStatus.NO_CONTENT:
             logging.info(f"Requested URI: {URI} returns no content...")
             return ""
+        await _record_failure(retry_client, URI, response)
     logging.error(f"Failed {URI} after multiple retries, got error {response.status}\n{response}\n------")
 
     response.raise_for_status()
+
+
+def _with_default_headers(headers: Optional[Dict], json_response: bool) -> Dict:
+    if headers is None:
+        headers = {
+            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36"}
+    elif "user-agent" not in headers:
+        headers = dict(headers, **{
+            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36"})
+    if json_response:
+        headers["accept"] = "application/json"
+    return headers
+
+
+def body_digest(body: bytes) -> bytes:
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class Fingerprint(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    digest: bytes
+
+
+class ResponseFingerprints:
+    """
+    The last seen version of the response per URI, to find out whether it changed since the previous request:
+    the ETag / Last-Modified validators when the server sends them (so it can answer 304 Not Modified),
+    a digest of the body otherwise.
+    """
+
+    def __init__(self):
+        self._fingerprints: Dict[str, Fingerprint] = {}
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def conditional_headers(self, URI: str) -> Dict[str, str]:
+        fingerprint = self._fingerprints.get(URI)
+        if fingerprint is None:
+            return {}
+        headers = {}
+        if fingerprint.etag:
+            headers["if-none-match"] = fingerprint.etag
+        if fingerprint.last_modified:
+            headers["if-modified-since"] = fingerprint.last_modified
+        return headers
+
+    def update(self, URI: str, body: bytes, response_headers: Mapping[str, str],
+               fingerprint: Callable[[bytes], bytes] = body_digest) -> bool:
+        """
+        Store the fingerprint of a (200 OK) response.
+        fingerprint: digests the body, only the parts of the body it covers count as a change
+        :return: whether the response changed since the previous one (True if there's no previous one)
+        """
+        new = Fingerprint(response_headers.get("etag"), response_headers.get("last-modified"), fingerprint(body))
+        previous = self._fingerprints.get(URI)
+        self._fingerprints[URI] = new
+        return previous is None or previous.digest != new.digest
+
+    def discard(self, URI: str) -> None:
+        """
+        Forget a URI, the next response for it counts as changed.
+        """
+        self._fingerprints.pop(URI, None)
+
+
+async def get_changed_response(retry_client: RetryClient, URI: str, fingerprints: ResponseFingerprints,
+                               headers: Optional[Dict] = None, retry_options: RetryOptions = None,
+                               fingerprint: Callable[[bytes], bytes] = body_digest) -> Optional[bytes]:
+    """
+    Conditional GET: like get_request_response with raw_response, but returns None when the response didn't change
+    since the previous call for this URI (304 Not Modified or the same fingerprint), so the caller can skip decoding it.
+    """
+    headers = dict(_with_default_headers(headers, json_response=True), **fingerprints.conditional_headers(URI))
+
+    logging.info("making conditional request for %s", URI)
+    ro = retry_options or retry_client.retry_options
+    async with retry_client.get(URI, headers=headers, retry_options=ro) as response:
+        if response.status == HTTPStatus.NOT_MODIFIED:
+            return None
+        if response.status == HTTPStatus.OK:
+            body = await response.read()
+            if not fingerprints.update(URI, body, response.headers, fingerprint):
+                return None
+            return body
+        elif response.status == HTTPStatus.NO_CONTENT:
+            logging.info(f"Requested URI: {URI} returns no content...")
+            return b""
+        await _record_failure(retry_client, URI, response)
+    logging.error(f"Failed {URI} after multiple retries, got error {response.status}\n{response}\n------")
+
+    response.raise_for_status()
+
+
+async def fetch_item_details(retry_client: RetryClient, item_id: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+    """
+    the details of a listing (item_id is the itemId of the Listing, e.g. "m2141361524"), as shown on its page
+    :return: the status & decoded body, None for 404 (the item doesn't exist)
+    a 400 with "code" LISTING_NOT_FOUND means the listing exists, but its details aren't available yet
+    (see is_listing_not_found): retrying a bit later will most likely get them
+    """
+    async with retry_client.post(ITEM_DETAILS_URL.format(item_id=item_id), headers=ITEM_DETAILS_HEADERS) as response:
+        status = response.status
+        if status == HTTPStatus.NOT_FOUND:
+            # "code" will be "NOT_FOUND"
+            return status, None
+        # status 403 means we're ratelimited by cloudfront (the RateGovernor of the client slows down when it happens)
+        details = await response.json(loads=json_codec.loads)
+    if isinstance(details, dict) and details.get("recommendedItems"):
+        del details["recommendedItems"]
+    return status, details
+
+
+def is_listing_not_found(status: int, details: Optional[Dict[str, Any]]) -> bool:
+    """
+    whether fetch_item_details was too soon: the details of the listing aren't available yet
+    """
+    return status == HTTPStatus.BAD_REQUEST and isinstance(details, dict) and details.get("code") == "LISTING_NOT_FOUND"
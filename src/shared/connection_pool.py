@@ -0,0 +1,122 @@
+"""
+Connection pool settings for the HTTP clients & statistics on how well the connections are reused.
+aiohttp only speaks HTTP/1.1, so a connection is reused by keeping it alive between requests (no HTTP/2 multiplexing):
+every new connection to 2dehands costs a TCP & TLS handshake.
+"""
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Dict, NamedTuple, Optional
+
+from aiohttp import TCPConnector, TraceConfig
+
+
+class ConnectorProfile(NamedTuple):
+    limit: int = 100  # max open connections of the whole pool
+    limit_per_host: int = 0  # max open connections per host (0 = only limited by limit)
+    ttl_dns_cache: Optional[int] = 10  # seconds a resolved host is cached (None = forever)
+    keepalive_timeout: float = 15  # seconds an idle connection is kept open for reuse
+    enable_cleanup_closed: bool = False  # abort SSL connections the server didn't close properly
+
+    def create_connector(self) -> TCPConnector:
+        """
+        ! call it with a running event loop
+        """
+        return TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=self.ttl_dns_cache,
+                            keepalive_timeout=self.keepalive_timeout,
+                            enable_cleanup_closed=self.enable_cleanup_closed)
+
+
+# the search API (www.2dehands.be) is polled continuously by the notifier: a few connections which stay alive
+# longer than the time between 2 polls, so (nearly) every poll reuses one
+SEARCH_CONNECTOR_PROFILE = ConnectorProfile(limit=16, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=60)
+# the item API (app.2dehands.be) gets bursts of requests for the details of new listings
+ITEM_CONNECTOR_PROFILE = ConnectorProfile(limit=32, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=30)
+
+
+class ConnectionStats:
+    """
+    Counts new & reused connections (and how long it took to get them) of the clients it's hooked into,
+    see trace_config().
+    A new connection to an https URL is a TLS handshake.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.tls_handshakes = 0
+        self.connect_seconds = 0.0  # total time spent opening new connections (DNS, TCP & TLS)
+        self.queued = 0  # times a request had to wait for a free connection (the pool limit was reached)
+        self.queued_seconds = 0.0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    @property
+    def reuse_rate(self) -> float:
+        """
+        fraction of the connections which was reused
+        """
+        connections = self.new_connections + self.reused_connections
+        return self.reused_connections / connections if connections else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "reuse_rate": round(self.reuse_rate, 3),
+            "tls_handshakes": self.tls_handshakes,
+            "avg_connect_ms": round(self.connect_seconds / self.new_connections * 1000, 1)
+            if self.new_connections else None,
+            "queued": self.queued,
+            "avg_queued_ms": round(self.queued_seconds / self.queued * 1000, 1) if self.queued else None,
+            "dns_cache_hits": self.dns_cache_hits,
+            "dns_cache_misses": self.dns_cache_misses,
+        }
+
+    def trace_config(self) -> TraceConfig:
+        """
+        TraceConfig which records the connections of a ClientSession in these stats
+        """
+        def now() -> float:
+            return asyncio.get_running_loop().time()
+
+        async def on_request_start(session, ctx: SimpleNamespace, params) -> None:
+            self.requests += 1
+            ctx.is_tls = params.url.scheme in ("https", "wss")
+
+        async def on_connection_create_start(session, ctx: SimpleNamespace, params) -> None:
+            ctx.connect_start = now()
+
+        async def on_connection_create_end(session, ctx: SimpleNamespace, params) -> None:
+            self.new_connections += 1
+            if getattr(ctx, "is_tls", False):
+                self.tls_handshakes += 1
+            self.connect_seconds += now() - ctx.connect_start
+
+        async def on_connection_reuseconn(session, ctx: SimpleNamespace, params) -> None:
+            self.reused_connections += 1
+
+        async def on_connection_queued_start(session, ctx: SimpleNamespace, params) -> None:
+            ctx.queued_start = now()
+
+        async def on_connection_queued_end(session, ctx: SimpleNamespace, params) -> None:
+            self.queued += 1
+            self.queued_seconds += now() - ctx.queued_start
+
+        async def on_dns_cache_hit(session, ctx: SimpleNamespace, params) -> None:
+            self.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(session, ctx: SimpleNamespace, params) -> None:
+            self.dns_cache_misses += 1
+
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(on_connection_queued_end)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
@@ -1 +1,9 @@
-TWEEDEHANDS_BROWSER_URL_REGEX = r'^https:\/\/www\.2dehands\.be\/(?:q|l)\/[^?]+'
\ No newline at end of file
+TWEEDEHANDS_BROWSER_URL_REGEX = r'^https:\/\/www\.2dehands\.be\/(?:q|l)\/[^?]+'
+# the itemId of a listing (e.g. m2141361524), it's part of the URL of the item API & of the item cache keys
+ITEM_ID_REGEX = r'^m\d+$'
+# the webserver publishes every change to the monitored queries on this channel, so the notifier doesn't have to poll the DB
+# '{"action": "added" | "status" | "deleted", "id": <id>, "request_url": <request_url>, "status": <status>}'
+QUERY_CHANGES_CHANNEL = "query_changes"
+# the notifier keeps the next check time of every query in this sorted set (request URL => timestamp),
+# the webserver shows it in the QueryInfos instead of the DB column (see schedule_state.py)
+QUERY_SCHEDULE_KEY = "query_schedule"
@@ -0,0 +1,62 @@
+"""
+JSON encoding & decoding for the hot paths (API responses, Redis messages, webserver responses).
+Uses orjson or msgspec when one of them is installed (both are native & a lot faster), the json module otherwise.
+The output is always compact UTF-8 JSON, whatever the backend.
+"""
+import json
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+elif msgspec is not None:
+    BACKEND = "msgspec"
+else:
+    BACKEND = "json"
+
+if msgspec is not None:
+    _msgspec_decoder = msgspec.json.Decoder()
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """
+    raises ValueError (json.JSONDecodeError for the json module) on invalid JSON, whatever the backend
+    """
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    if BACKEND == "msgspec":
+        try:
+            return _msgspec_decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    return json.loads(data)
+
+
+def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None, sort_keys: bool = False) -> bytes:
+    """
+    default: called for objects which can't be serialized (like json.dumps),
+    when given it's also called for datetimes & non-str dict keys are converted to str (e.g. the status codes of the
+    OpenAPI schema), so the output is the same as with the json module
+    """
+    if BACKEND == "orjson":
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        if default is not None:
+            option |= orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+    if BACKEND == "msgspec" and default is None:
+        # msgspec serializes datetimes itself (ISO 8601), so a default has to go through the json module
+        return msgspec.json.encode(obj, order="sorted" if sort_keys else None)
+    return json.dumps(obj, default=default, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj: Any, default: Optional[Callable[[Any], Any]] = None, sort_keys: bool = False) -> str:
+    return dumps(obj, default=default, sort_keys=sort_keys).decode("utf-8")
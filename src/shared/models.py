@@ -33,6 +33,7 @@ class QueryInfo(Model):
             re.M)],
         description="url to use for GET request"
     )
+    # not written anymore, the webserver fills it in from the notifier's schedule in Redis (see schedule_state.py)
     next_check_time = fields.DatetimeField(null=True, description="When this query will be checked next")
     status = fields.CharEnumField(
         QueryStatus,
@@ -0,0 +1,200 @@
+"""
+One request budget for all 2dehands traffic, shared by the notifier & the webserver through Redis.
+
+Every endpoint class (search, item details, ...) has a token bucket: requests take a token & wait when the bucket is
+empty. The rate the bucket refills at is adapted to what 2dehands tolerates (AIMD): it's halved when we get throttled
+(403 from CloudFront, 429, 400 for the search API) and grows back step by step with every successful request.
+When Redis can't be reached, the same buckets are kept in memory, so every process respects the budget on its own.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, FrozenSet, NamedTuple, Optional
+from urllib.parse import urlparse
+
+SEARCH_ENDPOINT = "search"
+ITEM_ENDPOINT = "item"
+OTHER_ENDPOINT = "other"
+
+
+class EndpointLimit(NamedTuple):
+    rate: float  # max requests per second, the rate we start at & grow back to
+    burst: float  # max requests which can start at once (bucket size)
+    min_rate: float  # the rate is never lowered below this
+    throttle_statuses: FrozenSet[int] = frozenset({403, 429})  # statuses which mean we're going too fast
+    decrease_factor: float = 0.5  # the rate is multiplied by this when throttled
+    increase_step: float = 0.05  # requests per second added to the rate for every successful request
+    cooldown: float = 30  # seconds after being throttled in which the rate isn't increased or lowered again
+
+
+DEFAULT_LIMITS = {
+    # the search API answers 400 after a while of fetching too fast
+    SEARCH_ENDPOINT: EndpointLimit(rate=2, burst=2, min_rate=0.1, throttle_statuses=frozenset({400, 403, 429})),
+    # 400 is a valid answer of the item API (LISTING_NOT_FOUND: the details aren't available yet)
+    ITEM_ENDPOINT: EndpointLimit(rate=1, burst=3, min_rate=0.05),
+    OTHER_ENDPOINT: EndpointLimit(rate=5, burst=5, min_rate=0.5),
+}
+
+
+def endpoint_class(url: str) -> str:
+    path = urlparse(str(url)).path
+    if path.startswith("/lrp/api/search"):
+        return SEARCH_ENDPOINT
+    if path.startswith("/app/vip/"):
+        return ITEM_ENDPOINT
+    return OTHER_ENDPOINT
+
+
+# token bucket, tokens below 0 are reservations of requests which are waiting
+# KEYS[1]: bucket, ARGV: now, rate, burst  => seconds to wait before the request may start
+_ACQUIRE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'rate')
+local now = tonumber(ARGV[1])
+local rate = tonumber(state[3]) or tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate) - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now), 'rate', tostring(rate))
+redis.call('EXPIRE', KEYS[1], 3600)
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+# AIMD on the rate of the bucket
+# KEYS[1]: bucket, ARGV: now, throttled (0/1), rate, min_rate, decrease_factor, increase_step, cooldown  => new rate
+_REPORT_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'rate', 'penalty_until')
+local now = tonumber(ARGV[1])
+local max_rate = tonumber(ARGV[3])
+local rate = tonumber(state[1]) or max_rate
+local penalty_until = tonumber(state[2]) or 0
+if now >= penalty_until then
+    if ARGV[2] == '1' then
+        rate = math.max(tonumber(ARGV[4]), rate * tonumber(ARGV[5]))
+        penalty_until = now + tonumber(ARGV[7])
+    else
+        rate = math.min(max_rate, rate + tonumber(ARGV[6]))
+    end
+    redis.call('HSET', KEYS[1], 'rate', tostring(rate), 'penalty_until', tostring(penalty_until))
+    redis.call('EXPIRE', KEYS[1], 3600)
+end
+return tostring(rate)
+"""
+
+
+class _LocalBucket:
+    """
+    in-memory version of the Redis scripts above
+    """
+
+    def __init__(self, limit: EndpointLimit, now: float):
+        self.limit = limit
+        self.rate = limit.rate
+        self.tokens = limit.burst
+        self.updated = now
+        self.penalty_until = 0.0
+
+    def acquire(self, now: float) -> float:
+        self.tokens = min(self.limit.burst, self.tokens + max(0.0, now - self.updated) * self.rate) - 1
+        self.updated = now
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def report(self, now: float, throttled: bool) -> float:
+        if now >= self.penalty_until:
+            if throttled:
+                self.rate = max(self.limit.min_rate, self.rate * self.limit.decrease_factor)
+                self.penalty_until = now + self.limit.cooldown
+            else:
+                self.rate = min(self.limit.rate, self.rate + self.limit.increase_step)
+        return self.rate
+
+
+class RateGovernor:
+    """
+    Token bucket & adaptive rate per endpoint class (see the module docstring), shared through Redis if given.
+    Hook it into a RetryClient with get_retry_client(rate_governor=...), so retries go through it as well.
+    """
+
+    def __init__(self, redis_client=None, limits: Optional[Dict[str, EndpointLimit]] = None,
+                 key_prefix: str = "rate_governor"):
+        """
+        redis_client: redis.asyncio client to share the buckets with other processes (None = this process only)
+        limits: EndpointLimit per endpoint class (see endpoint_class), defaults to DEFAULT_LIMITS
+        """
+        self.redis_client = redis_client
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.key_prefix = key_prefix
+        self._local_buckets: Dict[str, _LocalBucket] = {}
+        self._using_redis = redis_client is not None
+        if redis_client is not None:
+            self._acquire_script = redis_client.register_script(_ACQUIRE_SCRIPT)
+            self._report_script = redis_client.register_script(_REPORT_SCRIPT)
+
+    async def acquire(self, url: str) -> None:
+        """
+        Wait until a request to url may start.
+        """
+        endpoint = endpoint_class(url)
+        limit = self.limits[endpoint]
+        now = time.time()
+        delay = None
+        if self.redis_client is not None:
+            try:
+                delay = float(await self._acquire_script(keys=[self._key(endpoint)],
+                                                         args=[now, limit.rate, limit.burst]))
+                self._redis_available()
+            except Exception as e:
+                self._redis_unavailable(e)
+        if delay is None:
+            delay = self._local_bucket(endpoint, now).acquire(now)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def report(self, url: str, status: int) -> None:
+        """
+        Adapt the rate of url's endpoint class to the status of a finished request.
+        """
+        endpoint = endpoint_class(url)
+        limit = self.limits[endpoint]
+        throttled = status in limit.throttle_statuses
+        if not throttled and status >= 400:
+            return  # an error which doesn't tell anything about the rate
+        now = time.time()
+        rate = None
+        if self.redis_client is not None:
+            try:
+                rate = float(await self._report_script(keys=[self._key(endpoint)], args=[
+                    now, int(throttled), limit.rate, limit.min_rate, limit.decrease_factor, limit.increase_step,
+                    limit.cooldown
+                ]))
+                self._redis_available()
+            except Exception as e:
+                self._redis_unavailable(e)
+        if rate is None:
+            rate = self._local_bucket(endpoint, now).report(now, throttled)
+        if throttled:
+            logging.warning(f"Throttled by 2dehands ({status}) on the {endpoint} endpoint, "
+                            f"rate is now {rate:.2f} requests per second.")
+
+    def _key(self, endpoint: str) -> str:
+        return f"{self.key_prefix}:{endpoint}"
+
+    def _local_bucket(self, endpoint: str, now: float) -> _LocalBucket:
+        bucket = self._local_buckets.get(endpoint)
+        if bucket is None:
+            bucket = self._local_buckets[endpoint] = _LocalBucket(self.limits[endpoint], now)
+        return bucket
+
+    def _redis_available(self) -> None:
+        if not self._using_redis:
+            self._using_redis = True
+            logging.info("Rate governor: Redis is back, sharing the request budget again.")
+
+    def _redis_unavailable(self, e: Exception) -> None:
+        if self._using_redis:
+            self._using_redis = False
+            logging.warning(f"Rate governor: Redis unavailable ({type(e).__name__} - {e}), "
+                            f"falling back to a request budget for this process only.")
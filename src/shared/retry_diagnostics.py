@@ -0,0 +1,73 @@
+from collections import Counter, OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+
+
+class ErrorInfo(NamedTuple):
+    status: int
+    reason: Optional[str]
+    snippet: Optional[str] = None  # the start of the response body, only read for final failures
+
+
+class RetryDiagnostics:
+    """
+    Why requests of a RetryClient were retried or failed, as metrics (see snapshot).
+    The last error per URL is kept in an LRU of max_entries URLs, so it stays bounded whatever gets requested.
+    Bodies aren't read for retries: only the final failure of a request keeps a snippet of its body.
+    """
+
+    def __init__(self, max_entries: int = 256, snippet_length: int = 300):
+        """
+        snippet_length: max amount of bytes of the body kept for a final failure
+        """
+        self.max_entries = max_entries
+        self.snippet_length = snippet_length
+        # the counters are keyed by the status as string, so they can be serialized as JSON
+        self.errors_by_status = Counter()  # every response >= 400, retried or not
+        self.retries_by_status = Counter()  # retries, by the status of the response which caused it
+        self.failures_by_status = Counter()  # requests which still failed after all retries
+        self._last_errors: "OrderedDict[str, ErrorInfo]" = OrderedDict()  # Maps URLs to their last error, LRU
+        self._failures: "OrderedDict[str, ErrorInfo]" = OrderedDict()  # Maps URLs to their last final failure, LRU
+
+    def record_error(self, url: str, status: int, reason: Optional[str]) -> None:
+        """
+        a response >= 400, it may be retried
+        """
+        self.errors_by_status[str(status)] += 1
+        self._remember(self._last_errors, url, ErrorInfo(status, reason))
+
+    def record_retry(self, url: str) -> Optional[ErrorInfo]:
+        """
+        :return: the error which caused the retry (None if it wasn't a response, e.g. a connection error)
+        """
+        error = self._last_errors.pop(url, None)
+        self.retries_by_status[str(error.status) if error else "exception"] += 1
+        return error
+
+    def record_failure(self, url: str, status: int, reason: Optional[str], body: Optional[bytes] = None) -> ErrorInfo:
+        """
+        a request which failed after all retries
+        body: (the start of) the body of the last response, it's truncated to snippet_length
+        """
+        self._last_errors.pop(url, None)
+        self.failures_by_status[str(status)] += 1
+        snippet = body[:self.snippet_length].decode("utf-8", errors="replace") if body else None
+        error = ErrorInfo(status, reason, snippet)
+        self._remember(self._failures, url, error)
+        return error
+
+    def snapshot(self, recent_failures: int = 10) -> Dict[str, Any]:
+        return {
+            "errors_by_status": dict(self.errors_by_status),
+            "retries_by_status": dict(self.retries_by_status),
+            "failures_by_status": dict(self.failures_by_status),
+            "recent_failures": [
+                {"url": url, **error._asdict()}
+                for url, error in reversed(list(self._failures.items())[-recent_failures:])
+            ],
+        }
+
+    def _remember(self, errors: "OrderedDict[str, ErrorInfo]", url: str, error: ErrorInfo) -> None:
+        errors[url] = error
+        errors.move_to_end(url)
+        if len(errors) > self.max_entries:
+            errors.popitem(last=False)
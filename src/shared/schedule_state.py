@@ -0,0 +1,142 @@
+"""
+The schedule of the notifier (when every query is checked next), kept in Redis instead of the DB:
+it changes on every execution of every query, but it's only read to show it in the webserver's /query responses.
+
+It's a sorted set (QUERY_SCHEDULE_KEY): request URL => timestamp of its next check.
+The notifier (every worker, for the queries it monitors) writes it, the webserver merges it into the QueryInfos it returns.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional
+
+from src.shared.constants import QUERY_SCHEDULE_KEY
+
+# KEYS[1]: schedule, ARGV: request URL & the timestamp it was scheduled at, for every request URL
+# => removes the request URLs which are still scheduled at that timestamp
+_REMOVE_UNCHANGED_SCRIPT = """
+local removed = 0
+for i = 1, #ARGV, 2 do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[i + 1]) then
+        removed = removed + redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return removed
+"""
+
+
+class ScheduleStateWriter:
+    """
+    Collects the next check times set by the notifier & writes them all at once per flush (one pipeline).
+    Only the last update per request URL is written, a removed query is dropped from the schedule.
+
+    When the schedule is shared with other writers (the notifier workers), a query is only dropped
+    if it's still scheduled at the time this writer wrote: it may have been handed over to another worker,
+    which scheduled it in the meantime.
+    """
+
+    def __init__(self, redis_client, key: str = QUERY_SCHEDULE_KEY, shared: bool = False):
+        self.redis_client = redis_client
+        self.key = key
+        self.shared = shared
+        self._pending: Dict[str, Optional[float]] = {}  # request URL => timestamp, None to remove it
+        self._written: Dict[str, float] = {}  # request URL => timestamp in Redis, when shared
+        self._remove_script = redis_client.register_script(_REMOVE_UNCHANGED_SCRIPT) if shared else None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def set_next_check_time(self, request_url: str, next_check_time: datetime) -> None:
+        self._pending[request_url] = next_check_time.timestamp()
+
+    def remove(self, request_url: str) -> None:
+        self._pending[request_url] = None
+
+    async def flush(self) -> None:
+        """
+        Write all pending updates. If it fails, updates which weren't overwritten in the meantime are retried
+        on the next flush.
+        """
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        scheduled = {request_url: timestamp for request_url, timestamp in pending.items() if timestamp is not None}
+        removed = [request_url for request_url, timestamp in pending.items() if timestamp is None]
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                if scheduled:
+                    pipe.zadd(self.key, scheduled)
+                if removed and not self.shared:
+                    pipe.zrem(self.key, *removed)
+                elif removed:
+                    # a query which was never written isn't in Redis, unless another worker wrote it
+                    args = [arg for request_url in removed if request_url in self._written
+                            for arg in (request_url, self._written[request_url])]
+                    if args:
+                        await self._remove_script(keys=[self.key], args=args, client=pipe)
+                await pipe.execute()
+        except Exception:
+            # newer updates (made while flushing) win over the ones we failed to write
+            self._pending = {**pending, **self._pending}
+            raise
+        if self.shared:
+            self._written.update(scheduled)
+            for request_url in removed:
+                self._written.pop(request_url, None)
+
+    async def rewrite(self, owns: Optional[Callable[[str], bool]] = None) -> None:
+        """
+        Replace the schedule with the pending next check times, e.g. at startup: the queries which were removed
+        while the notifier wasn't running are dropped from it.
+        owns: when shared, whether a request URL is scheduled by this writer (only those are dropped)
+        """
+        if self.shared:
+            for request_url, timestamp in await self.redis_client.zrange(self.key, 0, -1, withscores=True):
+                request_url = request_url.decode() if isinstance(request_url, bytes) else request_url
+                if request_url not in self._pending and owns(request_url):
+                    self._written[request_url] = timestamp
+                    self._pending[request_url] = None
+            await self.flush()
+            return
+
+        pending, self._pending = self._pending, {}
+        scheduled = {request_url: timestamp for request_url, timestamp in pending.items() if timestamp is not None}
+        try:
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.delete(self.key)
+                if scheduled:
+                    pipe.zadd(self.key, scheduled)
+                await pipe.execute()
+        except Exception:
+            self._pending = {**pending, **self._pending}
+            raise
+
+
+async def get_next_check_times(redis_client, request_urls: Iterable[str],
+                               key: str = QUERY_SCHEDULE_KEY) -> Optional[Dict[str, Optional[datetime]]]:
+    """
+    :return: the next check time of every request URL (None when it isn't scheduled, e.g. FAILED),
+    None if the schedule couldn't be read
+    """
+    request_urls = list(request_urls)
+    if not request_urls:
+        return {}
+    try:
+        timestamps = await redis_client.zmscore(key, request_urls)
+    except Exception as e:
+        logging.warning(f"Couldn't read the query schedule: {type(e).__name__} - {e}")
+        return None
+    return {request_url: None if timestamp is None else datetime.fromtimestamp(timestamp)
+            for request_url, timestamp in zip(request_urls, timestamps)}
+
+
+async def get_scheduled_count(redis_client, key: str = QUERY_SCHEDULE_KEY) -> Optional[int]:
+    """
+    :return: the amount of queries in the schedule (of all notifier workers), None if it couldn't be read
+    """
+    try:
+        return await redis_client.zcard(key)
+    except Exception as e:
+        logging.warning(f"Couldn't read the query schedule: {type(e).__name__} - {e}")
+        return None
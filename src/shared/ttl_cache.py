@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    LRU cache of which every entry expires ttl seconds after it was set.
+    At most max_entries are kept, the least recently used entry is evicted first.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300, clock: Callable[[], float] = time.monotonic):
+        """
+        ttl: default seconds an entry stays valid, see set
+        clock: returns the current time in seconds (replaceable for testing)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[K, Tuple[float, V]]" = OrderedDict()  # Maps keys to (expiry time, value)
+
+    def __len__(self) -> int:
+        """
+        amount of entries, including the expired ones which weren't evicted yet
+        """
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > self.clock()
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self.clock():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        """
+        ttl: seconds this entry stays valid (None = the cache's ttl)
+        """
+        self._entries[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._entries.pop(key, None)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,265 @@
+"""
+The fakes the tests share: a clock, an in-memory Redis & the search API of 2dehands.
+"""
+import asyncio
+import os
+from collections import Counter
+
+import pytest
+import redis
+
+from src.marketplace_notifier import cluster
+from src.marketplace_notifier import notifier as notifier_module
+from src.shared import json_codec, schedule_state
+
+
+class FakeClock:
+    """
+    time which only moves when a test moves it (or something sleeps on it): clock() / clock.time()
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakePipeline:
+    """
+    queues the commands of its FakeRedis, execute runs them in one round trip
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __getattr__(self, name):
+        command = self.redis_client.command(name)
+
+        def queue(*args, **kwargs):
+            self.commands.append(lambda: command(*args, **kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        self.redis_client.round_trip()
+        return [command() for command in self.commands]
+
+
+class FakeRedis:
+    """
+    the Redis commands the notifier & the webserver use, in memory: keys expire on the clock,
+    every command (or pipeline) fails with a ConnectionError while down.
+    The Lua scripts are emulated in Python, see the lua_redis fixture to run them for real.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.down = False
+        self.round_trips = 0
+        self.subscribers = 1  # receivers of every PUBLISH
+        self.published = []  # (channel, message) of every PUBLISH
+        self.streams = {}
+        self.zsets = {}
+        self.values = {}  # Maps keys to (value, expiry time or None)
+        self._scripts = {
+            cluster._ACQUIRE_SCRIPT: self._acquire_lease,
+            cluster._RELEASE_SCRIPT: self._release_lease,
+            schedule_state._REMOVE_UNCHANGED_SCRIPT: self._remove_unchanged,
+        }
+
+    def messages(self, channel):
+        """
+        :return: the decoded messages published on channel
+        """
+        return [json_codec.loads(message) for published_channel, message in self.published
+                if published_channel == channel]
+
+    def round_trip(self):
+        if self.down:
+            raise ConnectionError("Redis is down")
+        self.round_trips += 1
+
+    def command(self, name):
+        """
+        :return: the (synchronous) implementation of a command
+        """
+        return getattr(self, f"_{name}")
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        command = self.command(name)
+
+        async def run(*args, **kwargs):
+            self.round_trip()
+            return command(*args, **kwargs)
+        return run
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        function = self._scripts.get(script, self._not_emulated)
+
+        async def run(keys, args, client=None):
+            if isinstance(client, FakePipeline):
+                client.commands.append(lambda: function(keys, args))
+                return client
+            self.round_trip()
+            return function(keys, args)
+        return run
+
+    def _publish(self, channel, message):
+        self.published.append((channel, message))
+        return self.subscribers
+
+    def _xadd(self, name, fields, maxlen=None, approximate=True):
+        stream = self.streams.setdefault(name, [])
+        stream.append(fields)
+        if maxlen is not None:
+            del stream[:-maxlen]
+        return f"{len(stream)}-0"
+
+    def _get(self, key):
+        value, expires = self.values.get(key, (None, None))
+        if expires is not None and expires <= self.clock.now:
+            del self.values[key]
+            return None
+        return value
+
+    def _set(self, key, value, px=None):
+        self.values[key] = (value, None if px is None else self.clock.now + px / 1000)
+
+    def _pttl(self, key):
+        if self._get(key) is None:
+            return -2
+        expires = self.values[key][1]
+        return -1 if expires is None else int((expires - self.clock.now) * 1000)
+
+    def _delete(self, *keys):
+        return sum(self.zsets.pop(key, None) is not None or self.values.pop(key, None) is not None for key in keys)
+
+    def _zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def _zrem(self, key, *members):
+        return sum(self.zsets.get(key, {}).pop(member, None) is not None for member in members)
+
+    def _zremrangebyscore(self, key, low, high):
+        self.zsets[key] = {member: score for member, score in self.zsets.get(key, {}).items() if score > high}
+
+    def _zrange(self, key, start, end, withscores=False):
+        zset = self.zsets.get(key, {})
+        members = sorted(zset, key=zset.get)
+        return [(member, zset[member]) for member in members] if withscores else members
+
+    def _zmscore(self, key, members):
+        return [self.zsets.get(key, {}).get(member) for member in members]
+
+    def _zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def _acquire_lease(self, keys, args):
+        owner = self._get(keys[0])
+        if owner is None or owner == args[0]:
+            self._set(keys[0], args[0], px=args[1])
+            return 1
+        return 0
+
+    def _release_lease(self, keys, args):
+        if self._get(keys[0]) == args[0]:
+            del self.values[keys[0]]
+            return 1
+        return 0
+
+    def _not_emulated(self, keys, args):
+        raise NotImplementedError("this script isn't emulated, see the lua_redis fixture")
+
+    def _remove_unchanged(self, keys, args):
+        zset = self.zsets.get(keys[0], {})
+        removed = [request_url for request_url, timestamp in zip(args[::2], args[1::2])
+                   if zset.get(request_url) == timestamp]
+        return self._zrem(keys[0], *removed)
+
+
+class FakeSearch:
+    """
+    stands in for get_request_response: a page of listings (or an exception) per request URL,
+    remembers the requests & how many of them ran at once (in total & per request URL)
+    """
+
+    def __init__(self, pages=None, delay=0.01):
+        self.pages = pages or {}
+        self.delay = delay
+        self.requested = []
+        self.in_flight = Counter()
+        self.max_in_flight = 0
+        self.max_in_flight_per_url = 0
+
+    async def __call__(self, retry_client, url, json_response=False, raw_response=False):
+        self.requested.append(url)
+        self.in_flight[url] += 1
+        self.max_in_flight = max(self.max_in_flight, sum(self.in_flight.values()))
+        self.max_in_flight_per_url = max(self.max_in_flight_per_url, self.in_flight[url])
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight[url] -= 1
+        page = self.pages[url]
+        if isinstance(page, Exception):
+            raise page
+        return {"listings": page}
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def fake_redis(clock):
+    return FakeRedis(clock)
+
+
+@pytest.fixture
+def fake_search(monkeypatch):
+    """
+    a FakeSearch without pages, which the notifier fetches from
+    """
+    search = FakeSearch()
+    monkeypatch.setattr(notifier_module, "get_request_response", search)
+    return search
+
+
+@pytest.fixture
+def lua_redis():
+    """
+    a redis.asyncio client which runs the Lua scripts for real: an in-process fakeredis (with Lua support),
+    or the Redis server at REDIS_TEST_URL if it's set (e.g. redis://localhost:6379/15, that DB is flushed!)
+    """
+    url = os.getenv("REDIS_TEST_URL")
+    if url:
+        redis.Redis.from_url(url).flushdb()
+        yield redis.asyncio.Redis.from_url(url)
+        redis.Redis.from_url(url).flushdb()
+        return
+
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # fakeredis[lua]
+    yield fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
@@ -0,0 +1,96 @@
+"""
+Realistic /lrp/api/search responses for the tests & the benchmarks, shaped like the Listing model in src/misc/api_models.py
+"""
+import random
+from typing import Any, Dict, List
+
+PAGE_SIZE = 100
+AD_POSITIONS = (0, 1, 2, 50)  # positions of "priorityProduct" listings on a page
+
+
+def make_listing(item_id: int, priority_product: str = "NONE", rng: random.Random = random) -> Dict[str, Any]:
+    picture_id = rng.randint(10 ** 9, 10 ** 10)
+    picture_base = f"https://images.2dehands.com/api/v1/listing-twh-p/images/{picture_id % 100:02d}/{picture_id}"
+    return {
+        "itemId": f"m{item_id}",
+        "title": f"iPhone 15 Pro {rng.choice(['128', '256', '512'])}GB {rng.choice(['zwart', 'wit', 'blauw'])} - als nieuw",
+        "description": "Te koop: iPhone in perfecte staat, altijd met hoesje en screenprotector gebruikt. " * 3,
+        "categorySpecificDescription": "iPhone in perfecte staat, altijd met hoesje gebruikt.",
+        "thinContent": False,
+        "priceInfo": {"priceCents": rng.randint(100, 150000), "priceType": rng.choice(["FIXED", "MIN_BID", "FAST_BID"])},
+        "location": {
+            "cityName": rng.choice(["Gent", "Antwerpen", "Brugge", "Leuven"]),
+            "countryName": "België",
+            "countryAbbreviation": "BE",
+            "distanceMeters": rng.randint(0, 150000),
+            "isBuyerLocation": False,
+            "onCountryLevel": False,
+            "abroad": False,
+            "latitude": 51.05 + rng.random(),
+            "longitude": 3.72 + rng.random()
+        },
+        "date": "Vandaag",
+        "imageUrls": [f"//images.2dehands.com/api/v1/listing-twh-p/images/{picture_id}?rule=ecg_mp_eps$_82"],
+        "sellerInformation": {
+            "sellerId": rng.randint(10 ** 6, 10 ** 8),
+            "sellerName": "Verkoper",
+            "showSoiUrl": True,
+            "showWebsiteUrl": False,
+            "isVerified": rng.random() < 0.3
+        },
+        "categoryId": rng.choice([1953, 2726, 820]),
+        "priorityProduct": priority_product,
+        "videoOnVip": False,
+        "urgencyFeatureActive": False,
+        "napAvailable": False,
+        "attributes": [{"key": "condition", "value": "Zo goed als nieuw"}, {"key": "delivery", "value": "Ophalen of Verzenden"}],
+        "extendedAttributes": [{"key": "condition", "value": "Zo goed als nieuw"}],
+        "traits": ["PACKAGE_FREE", "NO_COMMERCIAL_CONTENT"] + (["VERIFIED_SELLER"] if rng.random() < 0.3 else []),
+        "verticals": ["telecom", "mobile_phones", "apple_iphone"],
+        "pictures": [
+            {
+                "id": picture_id + i,
+                "extraSmallUrl": f"{picture_base}?rule=ecg_mp_eps$_82",
+                "mediumUrl": f"{picture_base}?rule=ecg_mp_eps$_83",
+                "largeUrl": f"{picture_base}?rule=ecg_mp_eps$_84",
+                "extraExtraLargeUrl": f"{picture_base}?rule=ecg_mp_eps$_85",
+                "aspectRatio": {"width": 4, "height": 3}
+            } for i in range(rng.randint(1, 6))
+        ],
+        "vipUrl": f"/v/telecommunicatie/mobiele-telefoons-apple-iphone/m{item_id}-iphone-15-pro",
+        "pageLocation": "L1"
+    }
+
+
+def make_listings(newest_item_id: int, amount: int = PAGE_SIZE, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    a page of listings, newest first, with some ads (which have older item IDs) in between
+    """
+    rng = random.Random(seed)
+    listings = []
+    item_id = newest_item_id
+    for position in range(amount):
+        if position in AD_POSITIONS:
+            listings.append(make_listing(newest_item_id - 10_000 - position, rng.choice(["DAGTOPPER", "TOPADVERTENTIE"]), rng))
+            continue
+        listings.append(make_listing(item_id, rng=rng))
+        item_id -= rng.randint(1, 40)
+    return listings
+
+
+def make_search_response(newest_item_id: int, amount: int = PAGE_SIZE, seed: int = 0) -> Dict[str, Any]:
+    return {
+        "listings": make_listings(newest_item_id, amount, seed),
+        "totalResultCount": 2412,
+        "maxAllowedPageNumber": 100,
+        "correlationId": "3e0b5c8a-91c4-4d64-9a1c-5b0f1f7c1e2a",
+        "searchCategory": 0,
+        "searchCategoryOptions": [
+            {"fullName": f"Categorie {i}", "id": i, "key": f"categorie-{i}", "name": f"Categorie {i}", "parentId": 0}
+            for i in range(40)
+        ],
+        "facets": [{"key": "PriceCents", "type": "AttributeRangeFacet", "label": "Prijs"}],
+        "sortOptions": [{"sortBy": "SORT_INDEX", "sortOrder": "DECREASING"}],
+        "isSearchSaved": False,
+        "hasErrors": False
+    }
@@ -0,0 +1,65 @@
+import pytest
+
+from src.marketplace_notifier.adaptive_interval import AdaptiveIntervalPolicy
+
+BUSY = "https://www.2dehands.be/lrp/api/search?query=iphone"
+QUIET = "https://www.2dehands.be/lrp/api/search?query=commodore+64"
+
+
+def _poll(policy, request_url, new_listings_per_poll, polls, start=0.0):
+    now = start
+    policy.record_poll(request_url, 0, now=now)
+    for _ in range(polls):
+        now += policy.interval(request_url)
+        policy.record_poll(request_url, new_listings_per_poll, now=now)
+    return now
+
+
+def test_unknown_query_gets_the_base_interval():
+    policy = AdaptiveIntervalPolicy(120, 30, 900)
+
+    assert policy.interval(BUSY) == 120
+    policy.record_poll(BUSY, 100, now=0)  # the first poll only sets the starting point
+    assert policy.interval(BUSY) == 120
+
+
+def test_intervals_follow_the_velocity_within_bounds():
+    policy = AdaptiveIntervalPolicy(120, 30, 900)
+    _poll(policy, BUSY, 10, polls=10)
+    _poll(policy, QUIET, 0, polls=10)
+
+    assert policy.interval(BUSY) == 30
+    assert policy.interval(QUIET) == 900
+
+
+def test_intervals_converge_to_the_target_new_listings_per_poll():
+    policy = AdaptiveIntervalPolicy(120, 10, 900, target_new_listings=2)
+    now = 0.0
+    policy.record_poll(BUSY, 0, now=now)
+    for _ in range(30):
+        interval = policy.interval(BUSY)
+        now += interval
+        policy.record_poll(BUSY, interval / 30, now=now)  # a new listing every 30 seconds
+
+    assert policy.interval(BUSY) == pytest.approx(60, rel=0.01)
+
+
+def test_budget_stretches_all_intervals():
+    policy = AdaptiveIntervalPolicy(120, 30, 900, requests_per_minute=2)
+    _poll(policy, BUSY, 10, polls=5)
+    for i in range(4):
+        policy.interval(f"{QUIET}&page={i}")
+
+    # demand: 60/30 + 4 * 60/120 = 4 requests per minute
+    assert policy.budget_factor == pytest.approx(2)
+    assert policy.interval(BUSY) == pytest.approx(60)
+    assert policy.interval(f"{QUIET}&page=0") == pytest.approx(240)
+
+    policy.remove(BUSY)
+    assert policy.budget_factor == 1
+    assert len(policy) == 4
+
+
+def test_invalid_bounds():
+    with pytest.raises(ValueError):
+        AdaptiveIntervalPolicy(10, 30, 900)
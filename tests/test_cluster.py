@@ -0,0 +1,225 @@
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+import pytest
+from tortoise import Tortoise
+
+from src.marketplace_notifier import cluster
+from src.marketplace_notifier.cluster import NotifierCluster, rendezvous_owner, shard_key
+from src.marketplace_notifier.listing_cache import LatestListingCache
+from src.marketplace_notifier.notifier import Notifier
+from src.shared.constants import QUERY_SCHEDULE_KEY
+from src.shared.models import QueryInfo, QueryStatus
+
+REQUEST_URLS = [f"https://www.2dehands.be/lrp/api/search?query=fiets+{i}" for i in range(200)]
+
+
+@pytest.fixture(autouse=True)
+def cluster_clock(clock, monkeypatch):
+    clock.now = 1_000.0
+    monkeypatch.setattr(cluster.time, "time", clock.time)
+
+
+def test_rendezvous_hashing_only_moves_the_keys_of_a_leaving_worker():
+    workers = ["a", "b", "c", "d"]
+    owners = {url: rendezvous_owner(url, workers) for url in REQUEST_URLS}
+    assert min(Counter(owners.values()).values()) > len(REQUEST_URLS) / len(workers) / 2
+
+    new_owners = {url: rendezvous_owner(url, ["a", "b", "d"]) for url in REQUEST_URLS}
+    moved = {url for url in REQUEST_URLS if owners[url] != new_owners[url]}
+    assert moved == {url for url in REQUEST_URLS if owners[url] == "c"}
+    assert rendezvous_owner("key", []) is None
+
+
+def test_coalescable_queries_have_the_same_shard_key():
+    url = "https://www.2dehands.be/lrp/api/search?query=fiets&postcode=9000"
+    assert shard_key(f"{url}&distanceMeters=25000") == shard_key(f"{url}&distanceMeters=10000") == shard_key(url)
+
+
+def test_every_query_has_one_owner(fake_redis):
+    redis_client = fake_redis
+    workers = [NotifierCluster(redis_client, worker_id=f"worker-{i}") for i in range(3)]
+
+    async def join():
+        for worker in workers:
+            await worker.heartbeat()
+        for worker in workers:
+            await worker.heartbeat()
+    asyncio.run(join())
+
+    assert all(worker.workers == ["worker-0", "worker-1", "worker-2"] for worker in workers)
+    for url in REQUEST_URLS:
+        assert sum(worker.owns(url) for worker in workers) == 1
+
+
+def test_queries_are_handed_over_when_a_worker_joins(fake_redis):
+    redis_client = fake_redis
+    first, second = NotifierCluster(redis_client, "first"), NotifierCluster(redis_client, "second")
+
+    async def scenario():
+        await first.heartbeat()
+        for url in REQUEST_URLS:
+            assert await first.acquire(url)
+
+        await second.heartbeat()
+        await first.heartbeat()
+        moved = [url for url in REQUEST_URLS if second.owns(url)]
+        assert moved and not any(first.owns(url) for url in moved)
+        # the first worker still holds their leases, until it gave them away
+        assert not any([await second.acquire(url) for url in moved])
+        await first.sync_leases([url for url in REQUEST_URLS if first.owns(url)])
+        assert all([await second.acquire(url) for url in moved])
+        assert not any(first.holds(url) for url in moved)
+    asyncio.run(scenario())
+
+
+def test_queries_of_a_dead_worker_are_taken_over_after_the_lease_expires(clock, fake_redis):
+    redis_client = fake_redis
+    dying, survivor = NotifierCluster(redis_client, "dying"), NotifierCluster(redis_client, "survivor")
+
+    async def scenario():
+        await dying.heartbeat()
+        await survivor.heartbeat()
+        orphans = [url for url in REQUEST_URLS if dying.owns(url)]
+        for url in orphans:
+            await dying.acquire(url)
+
+        clock.now += survivor.worker_ttl + 1  # the dying worker stopped sending heartbeats
+        assert await survivor.heartbeat()
+        assert survivor.workers == ["survivor"] and all(survivor.owns(url) for url in orphans)
+        assert not await survivor.acquire(orphans[0])
+        clock.now += survivor.lease_ttl
+        assert all([await survivor.acquire(url) for url in orphans])
+    asyncio.run(scenario())
+
+
+
+def new_listings(search, request_urls, item_ids):
+    for i, url in enumerate(request_urls):
+        search.pages[url] = [{"itemId": f"m{item_id + i}", "priorityProduct": "NONE", "title": "fiets"}
+                             for item_id in item_ids]
+
+
+def test_handover_between_notifier_workers(fake_redis, fake_search):
+    search = fake_search
+    search.delay = 0.05
+    redis_client = fake_redis
+    request_urls = REQUEST_URLS[:20]
+
+    async def start_worker(worker_id):
+        worker = Notifier(None, redis_client, 120, LatestListingCache(), max_concurrent_queries=len(request_urls),
+                          cluster=NotifierCluster(redis_client, worker_id))
+        await worker.latest_listing_cache.load()
+        await worker.cluster.heartbeat()
+        await worker._initialize_schedule()
+        return worker
+
+    def dispatch_all(worker):
+        now = datetime.now()
+        for fetch_url in worker.query_coalescer.fetch_urls():
+            worker.query_schedule.schedule(fetch_url, now)
+        worker._dispatch_ready_queries()
+        return asyncio.gather(*list(worker._running_tasks))
+
+    async def scenario():
+        await Tortoise.init(db_url="sqlite://:memory:",
+                            modules={"models": ["src.shared.models", "src.marketplace_notifier.db_models"]})
+        await Tortoise.generate_schemas()
+        try:
+            for i, url in enumerate(request_urls):
+                await QueryInfo.create(browser_url=f"https://www.2dehands.be/q/fiets+{i}/", request_url=url,
+                                       status=QueryStatus.ACTIVE)
+            # a query which was deleted while no worker ran
+            redis_client.zsets[QUERY_SCHEDULE_KEY] = {REQUEST_URLS[-1]: 1.0}
+            first = await start_worker("first")
+            assert redis_client.zsets[QUERY_SCHEDULE_KEY].keys() == set(request_urls)
+            new_listings(search, request_urls, [100])
+            await dispatch_all(first)
+            await first._flush_state()
+
+            second = await start_worker("second")
+            moved = [url for url in request_urls if second.cluster.owns(url)]
+            assert moved and first.active_queries == set(request_urls)
+            new_listings(search, request_urls, [100, 200])
+            # the first worker learns about the second one while it's fetching the queries it gives away
+            first_round = dispatch_all(first)
+            await asyncio.sleep(0.01)
+            await first._heartbeat()
+            assert first.active_queries == set(request_urls) - set(moved)
+            # the second worker scheduled the moved queries before the first one dropped them
+            assert redis_client.zsets[QUERY_SCHEDULE_KEY].keys() == set(request_urls)
+            await dispatch_all(second)
+            await first_round
+
+            new_listings(search, request_urls, [100, 200, 300])
+            requested_before = len(search.requested)
+            await asyncio.gather(dispatch_all(first), dispatch_all(second))
+            assert sorted(search.requested[requested_before:]) == sorted(request_urls)
+        finally:
+            await Tortoise.close_connections()
+
+    asyncio.run(scenario())
+
+    # never fetched by both workers at once, every listing is notified exactly once
+    assert search.max_in_flight_per_url == 1
+    notified = Counter((message["request_url"], listing["itemId"])
+                       for message in redis_client.messages("listings") for listing in message["new_listings"])
+    assert notified == Counter({(url, f"m{item_id + i}"): 1
+                                for i, url in enumerate(request_urls) for item_id in (100, 200, 300)})
+
+
+def test_failed_takeover_is_retried(fake_redis):
+    redis_client = fake_redis
+    worker = Notifier(None, redis_client, 120, LatestListingCache(), cluster=NotifierCluster(redis_client, "worker"))
+    other = NotifierCluster(redis_client, "other")
+    url = REQUEST_URLS[0]
+    worker.query_coalescer.add(url)
+    reloads = []
+
+    async def reload(request_urls):
+        reloads.append(list(request_urls))
+        if len(reloads) == 1:
+            raise ConnectionError("database is locked")
+
+    worker.latest_listing_cache.reload = reload
+
+    async def scenario():
+        assert not await worker._acquire_lease(url)
+        # released, so it isn't polled with outdated latest listings (& nobody waits for it to expire)
+        assert not worker.cluster.holds(url)
+        assert await other.acquire(url)
+        await other.leave()
+        assert await worker._acquire_lease(url)
+    asyncio.run(scenario())
+
+    assert reloads == [[url], [url]]
+
+
+def test_leases_are_kept_until_the_state_is_flushed(clock, fake_redis):
+    redis_client = fake_redis
+    worker = Notifier(None, redis_client, 120, LatestListingCache(), cluster=NotifierCluster(redis_client, "worker"))
+    other = NotifierCluster(redis_client, "other")
+    url = REQUEST_URLS[0]
+    flushes = []
+
+    async def flush():
+        flushes.append(len(flushes))
+        if len(flushes) == 1:
+            raise ConnectionError("database is locked")
+
+    worker.latest_listing_cache.flush = flush
+
+    async def scenario():
+        await worker.cluster.heartbeat()
+        assert await worker.cluster.acquire(url)
+        # handed over: not monitored anymore, its latest listings aren't written yet
+        await worker._heartbeat()
+        assert worker.cluster.holds(url)
+        clock.now += worker.cluster.lease_ttl - 1
+        assert not await other.acquire(url)  # renewed
+
+        await worker._heartbeat()
+        assert not worker.cluster.holds(url)
+        assert await other.acquire(url)
+    asyncio.run(scenario())
@@ -0,0 +1,48 @@
+import asyncio
+
+from aiohttp import web
+
+from src.shared.api_utils import get_retry_client, get_request_response
+from src.shared.connection_pool import ConnectionStats, ConnectorProfile
+
+
+async def _search(request):
+    return web.json_response({"listings": []})
+
+
+async def _get_three_times(profile):
+    app = web.Application()
+    app.router.add_get("/lrp/api/search", _search)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    stats = ConnectionStats()
+    try:
+        async with get_retry_client(connector_profile=profile, connection_stats=stats) as client:
+            for _ in range(3):
+                await get_request_response(client, f"http://127.0.0.1:{port}/lrp/api/search")
+    finally:
+        await runner.cleanup()
+    return stats
+
+
+def test_connections_are_kept_alive_and_reused():
+    stats = asyncio.run(_get_three_times(ConnectorProfile(limit_per_host=2, keepalive_timeout=30)))
+
+    assert stats.requests == 3
+    assert stats.new_connections == 1
+    assert stats.reused_connections == 2
+    assert stats.tls_handshakes == 0  # plain http
+    snapshot = stats.snapshot()
+    assert snapshot["reuse_rate"] == round(2 / 3, 3)
+    assert snapshot["avg_connect_ms"] is not None
+
+
+def test_empty_stats():
+    stats = ConnectionStats()
+
+    assert stats.reuse_rate == 0
+    assert stats.snapshot()["avg_connect_ms"] is None
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from src.shared import json_codec
+from src.marketplace_notifier import enrichment
+from src.marketplace_notifier.enrichment import LISTING_DETAILS_CHANNEL, ListingEnricher
+from src.marketplace_notifier.publishers import COMPACT_PAYLOAD, ListingMessages
+
+NOT_FOUND_YET = (400, {"code": "LISTING_NOT_FOUND"})
+
+
+class FakePublisher:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, channel, message):
+        self.published.append((channel, json_codec.loads(message)))
+
+
+class Responses(dict):
+    requested: list
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """
+    the responses fetch_item_details gives per item ID, in order (the last one is repeated)
+    """
+    responses, requested = Responses(), []
+
+    async def fetch_item_details(retry_client, item_id):
+        requested.append(item_id)
+        item_responses = responses[item_id]
+        return item_responses.pop(0) if len(item_responses) > 1 else item_responses[0]
+
+    monkeypatch.setattr(enrichment, "fetch_item_details", fetch_item_details)
+    responses.requested = requested
+    return responses
+
+
+async def _enrich(enricher_kwargs, submissions, run_for=0.1):
+    publisher = FakePublisher()
+    enricher = ListingEnricher(None, publisher, **enricher_kwargs)
+    task = asyncio.create_task(enricher.run())
+    for request_url, query_id, item_ids in submissions:
+        enricher.submit(request_url, [{"itemId": item_id} for item_id in item_ids], query_id)
+    await asyncio.sleep(run_for)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return enricher, publisher.published
+
+
+def test_details_are_published_once_per_query(responses):
+    responses["m1"] = [(200, {"title": "fiets"})]
+    enricher, published = asyncio.run(_enrich({}, [("query-a", 1, ["m1"]), ("query-b", 2, ["m1"])]))
+
+    assert responses.requested == ["m1"]  # new for both queries, but fetched once
+    assert sorted((message["request_url"], message["query_id"], message["details"]["title"])
+                  for _, message in published) == [("query-a", 1, "fiets"), ("query-b", 2, "fiets")]
+    assert {channel for channel, _ in published} == {LISTING_DETAILS_CHANNEL}
+    assert len(enricher) == 0 and "m1" in enricher.details_cache
+
+
+def test_too_soon_is_retried_later(responses):
+    responses["m1"] = [NOT_FOUND_YET, NOT_FOUND_YET, (200, {"title": "fiets"})]
+    responses["m2"] = [NOT_FOUND_YET]
+    enricher, published = asyncio.run(_enrich({"retry_delays": (0.01, 0.01)}, [("query", 1, ["m1", "m2"])]))
+
+    assert responses.requested.count("m1") == 3
+    assert responses.requested.count("m2") == 3  # gave up after the last retry delay
+    assert [message["item_id"] for _, message in published] == ["m1"]
+    assert enricher.dropped == 1
+
+
+def test_details_follow_the_listing_messages(responses):
+    responses["m1"] = [(200, {"itemId": "m1", "title": "fiets", "description": "blauw", "seller": {"name": "jan"}})]
+    listing_messages = ListingMessages(COMPACT_PAYLOAD, shard_by_query=True)
+    _, published = asyncio.run(_enrich({"listing_messages": listing_messages},
+                                       [("query-a", 1, ["m1"]), ("query-b", None, ["m1"])]))
+
+    assert sorted(published, key=lambda channel_message: channel_message[0]) == [
+        (LISTING_DETAILS_CHANNEL, {"request_url": "query-b", "query_id": None, "item_id": "m1",
+                                   "details": {"itemId": "m1", "title": "fiets", "description": "blauw"}}),
+        (f"{LISTING_DETAILS_CHANNEL}:1", {"request_url": "query-a", "query_id": 1, "item_id": "m1",
+                                          "details": {"itemId": "m1", "title": "fiets", "description": "blauw"}}),
+    ]
+
+
+def test_full_queue_drops_listings(responses):
+    responses["m1"] = responses["m2"] = [(404, None)]
+    enricher, published = asyncio.run(_enrich({"max_queued": 1}, [("query", 1, ["m1", "m2"])]))
+
+    assert responses.requested == ["m1"]
+    assert published == []
+    assert enricher.dropped == 2  # m2 didn't fit in the queue, m1 doesn't exist
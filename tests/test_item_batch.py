@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from src.api import webserver
+
+NOT_FOUND_YET = (400, {"code": "LISTING_NOT_FOUND"})
+
+
+class FakeItemCache:
+    def __init__(self, responses):
+        self.responses = responses
+        self.requested = []
+
+    async def get(self, item_id):
+        self.requested.append(item_id)
+        response = self.responses[item_id]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def item_cache(monkeypatch):
+    item_cache = FakeItemCache({
+        "m1": (200, {"title": "fiets"}),
+        "m2": (404, None),
+        "m3": NOT_FOUND_YET,
+        "m4": ConnectionResetError("connection lost"),
+    })
+    monkeypatch.setattr(webserver.app, "item_cache", item_cache)
+    return item_cache
+
+
+async def _post_batch(item_ids):
+    client = webserver.app.test_client()
+    response = await client.post("/item/batch", json={"item_ids": item_ids})
+    return response.status_code, await response.get_json()
+
+
+def test_batch_has_a_result_per_item(item_cache):
+    status, body = asyncio.run(_post_batch(["m1", "m2", "m1", "m3", "m4"]))
+
+    assert status == 200
+    assert item_cache.requested == ["m1", "m2", "m3", "m4"]  # duplicates are fetched once
+    assert body["items"]["m1"] == {"status": 200, "details": {"title": "fiets"}}
+    assert body["items"]["m2"] == {"status": 404, "error": "Item Not Found"}
+    assert body["items"]["m3"]["status"] == 400
+    assert body["items"]["m4"]["status"] == 500
+    assert list(body["items"]) == ["m1", "m2", "m3", "m4"]
+
+
+def test_batch_size_is_limited(item_cache):
+    status, _ = asyncio.run(_post_batch([f"m{i}" for i in range(webserver.MAX_BATCH_ITEMS + 1)]))
+    assert status == 400
+    status, _ = asyncio.run(_post_batch([]))
+    assert status == 400
+    assert item_cache.requested == []
+
+
+def test_invalid_item_ids_are_rejected(item_cache):
+    status, body = asyncio.run(_post_batch(["m1", "m1/../../../x?y=1"]))
+    assert status == 400
+    assert "item_ids" in body["error"]
+
+    async def get_item(item_id):
+        response = await webserver.app.test_client().get(f"/item/{item_id}")
+        return response.status_code
+
+    assert asyncio.run(get_item("x1")) == 400
+    assert asyncio.run(get_item("m1%3Fy%3D1")) == 400
+    assert item_cache.requested == []
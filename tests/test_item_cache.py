@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from src.api import item_cache
+from src.api.item_cache import ItemDetailsCache
+
+NOT_FOUND_YET = (400, {"code": "LISTING_NOT_FOUND"})
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    the response fetch_item_details gives per item ID, the requested item IDs are in upstream["requested"]
+    """
+    upstream = {"requested": []}
+
+    async def fetch_item_details(retry_client, item_id):
+        upstream["requested"].append(item_id)
+        await asyncio.sleep(0.01)
+        return upstream[item_id]
+
+    monkeypatch.setattr(item_cache, "fetch_item_details", fetch_item_details)
+    return upstream
+
+
+def test_concurrent_lookups_share_one_request(upstream):
+    upstream["m1"] = (200, {"title": "fiets"})
+    cache = ItemDetailsCache(None)
+
+    async def lookups():
+        return await asyncio.gather(*(cache.get("m1") for _ in range(5)))
+
+    assert asyncio.run(lookups()) == [(200, {"title": "fiets"})] * 5
+    assert upstream["requested"] == ["m1"]
+    assert cache.coalesced == 4
+    assert asyncio.run(cache.get("m1")) == (200, {"title": "fiets"})
+    assert upstream["requested"] == ["m1"]
+
+
+def test_negative_responses_are_cached_shorter(upstream, clock):
+    upstream.update(m1=(404, None), m2=NOT_FOUND_YET, m3=(403, {"message": "Forbidden"}))
+    cache = ItemDetailsCache(None, not_found_ttl=3600, too_soon_ttl=5, clock=clock)
+
+    async def lookup_all():
+        for item_id in ("m1", "m2", "m3"):
+            await cache.get(item_id)
+
+    asyncio.run(lookup_all())
+    clock.now = 10
+    asyncio.run(lookup_all())
+
+    # the 404 is still cached, LISTING_NOT_FOUND expired & the 403 wasn't cached
+    assert upstream["requested"] == ["m1", "m2", "m3", "m2", "m3"]
+
+
+def test_redis_shares_the_cache(upstream, clock, fake_redis):
+    upstream["m1"] = (200, {"title": "fiets"})
+
+    asyncio.run(ItemDetailsCache(None, fake_redis, clock=clock).get("m1"))
+    clock.now = 100
+    other_process = ItemDetailsCache(None, fake_redis, clock=clock)
+    assert asyncio.run(other_process.get("m1")) == (200, {"title": "fiets"})
+
+    assert upstream["requested"] == ["m1"]
+    assert other_process.redis_hits == 1
+    # a hit isn't written back, which would extend its expiry
+    assert asyncio.run(fake_redis.pttl("item_details:m1")) == 200 * 1000
+
+
+def test_redis_hit_is_kept_in_memory_until_it_expires_in_redis(upstream, clock, fake_redis):
+    upstream["m1"] = (200, {"title": "fiets"})
+    asyncio.run(ItemDetailsCache(None, fake_redis, details_ttl=300, clock=clock).get("m1"))
+    clock.now = 280  # cached 280s ago by the other process
+
+    cache = ItemDetailsCache(None, fake_redis, details_ttl=300, clock=clock)
+    asyncio.run(cache.get("m1"))
+    clock.now = 310  # expired in Redis after 20s, not after the 300s of a fresh entry
+    asyncio.run(cache.get("m1"))
+
+    assert upstream["requested"] == ["m1", "m1"]
+    assert cache.redis_hits == 1
+
+
+def test_unreachable_redis_falls_back_to_memory(upstream, fake_redis):
+    upstream["m1"] = (200, {"title": "fiets"})
+    fake_redis.down = True
+    cache = ItemDetailsCache(None, fake_redis)
+
+    async def lookups():
+        return [await cache.get("m1") for _ in range(2)]
+
+    assert asyncio.run(lookups()) == [(200, {"title": "fiets"})] * 2
+    assert upstream["requested"] == ["m1"]
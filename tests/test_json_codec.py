@@ -0,0 +1,15 @@
+import json
+from datetime import datetime
+
+from src.shared import json_codec
+
+
+def test_output_with_a_default_is_the_same_as_with_the_json_module():
+    # e.g. the OpenAPI schema of the webserver, which has the status codes as keys
+    obj = {"responses": {200: {"description": "ok"}, 404: {"description": "été"}}, "at": datetime(2024, 5, 1, 12)}
+
+    encoded = json_codec.dumps(obj, default=str, sort_keys=True)
+
+    assert encoded == json.dumps(obj, default=str, sort_keys=True, ensure_ascii=False,
+                                 separators=(",", ":")).encode("utf-8")
+    assert json_codec.loads(encoded)["responses"]["404"] == {"description": "été"}
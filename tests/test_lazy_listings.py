@@ -0,0 +1,48 @@
+import json
+
+from src.marketplace_notifier.lazy_listings import LazyListing, parse_listings_lazily, materialise_listing
+from src.marketplace_notifier.listing_diff import ListingDiff
+from tests.payloads import make_search_response
+
+RESPONSE = make_search_response(newest_item_id=2_000_000, seed=2)
+BODY = json.dumps(RESPONSE, ensure_ascii=False).encode("utf-8")
+
+
+def test_only_diff_fields_are_parsed():
+    listings = parse_listings_lazily(BODY)
+
+    assert len(listings) == len(RESPONSE["listings"])
+    assert all(isinstance(listing, LazyListing) for listing in listings)
+    assert [dict.__getitem__(li, "itemId") for li in listings] == [li["itemId"] for li in RESPONSE["listings"]]
+    assert [li["priorityProduct"] for li in listings] == [li["priorityProduct"] for li in RESPONSE["listings"]]
+    assert all(dict.__len__(listing) == 2 for listing in listings)
+
+
+def test_listing_is_materialised_on_demand():
+    listing = parse_listings_lazily(BODY)[3]
+
+    assert listing["title"] == RESPONSE["listings"][3]["title"]
+    assert materialise_listing(listing) == RESPONSE["listings"][3]
+    assert type(materialise_listing(listing)) is dict
+    assert json.loads(json.dumps(listing)) == RESPONSE["listings"][3]
+    assert listing.get("doesNotExist", "default") == "default"
+
+
+def test_diff_on_lazy_listings_equals_diff_on_parsed_listings():
+    latest_item_id = int(RESPONSE["listings"][30]["itemId"][1:])
+
+    lazy_result = ListingDiff().diff(parse_listings_lazily(BODY), latest_item_id)
+    result = ListingDiff().diff(RESPONSE["listings"], latest_item_id)
+
+    assert [materialise_listing(li) for li in lazy_result.new_listings] == result.new_listings
+
+
+def test_unexpected_layout_falls_back_to_full_parse():
+    reordered = {**RESPONSE, "listings": [
+        {"title": li["title"], **li} for li in RESPONSE["listings"]  # itemId isn't the first key anymore
+    ]}
+
+    listings = parse_listings_lazily(json.dumps(reordered))
+
+    assert not any(isinstance(listing, LazyListing) for listing in listings)
+    assert listings == reordered["listings"]
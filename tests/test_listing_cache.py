@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+from tortoise import Tortoise
+
+from src.marketplace_notifier.db_models import LatestListingInfoDB, SeenListingsDB
+from src.marketplace_notifier.listing_cache import LatestListingCache, TITLE_MAX_LENGTH
+
+URL_1 = "https://www.2dehands.be/lrp/api/search?query=fiets"
+URL_2 = "https://www.2dehands.be/lrp/api/search?query=iphone"
+
+
+def run_with_db(test):
+    """
+    runs test() against an empty in-memory notifier DB
+    """
+    async def run():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["src.marketplace_notifier.db_models"]})
+        await Tortoise.generate_schemas()
+        try:
+            return await test()
+        finally:
+            await Tortoise.close_connections()
+
+    return asyncio.run(run())
+
+
+async def db_rows():
+    latest = dict(await LatestListingInfoDB.all().values_list("request_url", "item_id"))
+    seen = {request_url: len(item_ids) // 8
+            for request_url, item_ids in await SeenListingsDB.all().values_list("request_url", "item_ids")}
+    return latest, seen
+
+
+def test_flush_upserts_the_dirty_entries_only():
+    async def test():
+        await LatestListingInfoDB.create(request_url=URL_2, item_id="m50", title="iphone")
+        cache = LatestListingCache(seen_window_size=4)
+        await cache.load()
+        assert cache.latest_item_id(URL_2) == 50
+        assert cache.latest_item_id(URL_1) == 0
+
+        cache.update(URL_1, "m100", "fiets" * 20)
+        cache.mark_seen(URL_1, [98, 99, 100])
+        await cache.flush()
+        assert await db_rows() == ({URL_1: "m100", URL_2: "m50"}, {URL_1: 3})
+        assert (await LatestListingInfoDB.get(request_url=URL_1)).title == ("fiets" * 20)[:TITLE_MAX_LENGTH]
+
+        # an existing row is updated (on conflict) in the same transaction as the new ones
+        cache.update(URL_2, "m60", "iphone 15")
+        cache.mark_seen(URL_1, [101, 102])
+        await cache.flush()
+        assert await db_rows() == ({URL_1: "m100", URL_2: "m60"}, {URL_1: 4})
+
+        # a fresh cache loads the same state
+        reloaded = LatestListingCache(seen_window_size=4)
+        await reloaded.load()
+        assert reloaded.latest_item_id(URL_2) == 60
+        assert list(reloaded.seen_window(URL_1)) == [99, 100, 101, 102]
+
+    run_with_db(test)
+
+
+def test_failed_flush_is_retried(monkeypatch):
+    async def test():
+        cache = LatestListingCache()
+        cache.update(URL_1, "m100", "fiets")
+        cache.mark_seen(URL_1, [100])
+
+        async def failing_bulk_create(*args, **kwargs):
+            raise ConnectionError("database is locked")
+
+        with monkeypatch.context() as patch:
+            # the latest listings are written first, in the same transaction
+            patch.setattr(SeenListingsDB, "bulk_create", failing_bulk_create)
+            with pytest.raises(ConnectionError):
+                await cache.flush()
+        # the whole transaction is rolled back
+        assert await db_rows() == ({}, {})
+
+        cache.update(URL_1, "m101", "fiets 2")  # while the DB was down
+        await cache.flush()
+        assert await db_rows() == ({URL_1: "m101"}, {URL_1: 1})
+
+    run_with_db(test)
+
+
+def test_reload_replaces_the_pending_state_with_the_db():
+    async def test():
+        cache = LatestListingCache()
+        await cache.load()
+        # e.g. written by the worker which polled URL_1 until now
+        await LatestListingInfoDB.create(request_url=URL_1, item_id="m200", title="fiets")
+        cache.update(URL_1, "m100", "fiets")
+
+        await cache.reload([URL_1])
+        assert cache.latest_item_id(URL_1) == 200
+        await cache.flush()  # nothing pending anymore
+        assert await db_rows() == ({URL_1: "m200"}, {})
+
+    run_with_db(test)
+
+
+def test_evicted_entries_are_written_before_they_are_dropped():
+    async def test():
+        cache = LatestListingCache()
+        cache.update(URL_1, "m100", "fiets")
+        cache.update(URL_2, "m50", "iphone")
+        await cache.flush()
+
+        cache.evict(URL_2)  # clean, dropped right away
+        cache.mark_seen(URL_1, [100])
+        cache.evict(URL_1)  # dirty, dropped after the flush
+        assert len(cache) == 1
+        await cache.flush()
+        assert len(cache) == 0
+        assert await db_rows() == ({URL_1: "m100", URL_2: "m50"}, {URL_1: 1})
+
+        # monitored again: loaded from the DB
+        await cache.ensure_loaded(URL_1)
+        assert cache.latest_item_id(URL_1) == 100
+        assert list(cache.seen_window(URL_1)) == [100]
+
+        # re-monitored before its eviction: the pending update is kept
+        cache.update(URL_1, "m101", "fiets")
+        cache.evict(URL_1)
+        await cache.ensure_loaded(URL_1)
+        await cache.flush()
+        assert cache.latest_item_id(URL_1) == 101
+
+    run_with_db(test)
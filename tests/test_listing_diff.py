@@ -0,0 +1,107 @@
+from src.marketplace_notifier.listing_diff import ListingDiff, parse_item_id
+from src.marketplace_notifier.seen_window import SeenWindow
+
+
+def listing(item_id, priority_product="NONE"):
+    return {"itemId": f"m{item_id}", "priorityProduct": priority_product, "title": f"listing {item_id}"}
+
+
+def item_ids(listings):
+    return [parse_item_id(li["itemId"]) for li in listings]
+
+
+def test_parse_item_id():
+    assert parse_item_id("m2154316958") == 2154316958
+
+
+def test_only_new_non_ad_listings_newest_first():
+    page = [listing(900, "DAGTOPPER"), listing(950, "TOPADVERTENTIE"), listing(105), listing(104), listing(100), listing(99)]
+
+    result = ListingDiff().diff(page, latest_item_id=100)
+
+    assert item_ids(result.new_listings) == [105, 104]
+    assert result.latest_item_id == 105
+
+
+def test_no_new_listings_keeps_latest_item_id():
+    result = ListingDiff().diff([listing(100), listing(90)], latest_item_id=100)
+
+    assert result.new_listings == []
+    assert result.latest_item_id == 100
+
+
+def test_out_of_order_page_is_sorted():
+    page = [listing(103), listing(101), listing(90), listing(104), listing(102)]
+
+    result = ListingDiff().diff(page, latest_item_id=100)
+
+    assert item_ids(result.new_listings) == [104, 103, 102, 101]
+    assert result.latest_item_id == 104
+
+
+def test_whole_page_is_walked_by_default():
+    # a new listing can show up below older ones
+    page = [listing(110)] + [listing(100 - i) for i in range(50)] + [listing(111)]
+
+    assert item_ids(ListingDiff().diff(page, latest_item_id=100).new_listings) == [111, 110]
+
+
+def test_early_stop_after_consecutive_old_listings():
+    page = [listing(110), listing(99), listing(108), listing(98), listing(97), listing(109)]
+
+    result = ListingDiff(early_stop_after=2).diff(page, latest_item_id=100)
+
+    assert item_ids(result.new_listings) == [110, 108]
+
+
+def test_same_as_filter_and_sort():
+    from tests.payloads import make_listings
+
+    page = make_listings(newest_item_id=2_000_000, seed=1)
+    latest_item_id = parse_item_id(page[40]["itemId"])
+    expected = sorted(
+        (li for li in page if li["priorityProduct"] == "NONE" and parse_item_id(li["itemId"]) > latest_item_id),
+        key=lambda li: parse_item_id(li["itemId"]), reverse=True
+    )
+
+    assert ListingDiff().diff(page, latest_item_id).new_listings == expected
+
+
+def test_seen_window_catches_late_listings():
+    seen_window = SeenWindow(256, [100, 101, 103, 104])
+    # 102 shows up late, below newer listings, 105 is new
+    page = [listing(105), listing(104), listing(103), listing(102), listing(101), listing(100)]
+
+    result = ListingDiff().diff(page, latest_item_id=104, seen_window=seen_window)
+
+    assert item_ids(result.new_listings) == [105, 102]
+    assert result.latest_item_id == 105
+    assert result.seen_item_ids == [102, 105]
+
+
+def test_seen_window_ignores_listings_below_its_floor():
+    seen_window = SeenWindow(256, [100, 101])
+
+    assert ListingDiff().diff([listing(99), listing(101)], latest_item_id=101, seen_window=seen_window).new_listings == []
+
+
+def test_empty_seen_window_is_filled_with_the_whole_page():
+    page = [listing(900, "DAGTOPPER"), listing(105), listing(100), listing(99)]
+
+    result = ListingDiff().diff(page, latest_item_id=100, seen_window=SeenWindow(256))
+
+    assert item_ids(result.new_listings) == [105]
+    assert result.seen_item_ids == [99, 100, 105]
+
+
+def test_seen_window_is_a_bounded_ring_buffer():
+    seen_window = SeenWindow(3, [1, 2, 3])
+    seen_window.extend([4, 5])
+
+    assert list(seen_window) == [3, 4, 5]
+    assert 1 not in seen_window and 5 in seen_window
+    assert seen_window.floor == 3
+
+    restored = SeenWindow.from_bytes(3, seen_window.to_bytes())
+    assert list(restored) == [3, 4, 5]
+    assert list(SeenWindow.from_bytes(2, seen_window.to_bytes())) == [4, 5]
@@ -0,0 +1,63 @@
+from src.marketplace_notifier.local_filters import (PriceRange, compile_filter, evaluate_filters, selected,
+                                                    ListingColumns)
+from tests.payloads import make_listings
+
+LISTINGS = make_listings(newest_item_id=2_000_000, seed=5)
+
+
+def _listing(price_cents=None, distance_meters=None, **fields):
+    return dict({"itemId": "m1", "priceInfo": {"priceCents": price_cents},
+                 "location": {"distanceMeters": distance_meters}}, **fields)
+
+
+def test_compiled_filter_matches():
+    listing_filter = compile_filter(min_price_cents=100, max_price_cents=1000, max_distance_meters=5000)
+
+    assert listing_filter.matches(_listing(500, 1000))
+    assert not listing_filter.matches(_listing(50, 1000))
+    assert not listing_filter.matches(_listing(5000, 1000))
+    assert not listing_filter.matches(_listing(500, 10000))
+    assert listing_filter.matches({"itemId": "m1"})  # no price or distance to filter on
+    assert compile_filter().is_empty and compile_filter().matches({})
+
+
+def test_category_seller_traits_and_keywords():
+    listing = _listing(title="Gazelle stadsfiets", description="Weinig gebruikt, met BAGAGEDRAGER",
+                       categoryId=445, sellerInformation={"isVerified": True}, traits=["PACKAGE_FREE", "VERIFIED_SELLER"])
+
+    assert compile_filter(category_ids=[445, 446], seller_verified=True, traits=["VERIFIED_SELLER"],
+                          keywords=["gazelle", "Bagagedrager"]).matches(listing)
+    assert not compile_filter(category_ids=[1]).matches(listing)
+    assert not compile_filter(seller_verified=False).matches(listing)
+    assert not compile_filter(traits=["VERIFIED_SELLER", "NO_COMMERCIAL_CONTENT"]).matches(listing)
+    assert not compile_filter(keywords=["gazelle", "elektrisch"]).matches(listing)
+
+
+def test_filters_are_compiled_to_shared_predicates():
+    assert compile_filter(keywords=["B", "a"]) == compile_filter(keywords=["a", "b"])
+    assert compile_filter(max_price_cents=10).predicates == (PriceRange(None, 10),)
+
+
+def test_evaluate_filters_is_the_same_as_matching_one_by_one():
+    filters = {
+        "cheap": compile_filter(max_price_cents=50_000),
+        "cheap_nearby": compile_filter(max_price_cents=50_000, max_distance_meters=50_000),
+        "verified_white": compile_filter(seller_verified=True, keywords=["wit"]),
+        "other_category": compile_filter(category_ids=[1]),
+        "everything": compile_filter(),
+    }
+
+    masks = evaluate_filters(LISTINGS, filters)
+
+    for key, listing_filter in filters.items():
+        assert selected(LISTINGS, masks[key]) == [listing for listing in LISTINGS if listing_filter.matches(listing)]
+    assert masks["other_category"] == 0
+    assert selected(LISTINGS, masks["everything"]) == LISTINGS
+
+
+def test_columns_are_extracted_on_demand():
+    columns = ListingColumns(LISTINGS)
+
+    assert len(columns) == len(LISTINGS)
+    assert columns["price_cents"][0] == LISTINGS[0]["priceInfo"]["priceCents"]
+    assert "text" not in columns._columns
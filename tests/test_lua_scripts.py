@@ -0,0 +1,101 @@
+"""
+the Lua scripts of the cluster, the rate governor & the schedule, run by (fake)redis, see the lua_redis fixture
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.marketplace_notifier.cluster import NotifierCluster
+from src.shared import rate_limiter
+from src.shared.rate_limiter import EndpointLimit, RateGovernor
+from src.shared.schedule_state import ScheduleStateWriter, get_next_check_times
+
+URL_1 = "https://www.2dehands.be/lrp/api/search?query=fiets"
+URL_2 = "https://www.2dehands.be/lrp/api/search?query=iphone"
+
+
+def test_cluster_leases(lua_redis):
+    async def scenario():
+        first = NotifierCluster(lua_redis, "first", lease_ttl=0.2)
+        second = NotifierCluster(lua_redis, "second", lease_ttl=0.2)
+        assert await first.acquire(URL_1)
+        assert await first.acquire(URL_1)  # renewed
+        assert not await second.acquire(URL_1)
+        assert await second.acquire(URL_2)
+
+        await first.sync_leases([])  # released
+        assert await second.acquire(URL_1)
+        await second.release(URL_1)
+        await second.release(URL_1)  # not held anymore, nothing happens
+        assert await first.acquire(URL_1)
+
+        # a release doesn't delete the lease of another worker
+        await second.release(URL_1)
+        assert not await second.acquire(URL_1)
+
+        # the lease of a worker which stopped renewing it expires
+        await asyncio.sleep(0.3)
+        assert await second.acquire(URL_1)
+        await second.leave()
+        assert await first.acquire(URL_2)
+    asyncio.run(scenario())
+
+
+def test_rate_governor_buckets(lua_redis, monkeypatch):
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", sleep)
+    limits = {"search": EndpointLimit(rate=2, burst=2, min_rate=0.5, cooldown=60)}
+    url = "https://www.2dehands.be/lrp/api/search?query=fiets"
+
+    async def scenario():
+        governor, other_process = RateGovernor(lua_redis, limits), RateGovernor(lua_redis, limits)
+        for governor_ in (governor, other_process, governor, other_process):
+            await governor_.acquire(url)
+        # one bucket for both: the burst starts right away, the others reserve the next tokens
+        assert sleeps == pytest.approx([0.5, 1.0], abs=0.05)
+
+        await governor.report(url, 429)
+        await other_process.report(url, 403)  # in the cooldown
+        assert float(await lua_redis.hget("rate_governor:search", "rate")) == 1
+        assert not governor._local_buckets and not other_process._local_buckets
+    asyncio.run(scenario())
+
+
+def test_shared_schedule_only_removes_its_own_entries(lua_redis):
+    now = datetime.now()
+
+    async def scenario():
+        old_owner = ScheduleStateWriter(lua_redis, shared=True)
+        new_owner = ScheduleStateWriter(lua_redis, shared=True)
+        old_owner.set_next_check_time(URL_1, now)
+        old_owner.set_next_check_time(URL_2, now)
+        await old_owner.flush()
+
+        # URL_1 is handed over & scheduled by its new owner before the old owner drops it
+        new_owner.set_next_check_time(URL_1, now + timedelta(seconds=30))
+        await new_owner.flush()
+        old_owner.remove(URL_1)
+        old_owner.remove(URL_2)
+        await old_owner.flush()
+        assert await get_next_check_times(lua_redis, [URL_1, URL_2]) == {URL_1: now + timedelta(seconds=30),
+                                                                         URL_2: None}
+
+        # at startup, only the entries of the queries it owns are dropped
+        old_owner.set_next_check_time(URL_2, now)
+        await old_owner.flush()
+        restarted = ScheduleStateWriter(lua_redis, shared=True)
+        await restarted.rewrite(owns=lambda request_url: request_url == URL_2)
+        assert await get_next_check_times(lua_redis, [URL_1, URL_2]) == {URL_1: now + timedelta(seconds=30),
+                                                                         URL_2: None}
+
+        # a single notifier replaces the whole schedule
+        single = ScheduleStateWriter(lua_redis)
+        single.set_next_check_time(URL_2, now)
+        await single.rewrite()
+        assert await get_next_check_times(lua_redis, [URL_1, URL_2]) == {URL_1: None, URL_2: now}
+    asyncio.run(scenario())
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+
+from src.marketplace_notifier import notifier as notifier_module
+from src.marketplace_notifier.listing_cache import LatestListingCache
+from src.marketplace_notifier.notifier import Notifier, REQUEST_URL_ERROR_CHANNEL
+from src.shared.models import QueryStatus
+
+SEARCH_URL = "https://www.2dehands.be/lrp/api/search?query=fiets"
+CHEAP = SEARCH_URL + "&attributeRanges%5B%5D=PriceCents%3Anull%3A10000"
+EXPENSIVE = SEARCH_URL + "&attributeRanges%5B%5D=PriceCents%3A50000%3Anull"
+
+
+def request_url(i):
+    return f"https://www.2dehands.be/lrp/api/search?query=fiets+{i}"
+
+
+def listing(item_id):
+    return {"itemId": f"m{item_id}", "priorityProduct": "NONE", "title": f"fiets {item_id}"}
+
+
+@pytest.fixture
+def search(fake_search):
+    fake_search.pages.update({request_url(i): [listing(100 + i)] for i in range(6)})
+    return fake_search
+
+
+def run_due_queries(redis_client, request_urls, **notifier_kwargs):
+    """
+    :return: the Notifier, after processing all request_urls (all due right away) once
+    """
+    async def run():
+        notifier = Notifier(None, redis_client, 120, LatestListingCache(), **notifier_kwargs)
+        now = datetime.now()
+        for url in request_urls:
+            notifier.active_queries.add(url)
+            notifier.query_coalescer.add(url)
+        for fetch_url in notifier.query_coalescer.fetch_urls():
+            notifier.query_schedule.schedule(fetch_url, now)
+        notifier._dispatch_ready_queries()
+        await asyncio.gather(*list(notifier._running_tasks))
+        return notifier
+
+    return asyncio.run(run())
+
+
+def test_at_most_max_concurrent_queries_run_at_once(search, fake_redis):
+    notifier = run_due_queries(fake_redis, [request_url(i) for i in range(6)], max_concurrent_queries=2)
+
+    assert sorted(search.requested) == sorted(request_url(i) for i in range(6))
+    assert search.max_in_flight == 2
+    # all of them are rescheduled, spread over the interval
+    assert len(notifier.query_schedule) == 6
+    assert len(set(time for _, time in notifier.query_schedule.upcoming(6))) == 6
+
+
+def test_sequential_by_default(search, fake_redis):
+    run_due_queries(fake_redis, [request_url(i) for i in range(3)])
+
+    assert search.max_in_flight == 1
+
+
+def test_a_failing_query_does_not_affect_the_others(search, fake_redis):
+    search.pages[request_url(1)] = RuntimeError("boom")
+
+    notifier = run_due_queries(fake_redis, [request_url(i) for i in range(4)], max_concurrent_queries=4)
+
+    assert request_url(1) not in notifier.active_queries
+    assert request_url(1) not in notifier.query_schedule
+    assert notifier.query_state_writer._statuses == {request_url(1): QueryStatus.FAILED}
+    assert [message["request_url"] for message in fake_redis.messages(REQUEST_URL_ERROR_CHANNEL)] == [request_url(1)]
+
+    # the others were processed & rescheduled as usual
+    new_listings = {message["request_url"]: message["new_listings"] for message in fake_redis.messages("listings")}
+    assert new_listings == {request_url(i): [listing(100 + i)] for i in (0, 2, 3)}
+    assert all(request_url(i) in notifier.query_schedule for i in (0, 2, 3))
+
+
+def test_failing_coalesced_fetch_falls_back_to_the_own_request_urls(fake_search, fake_redis):
+    fake_search.pages.update({SEARCH_URL: RuntimeError("boom"), CHEAP: [listing(100)], EXPENSIVE: RuntimeError("boom")})
+
+    notifier = run_due_queries(fake_redis, [CHEAP, EXPENSIVE], coalesce_queries=True)
+    assert fake_search.requested == [SEARCH_URL]
+    # nothing is marked as FAILED, both are due right away on their own URL
+    assert notifier.query_state_writer._statuses == {}
+    assert notifier.active_queries == {CHEAP, EXPENSIVE}
+    assert sorted(url for url, _ in notifier.query_schedule.upcoming(3)) == sorted([CHEAP, EXPENSIVE])
+
+    async def run_again():
+        notifier._dispatch_ready_queries()
+        await asyncio.gather(*list(notifier._running_tasks))
+
+    asyncio.run(run_again())
+    # only the query which fails on its own URL is FAILED
+    assert notifier.query_state_writer._statuses == {EXPENSIVE: QueryStatus.FAILED}
+    assert notifier.active_queries == {CHEAP}
+    assert [message["request_url"] for message in fake_redis.messages(REQUEST_URL_ERROR_CHANNEL)] == [EXPENSIVE]
+
+
+def test_split_coalesced_fetch_is_shared_again_after_a_while(fake_search, fake_redis, clock):
+    fake_search.pages.update({SEARCH_URL: RuntimeError("boom"), CHEAP: [listing(100)], EXPENSIVE: [listing(600)]})
+    notifier = run_due_queries(fake_redis, [CHEAP, EXPENSIVE], coalesce_queries=True)
+    split_schedule = dict(notifier.query_schedule.upcoming(3))
+    assert split_schedule.keys() == {CHEAP, EXPENSIVE}
+
+    notifier._rejoin_split_fetches()
+    assert dict(notifier.query_schedule.upcoming(3)) == split_schedule
+
+    clock.now = time.monotonic() + notifier.query_coalescer.split_ttl
+    notifier.query_coalescer.clock = clock
+    notifier._rejoin_split_fetches()
+    assert dict(notifier.query_schedule.upcoming(3)) == {SEARCH_URL: min(split_schedule.values())}
+    assert notifier.query_coalescer.subscribers(SEARCH_URL).keys() == {CHEAP, EXPENSIVE}
+    assert notifier.active_queries == {CHEAP, EXPENSIVE}
+
+
+def test_reconcile_loop_survives_a_failed_sync(monkeypatch, fake_redis):
+    monkeypatch.setattr(notifier_module, "RECONCILE_INTERVAL", 0)
+    notifier = Notifier(None, fake_redis, 120, LatestListingCache())
+    syncs = []
+
+    async def reconcile():
+        syncs.append(len(syncs))
+        if len(syncs) == 1:
+            raise ConnectionError("database is locked")
+        if len(syncs) == 3:
+            raise asyncio.CancelledError
+
+    notifier._reconcile = reconcile
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(notifier._reconcile_loop())
+    assert len(syncs) == 3
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+
+from src.marketplace_notifier.lazy_listings import parse_listings_lazily
+from src.marketplace_notifier.publishers import (PubSubPublisher, StreamPublisher, STREAM_OUTPUT, PUBSUB_OUTPUT,
+                                                 COMPACT_FIELDS, COMPACT_PAYLOAD, ID_ONLY_PAYLOAD, ListingMessages,
+                                                 create_publisher)
+from tests.payloads import make_search_response
+
+RESPONSE = make_search_response(newest_item_id=2_000_000, seed=3)
+BODY = json.dumps(RESPONSE).encode("utf-8")
+REQUEST_URL = "https://www.2dehands.be/lrp/api/search?query=fiets"
+
+
+def test_stream_publisher_trims_the_stream(fake_redis):
+    publisher = StreamPublisher(fake_redis, maxlen=2)
+
+    async def publish():
+        for i in range(3):
+            await publisher.publish("listings", f"message {i}")
+    asyncio.run(publish())
+
+    assert fake_redis.streams == {"listings": [{"data": "message 1"}, {"data": "message 2"}]}
+    assert fake_redis.published == []
+
+
+def test_pubsub_publisher_counts_unheard_messages(fake_redis):
+    fake_redis.subscribers = 0
+    publisher = PubSubPublisher(fake_redis)
+
+    async def publish():
+        await publisher.publish("listings", "nobody listens")
+        fake_redis.subscribers = 1
+        await publisher.publish("listings", "somebody listens")
+    asyncio.run(publish())
+
+    assert [message for _, message in fake_redis.published] == ["nobody listens", "somebody listens"]
+    assert (publisher.published, publisher.unheard) == (2, 1)
+
+
+def test_create_publisher(fake_redis):
+    assert isinstance(create_publisher(PUBSUB_OUTPUT, fake_redis), PubSubPublisher)
+    assert create_publisher(STREAM_OUTPUT, fake_redis, stream_maxlen=5).maxlen == 5
+    with pytest.raises(ValueError):
+        create_publisher("kafka", fake_redis)
+
+
+def test_listings_are_sharded_by_query():
+    assert ListingMessages().channel(7) == "listings"
+    assert ListingMessages(shard_by_query=True).channel(7) == "listings:7"
+    assert ListingMessages(shard_by_query=True).channel(None) == "listings"  # the query's ID isn't known
+
+
+def test_payloads():
+    full = ListingMessages().message(REQUEST_URL, 7, RESPONSE["listings"][:2])
+    assert full == {"request_url": REQUEST_URL, "query_id": 7, "new_listings": RESPONSE["listings"][:2]}
+
+    compact = ListingMessages(COMPACT_PAYLOAD).message(REQUEST_URL, 7, RESPONSE["listings"][:2])["new_listings"]
+    assert [listing["itemId"] for listing in compact] == [listing["itemId"] for listing in RESPONSE["listings"][:2]]
+    assert set(compact[0]) <= set(COMPACT_FIELDS)
+    assert compact[0]["priceInfo"] == RESPONSE["listings"][0]["priceInfo"]
+
+
+def test_details_payloads():
+    details = {**RESPONSE["listings"][0], "seller": {"name": "jan"}}
+
+    assert ListingMessages().details_message(REQUEST_URL, 7, "m1", details)["details"] == details
+    compact = ListingMessages(COMPACT_PAYLOAD).details_message(REQUEST_URL, 7, "m1", details)["details"]
+    assert "seller" not in compact and compact["description"] == details["description"]
+    assert ListingMessages(ID_ONLY_PAYLOAD).details_message(REQUEST_URL, 7, "m1", details) == {
+        "request_url": REQUEST_URL, "query_id": 7, "item_id": "m1"}
+    assert ListingMessages(shard_by_query=True).details_channel(7) == "listing_details:7"
+
+
+def test_id_only_payload_doesnt_parse_the_listings():
+    listings = parse_listings_lazily(BODY)
+    message = ListingMessages(ID_ONLY_PAYLOAD).message(REQUEST_URL, 7, listings[:3])
+
+    assert message["new_listings"] == [{"itemId": listing["itemId"]} for listing in RESPONSE["listings"][:3]]
+    assert all(listing._body is not None for listing in listings[:3])
@@ -0,0 +1,104 @@
+from src.marketplace_notifier.local_filters import compile_filter
+from src.marketplace_notifier.query_coalescing import QueryCoalescer, split_request_url
+
+SEARCH = ("https://www.2dehands.be/lrp/api/search?attributesByKey%5B%5D=Language%3Aall-languages&limit=100&offset=0"
+          "&sortBy=SORT_INDEX&sortOrder=DECREASING&viewOptions=list-view&query=fiets")
+CHEAP = SEARCH + "&attributeRanges%5B%5D=PriceCents%3Anull%3A10000"
+EXPENSIVE = SEARCH + "&attributeRanges%5B%5D=PriceCents%3A50000%3Anull"
+NEARBY = SEARCH + "&postcode=9000&distanceMeters=10000"
+OTHER = SEARCH.replace("query=fiets", "query=auto")
+
+
+def test_split_request_url():
+    assert split_request_url(CHEAP) == (SEARCH, compile_filter(max_price_cents=10000))
+    assert split_request_url(EXPENSIVE) == (SEARCH, compile_filter(min_price_cents=50000))
+    assert split_request_url(NEARBY) == (SEARCH + "&postcode=9000", compile_filter(max_distance_meters=10000))
+    assert split_request_url(SEARCH) == (SEARCH, compile_filter())
+
+
+def test_single_query_fetches_its_own_url():
+    coalescer = QueryCoalescer()
+
+    assert coalescer.add(CHEAP) == (None, CHEAP)
+    assert coalescer.subscribers(CHEAP) == {CHEAP: None}
+    assert coalescer.subscribers(SEARCH) == {}
+
+
+def test_overlapping_queries_share_a_fetch():
+    coalescer = QueryCoalescer()
+    coalescer.add(CHEAP)
+
+    assert coalescer.add(EXPENSIVE) == (CHEAP, SEARCH)
+    assert coalescer.add(SEARCH) == (SEARCH, SEARCH)
+    assert coalescer.add(OTHER) == (None, OTHER)
+    assert len(coalescer) == 2
+    assert set(coalescer.fetch_urls()) == {SEARCH, OTHER}
+    assert coalescer.subscribers(SEARCH) == {
+        CHEAP: compile_filter(max_price_cents=10000),
+        EXPENSIVE: compile_filter(min_price_cents=50000),
+        SEARCH: None,
+    }
+    assert coalescer.subscribers(CHEAP) == {}
+
+    assert coalescer.remove(SEARCH) == (SEARCH, SEARCH)
+    assert coalescer.remove(CHEAP) == (SEARCH, EXPENSIVE)
+    assert coalescer.subscribers(EXPENSIVE) == {EXPENSIVE: None}
+    assert coalescer.remove(EXPENSIVE) == (EXPENSIVE, None)
+    assert coalescer.remove(EXPENSIVE) == (None, None)
+    assert EXPENSIVE not in coalescer
+
+
+def test_disabled_coalescer_keeps_queries_apart():
+    coalescer = QueryCoalescer(enabled=False)
+    coalescer.add(CHEAP)
+    coalescer.add(EXPENSIVE)
+
+    assert len(coalescer) == 2
+    assert coalescer.subscribers(CHEAP) == {CHEAP: None}
+
+
+def test_split_group_fetches_every_query_on_its_own():
+    coalescer = QueryCoalescer()
+    coalescer.add(CHEAP)
+    coalescer.add(EXPENSIVE)
+    coalescer.add(OTHER)
+    assert coalescer.is_shared(SEARCH)
+    assert not coalescer.is_shared(OTHER)
+
+    assert coalescer.split(OTHER) == []
+    assert sorted(coalescer.split(SEARCH)) == sorted([CHEAP, EXPENSIVE])
+    assert set(coalescer.fetch_urls()) == {CHEAP, EXPENSIVE, OTHER}
+    assert coalescer.subscribers(SEARCH) == {}
+    assert coalescer.subscribers(CHEAP) == {CHEAP: None}
+
+    # a query added later doesn't bring the broader search back
+    assert coalescer.add(NEARBY) == (None, NEARBY)
+    assert not coalescer.is_shared(SEARCH)
+
+
+def test_split_group_is_shared_again_after_a_while(clock):
+    coalescer = QueryCoalescer(split_ttl=60, clock=clock)
+    coalescer.add(CHEAP)
+    coalescer.add(EXPENSIVE)
+    coalescer.split(SEARCH)
+    assert coalescer.add(SEARCH) == (None, SEARCH)
+
+    clock.now = 59
+    assert coalescer.rejoin_splits() == {}
+    assert set(coalescer.fetch_urls()) == {CHEAP, EXPENSIVE, SEARCH}
+
+    clock.now = 60
+    rejoined = coalescer.rejoin_splits()
+    assert rejoined.keys() == {SEARCH}
+    assert sorted(rejoined[SEARCH]) == sorted([CHEAP, EXPENSIVE, SEARCH])
+    assert set(coalescer.fetch_urls()) == {SEARCH}
+    assert coalescer.subscribers(SEARCH) == {
+        CHEAP: compile_filter(max_price_cents=10000),
+        EXPENSIVE: compile_filter(min_price_cents=50000),
+        SEARCH: None,
+    }
+    assert coalescer.subscribers(CHEAP) == {}
+    assert coalescer.rejoin_splits() == {}
+
+    # it's split again when it fails again
+    assert sorted(coalescer.split(SEARCH)) == sorted([CHEAP, EXPENSIVE, SEARCH])
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from tortoise import Tortoise
+
+from src.api import webserver
+from src.shared.constants import QUERY_SCHEDULE_KEY
+from src.shared.models import QueryInfo, QueryStatus
+
+QUERIES = 7
+FAILED_IDS = {2, 5}
+NOW = datetime.now().replace(microsecond=0)
+
+
+def request_url(i):
+    return f"https://www.2dehands.be/lrp/api/search?query=fiets+{i}"
+
+
+@pytest.fixture
+def redis(monkeypatch, fake_redis):
+    fake_redis.zsets[QUERY_SCHEDULE_KEY] = {request_url(i): NOW.timestamp()
+                                            for i in range(1, QUERIES + 1) if i not in FAILED_IDS}
+    monkeypatch.setattr(webserver.app, "redis", fake_redis)
+    return fake_redis
+
+
+def run(*paths):
+    """
+    :return: the (status code, body) of a GET of every path, against a DB with QUERIES QueryInfos
+    """
+    async def get_all():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["src.shared.models"]})
+        await Tortoise.generate_schemas()
+        try:
+            for i in range(1, QUERIES + 1):
+                await QueryInfo.create(id=i, browser_url=f"https://www.2dehands.be/q/fiets+{i}/",
+                                       request_url=request_url(i),
+                                       status=QueryStatus.FAILED if i in FAILED_IDS else QueryStatus.ACTIVE)
+            client = webserver.app.test_client()
+            responses = []
+            for path in paths:
+                response = await client.get(path)
+                responses.append((response.status_code, await response.get_json()))
+            return responses
+        finally:
+            await Tortoise.close_connections()
+
+    return asyncio.run(get_all())
+
+
+def test_without_arguments_all_queries_are_returned(redis):
+    [(status, body)] = run("/query")
+
+    assert status == 200
+    assert [query["id"] for query in body["queries"]] == list(range(1, QUERIES + 1))
+    assert body["next_cursor"] is None
+    assert body["queries"][0].keys() == set(webserver.QUERY_FIELDS)
+    assert body["queries"][0]["next_check_time"] is not None
+    assert body["queries"][1]["next_check_time"] is None  # FAILED, not scheduled
+
+
+def test_pages_follow_the_cursor(redis):
+    [(_, first), (_, second), (_, last)] = run("/query?limit=3", "/query?limit=3&cursor=3", "/query?limit=3&cursor=6")
+
+    assert [query["id"] for query in first["queries"]] == [1, 2, 3]
+    assert first["next_cursor"] == 3
+    assert [query["id"] for query in second["queries"]] == [4, 5, 6]
+    assert second["next_cursor"] == 6
+    assert [query["id"] for query in last["queries"]] == [7]
+    assert last["next_cursor"] is None
+
+
+def test_filter_by_status_and_project_fields(redis):
+    [(status, body), (_, with_schedule)] = run("/query?status=FAILED&fields=status,browser_url",
+                                               "/query?status=ACTIVE&limit=2&fields=next_check_time")
+
+    assert status == 200
+    assert body["queries"] == [{"status": "FAILED", "browser_url": f"https://www.2dehands.be/q/fiets+{i}/"}
+                               for i in sorted(FAILED_IDS)]
+    # the cursor works without the id field
+    assert with_schedule["next_cursor"] == 3
+    assert [query.keys() for query in with_schedule["queries"]] == [{"next_check_time"}] * 2
+    assert all(query["next_check_time"] is not None for query in with_schedule["queries"])
+
+
+def test_invalid_arguments_are_rejected(redis):
+    responses = run("/query?fields=id,password", "/query?limit=0", f"/query?limit={webserver.MAX_QUERY_PAGE_SIZE + 1}")
+
+    assert [status for status, _ in responses] == [400, 400, 400]
+    assert "password" in responses[0][1]["error"]
+
+
+def test_summary_counts_the_queries(redis):
+    [(status, body)] = run("/query/summary")
+
+    assert status == 200
+    assert body == {"total": QUERIES, "statuses": {"ACTIVE": QUERIES - len(FAILED_IDS), "FAILED": len(FAILED_IDS)},
+                    "scheduled": QUERIES - len(FAILED_IDS)}
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from src.shared import rate_limiter
+from src.shared.rate_limiter import EndpointLimit, RateGovernor, endpoint_class
+
+SEARCH_URL = "https://www.2dehands.be/lrp/api/search?query=fiets"
+ITEM_URL = "https://app.2dehands.be/app/vip/v4/item/m2154316958"
+
+
+@pytest.fixture(autouse=True)
+def rate_limiter_clock(clock, monkeypatch):
+    clock.now = 1_000.0
+    monkeypatch.setattr(rate_limiter.time, "time", clock.time)
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", clock.sleep)
+
+
+def test_endpoint_class():
+    assert endpoint_class(SEARCH_URL) == rate_limiter.SEARCH_ENDPOINT
+    assert endpoint_class(ITEM_URL) == rate_limiter.ITEM_ENDPOINT
+    assert endpoint_class("https://www.2dehands.be/") == rate_limiter.OTHER_ENDPOINT
+
+
+def test_requests_wait_for_a_token(clock):
+    governor = RateGovernor(limits={"search": EndpointLimit(rate=2, burst=2, min_rate=0.1)})
+
+    async def burst():
+        for _ in range(4):
+            await governor.acquire(SEARCH_URL)
+    asyncio.run(burst())
+
+    # 2 requests of the burst start right away, the others get a token every 0.5s
+    assert clock.sleeps == pytest.approx([0.5, 0.5])
+    assert governor._local_buckets.keys() == {"search"}
+
+
+def test_rate_backs_off_when_throttled_and_grows_back(clock):
+    limit = EndpointLimit(rate=2, burst=1, min_rate=0.5, increase_step=0.25, cooldown=10)
+    governor = RateGovernor(limits={"search": limit})
+
+    async def report(*statuses):
+        for status in statuses:
+            await governor.report(SEARCH_URL, status)
+
+    asyncio.run(report(429, 403))  # the second one is in the cooldown of the first one
+    assert governor._local_buckets["search"].rate == 1
+    asyncio.run(report(200))  # no increase in the cooldown either
+    assert governor._local_buckets["search"].rate == 1
+
+    clock.now += 10
+    asyncio.run(report(429, 200))
+    assert governor._local_buckets["search"].rate == 0.5  # never below min_rate
+    clock.now += 10
+    asyncio.run(report(200, 404, 200, 200, 200, 200, 200, 200))
+    assert governor._local_buckets["search"].rate == 2  # 404 doesn't count, never above the configured rate
+
+
+def test_item_not_found_yet_is_no_throttle(clock):
+    governor = RateGovernor()
+    asyncio.run(governor.report(ITEM_URL, 400))
+
+    assert "item" not in governor._local_buckets
+
+
+def test_falls_back_to_a_local_budget_without_redis(clock, fake_redis):
+    fake_redis.down = True
+    governor = RateGovernor(fake_redis, limits={"item": EndpointLimit(rate=1, burst=1, min_rate=0.1)})
+
+    async def requests():
+        await governor.acquire(ITEM_URL)
+        await governor.acquire(ITEM_URL)
+        await governor.report(ITEM_URL, 403)
+    asyncio.run(requests())
+
+    assert clock.sleeps == [1]
+    assert governor._local_buckets["item"].rate == 0.5
@@ -0,0 +1,62 @@
+import json
+
+from src.marketplace_notifier.lazy_listings import listings_fingerprint
+from src.shared.api_utils import ResponseFingerprints
+from tests.payloads import make_search_response
+
+URL = "https://www.2dehands.be/lrp/api/search?query=fiets"
+
+
+def _body(response) -> bytes:
+    return json.dumps(response, ensure_ascii=False).encode("utf-8")
+
+
+def test_listings_fingerprint_ignores_fields_outside_the_diff():
+    response = make_search_response(newest_item_id=2_000_000, seed=4)
+    changed = json.loads(json.dumps(response))
+    changed["correlationId"] = "something-else"
+    changed["listings"][5]["title"] = "an edited title"
+    changed["listings"][0]["itemId"] = "m123"  # the ads rotate
+
+    assert listings_fingerprint(_body(response)) == listings_fingerprint(_body(changed))
+
+
+def test_listings_fingerprint_changes_with_the_listings():
+    response = make_search_response(newest_item_id=2_000_000, seed=4)
+    newer = make_search_response(newest_item_id=2_000_001, seed=4)
+    promoted = json.loads(json.dumps(response))
+    promoted["listings"][10]["priorityProduct"] = "DAGTOPPER"
+    late = json.loads(json.dumps(response))  # e.g. a bumped listing, far below the top
+    late["listings"][-5]["itemId"] = "m1999999"
+
+    fingerprint = listings_fingerprint(_body(response))
+    assert fingerprint != listings_fingerprint(_body(newer))
+    assert fingerprint != listings_fingerprint(_body(promoted))
+    assert fingerprint != listings_fingerprint(_body(late))
+
+
+def test_listings_fingerprint_of_an_unknown_layout_covers_the_whole_body():
+    assert listings_fingerprint(b'{"results": []}') != listings_fingerprint(b'{"results": [1]}')
+
+
+def test_unchanged_response_is_detected():
+    fingerprints = ResponseFingerprints()
+
+    assert fingerprints.update(URL, b"page 1", {})
+    assert not fingerprints.update(URL, b"page 1", {})
+    assert fingerprints.update(URL, b"page 2", {})
+    assert fingerprints.conditional_headers(URL) == {}
+
+    fingerprints.discard(URL)
+    assert fingerprints.update(URL, b"page 2", {})
+
+
+def test_validators_are_sent_back():
+    fingerprints = ResponseFingerprints()
+    fingerprints.update(URL, b"page", {"etag": '"abc"', "last-modified": "Wed, 21 Oct 2026 07:28:00 GMT"})
+
+    assert fingerprints.conditional_headers(URL) == {
+        "if-none-match": '"abc"',
+        "if-modified-since": "Wed, 21 Oct 2026 07:28:00 GMT",
+    }
+    assert fingerprints.conditional_headers("https://www.2dehands.be/other") == {}
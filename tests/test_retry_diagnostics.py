@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from aiohttp import ClientResponseError, web
+
+from src.shared import json_codec
+from src.shared.api_utils import get_retry_client, get_request_response
+from src.shared.retry_diagnostics import RetryDiagnostics
+
+URL = "https://www.2dehands.be/lrp/api/search?query=fiets"
+
+
+def test_errors_are_bounded():
+    diagnostics = RetryDiagnostics(max_entries=2)
+    for i in range(10):
+        diagnostics.record_error(f"{URL}&page={i}", 403, "Forbidden")
+
+    assert len(diagnostics._last_errors) == 2
+    assert diagnostics.errors_by_status == {"403": 10}
+    assert diagnostics.record_retry(f"{URL}&page=9").status == 403
+    assert diagnostics.record_retry(f"{URL}&page=0") is None  # evicted
+    assert diagnostics.retries_by_status == {"403": 1, "exception": 1}
+
+
+def test_failures_keep_a_truncated_snippet():
+    diagnostics = RetryDiagnostics(snippet_length=10)
+    diagnostics.record_error(URL, 403, "Forbidden")
+    diagnostics.record_failure(URL, 403, "Forbidden", b"<html>" + b"x" * 10_000)
+
+    snapshot = diagnostics.snapshot()
+    assert snapshot["failures_by_status"] == {"403": 1}
+    assert snapshot["recent_failures"] == [{"url": URL, "status": 403, "reason": "Forbidden", "snippet": "<html>xxxx"}]
+    assert URL not in diagnostics._last_errors
+    json_codec.dumps(snapshot)
+
+
+async def _request_failing_endpoint():
+    calls = []
+
+    async def forbidden(request):
+        calls.append(request)
+        return web.Response(status=403, text="<html>" + "rate limited " * 1000 + "</html>")
+
+    app = web.Application()
+    app.router.add_get("/lrp/api/search", forbidden)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        async with get_retry_client() as client:
+            with pytest.raises(ClientResponseError):
+                await get_request_response(client, f"http://127.0.0.1:{port}/lrp/api/search")
+            return client.retry_diagnostics, len(calls)
+    finally:
+        await runner.cleanup()
+
+
+def test_final_failure_is_recorded_by_the_client():
+    diagnostics, calls = asyncio.run(_request_failing_endpoint())
+
+    assert calls == 1  # 403 isn't retried by default
+    failure = diagnostics.snapshot()["recent_failures"][0]
+    assert failure["status"] == 403
+    assert failure["snippet"].startswith("<html>rate limited")
+    assert len(failure["snippet"]) == diagnostics.snippet_length
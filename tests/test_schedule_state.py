@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.api import webserver
+from src.shared.constants import QUERY_SCHEDULE_KEY
+from src.shared.schedule_state import ScheduleStateWriter, get_next_check_times
+
+URL_1 = "https://www.2dehands.be/lrp/api/search?query=fiets"
+URL_2 = "https://www.2dehands.be/lrp/api/search?query=iphone"
+
+
+def test_flush_writes_the_last_update_per_query_at_once(fake_redis):
+    redis = fake_redis
+    writer = ScheduleStateWriter(redis)
+    now = datetime.now().replace(microsecond=0)
+
+    writer.set_next_check_time(URL_1, now)
+    writer.set_next_check_time(URL_1, now + timedelta(minutes=2))
+    writer.set_next_check_time(URL_2, now)
+    asyncio.run(writer.flush())
+
+    assert redis.round_trips == 1
+    assert len(writer) == 0
+    assert asyncio.run(get_next_check_times(redis, [URL_1, URL_2, "unknown"])) == {
+        URL_1: now + timedelta(minutes=2), URL_2: now, "unknown": None}
+
+    round_trips = redis.round_trips
+    writer.remove(URL_2)
+    asyncio.run(writer.flush())
+    assert redis.zsets[QUERY_SCHEDULE_KEY].keys() == {URL_1}
+
+    # nothing to write, no round trip
+    asyncio.run(writer.flush())
+    assert redis.round_trips == round_trips + 1
+
+
+def test_failed_flush_is_retried_without_overwriting_newer_updates(fake_redis):
+    redis = fake_redis
+    writer = ScheduleStateWriter(redis)
+    now = datetime.now()
+    writer.set_next_check_time(URL_1, now)
+    writer.set_next_check_time(URL_2, now)
+
+    redis.down = True
+    with pytest.raises(ConnectionError):
+        asyncio.run(writer.flush())
+    writer.remove(URL_2)  # while Redis was down
+    assert asyncio.run(get_next_check_times(redis, [URL_1])) is None
+
+    redis.down = False
+    asyncio.run(writer.flush())
+    assert redis.zsets[QUERY_SCHEDULE_KEY] == {URL_1: now.timestamp()}
+
+
+def test_rewrite_drops_the_queries_which_are_not_scheduled_anymore(fake_redis):
+    redis = fake_redis
+    now = datetime.now()
+    # e.g. URL_2 was deleted while the notifier wasn't running
+    redis.zsets[QUERY_SCHEDULE_KEY] = {URL_1: 1.0, URL_2: 1.0}
+    writer = ScheduleStateWriter(redis)
+    writer.set_next_check_time(URL_1, now)
+
+    asyncio.run(writer.rewrite())
+    assert redis.zsets[QUERY_SCHEDULE_KEY] == {URL_1: now.timestamp()}
+    assert redis.round_trips == 1
+
+    asyncio.run(ScheduleStateWriter(redis).rewrite())
+    assert QUERY_SCHEDULE_KEY not in redis.zsets
+
+
+def test_webserver_fills_in_the_schedule(monkeypatch, fake_redis):
+    redis = fake_redis
+    monkeypatch.setattr(webserver.app, "redis", redis)
+    now = datetime.now().replace(microsecond=0)
+    redis.zsets[QUERY_SCHEDULE_KEY] = {URL_1: now.timestamp()}
+    stale = now - timedelta(days=1)
+    queries = [{"request_url": URL_1, "next_check_time": stale},
+               {"request_url": URL_2, "next_check_time": stale}]
+
+    assert [query["next_check_time"] for query in asyncio.run(webserver.with_schedule(queries))] == [now, None]
+
+    # the DB value is kept when Redis is unavailable
+    redis.down = True
+    queries = [{"request_url": URL_1, "next_check_time": stale}]
+    assert asyncio.run(webserver.with_schedule(queries))[0]["next_check_time"] == stale
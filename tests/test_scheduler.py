@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+from src.marketplace_notifier.scheduler import QuerySchedule
+
+NOW = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def test_pop_due_returns_due_urls_earliest_first():
+    schedule = QuerySchedule()
+    schedule.schedule("c", NOW + timedelta(seconds=30))
+    schedule.schedule("a", NOW - timedelta(seconds=10))
+    schedule.schedule("b", NOW)
+
+    assert schedule.pop_due(NOW) == ["a", "b"]
+    assert len(schedule) == 1
+    assert schedule.next_time() == NOW + timedelta(seconds=30)
+
+
+def test_rescheduling_replaces_previous_time():
+    schedule = QuerySchedule()
+    schedule.schedule("a", NOW)
+    schedule.schedule("a", NOW + timedelta(seconds=60))
+
+    assert schedule.pop_due(NOW) == []
+    assert schedule.get("a") == NOW + timedelta(seconds=60)
+    assert schedule.pop_due(NOW + timedelta(seconds=60)) == ["a"]
+
+
+def test_removed_url_is_never_popped():
+    schedule = QuerySchedule()
+    schedule.schedule("a", NOW)
+    schedule.schedule("b", NOW + timedelta(seconds=1))
+
+    assert schedule.remove("a")
+    assert not schedule.remove("a")
+    assert "a" not in schedule
+    assert schedule.next_time() == NOW + timedelta(seconds=1)
+    assert schedule.pop_due(NOW + timedelta(seconds=5)) == ["b"]
+    assert schedule.next_time() is None
+
+
+def test_upcoming_skips_stale_entries():
+    schedule = QuerySchedule()
+    for i in range(10):
+        schedule.schedule(f"url{i}", NOW + timedelta(seconds=i))
+    schedule.schedule("url0", NOW + timedelta(seconds=100))
+    schedule.remove("url1")
+
+    assert [url for url, _ in schedule.upcoming(3)] == ["url2", "url3", "url4"]
+
+
+def test_heap_is_compacted_after_many_reschedules():
+    schedule = QuerySchedule()
+    for i in range(1000):
+        schedule.schedule("a", NOW + timedelta(seconds=i))
+
+    assert len(schedule) == 1
+    assert len(schedule._heap) < 100
+    assert schedule.pop_due(NOW + timedelta(seconds=999)) == ["a"]
+
+
+def test_latest_time_follows_the_scheduled_entries():
+    schedule = QuerySchedule()
+    assert schedule.latest_time is None
+    schedule.schedule("a", NOW)
+    schedule.schedule("b", NOW + timedelta(seconds=60))
+    assert schedule.latest_time == NOW + timedelta(seconds=60)
+
+    schedule.remove("b")
+    assert schedule.latest_time == NOW
+    schedule.schedule("b", NOW + timedelta(seconds=30))
+    schedule.schedule("b", NOW + timedelta(seconds=10))  # rescheduled earlier
+    assert schedule.latest_time == NOW + timedelta(seconds=10)
+
+    assert schedule.pop_due(NOW + timedelta(seconds=10)) == ["a", "b"]
+    assert schedule.latest_time is None